@@ -2,17 +2,28 @@ import os
 import uuid
 import json
 import time
+import asyncio
+import threading
 from fastapi import FastAPI, Request, File, UploadFile, Form, HTTPException, Depends
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
 from pydantic import BaseModel
-from models.indexer import index_documents
-from models.retriever import retrieve_documents
-from models.responder import generate_response
+from starlette.concurrency import run_in_threadpool
+from models.encoders import load_index, index_is_stale
+from models.indexer import indexed_documents
+from models.retriever import retrieve_documents, invalidate_session
+from models.responder import generate_response, generate_response_stream, generation_backends
+from models.model_loader import measure_import_costs
+from models.cache import SessionIndexCache
+from models.executors import BoundedExecutor, ExecutorSaturatedError
+from models.jobs import IndexingJobQueue, QueueFullError
+from models import session_store
+from models.page_store import register_reference_source
+from models.metrics import CONTENT_TYPE, register_queue, render_metrics
+from models.warmup import start_warmup, is_ready, readiness
 from logger import get_logger
-from byaldi import RAGMultiModalModel
 import re
 from pathlib import Path
 # Initialize FastAPI app
@@ -37,8 +48,64 @@ SESSION_FOLDER = "sessions"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(SESSION_FOLDER, exist_ok=True)
 
-# Cache for RAG models
-RAG_models = {}
+# Blocking work runs on bounded executors so it never stalls the event loop.
+# Local backends share one device, so they get few workers; remote ones mostly wait on I/O.
+LOCAL_BACKENDS = ('qwen', 'llama-vision', 'pixtral', 'molmo')
+LOCAL_GENERATION_WORKERS = int(os.getenv('LOCAL_GENERATION_WORKERS', os.getenv('GENERATION_BATCH_SIZE', 4)))
+REMOTE_GENERATION_WORKERS = int(os.getenv('REMOTE_GENERATION_WORKERS', 16))
+GENERATION_QUEUE_DEPTH = int(os.getenv('GENERATION_QUEUE_DEPTH', 64))
+RETRIEVAL_WORKERS = int(os.getenv('RETRIEVAL_WORKERS', 4))
+RETRIEVAL_QUEUE_DEPTH = int(os.getenv('RETRIEVAL_QUEUE_DEPTH', 64))
+
+retrieval_executor = BoundedExecutor('retrieval', RETRIEVAL_WORKERS, RETRIEVAL_QUEUE_DEPTH)
+register_queue(retrieval_executor.name, retrieval_executor.depth)
+_generation_executors = {}
+
+def check_model_choice(model_choice: str):
+    """
+    Rejects a model_choice that names no backend, before it is used to pick
+    an executor or label metrics.
+    """
+    if model_choice not in generation_backends():
+        raise HTTPException(status_code=400, detail=f"Unknown model_choice '{model_choice}'. "
+                                                    f"Available: {', '.join(generation_backends())}")
+
+def generation_executor(model_choice: str) -> BoundedExecutor:
+    """
+    Returns the executor that bounds concurrent generations for a backend.
+    Callers validate model_choice first with check_model_choice.
+    """
+    executor = _generation_executors.get(model_choice)
+    if executor is None:
+        workers = LOCAL_GENERATION_WORKERS if model_choice in LOCAL_BACKENDS else REMOTE_GENERATION_WORKERS
+        executor = _generation_executors.setdefault(
+            model_choice, BoundedExecutor(f"generation-{model_choice}", workers, GENERATION_QUEUE_DEPTH))
+        register_queue(executor.name, executor.depth)
+    return executor
+
+async def run_bounded(executor: BoundedExecutor, fn, *args, **kwargs):
+    """
+    Runs a blocking call on a bounded executor, answering 429 when it is saturated.
+    """
+    try:
+        future = executor.submit(fn, *args, **kwargs)
+    except ExecutorSaturatedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return await asyncio.wrap_future(future)
+
+# Background indexing
+indexing_jobs = IndexingJobQueue(
+    max_workers=int(os.getenv('INDEXING_WORKERS', 1)),
+    max_pending=int(os.getenv('INDEXING_MAX_PENDING', 16))
+)
+register_queue('indexing', indexing_jobs.pending)
+
+# Pages shown in saved chat histories are never collected from the page store
+register_reference_source('chat history', lambda: session_store.referenced_images(SESSION_FOLDER))
+
+# Opt-in report of the cold import cost of each generation backend
+if os.getenv('REPORT_IMPORT_COSTS'):
+    measure_import_costs()
 
 
 def secure_filename(filename: str) -> str:
@@ -52,13 +119,46 @@ def load_rag_model_for_session(session_id: str):
     index_path = os.path.join(INDEX_FOLDER, session_id)
     if os.path.exists(index_path):
         try:
-            RAG = RAGMultiModalModel.from_index(index_path)
-            RAG_models[session_id] = RAG
-            logger.info(f"RAG model for session {session_id} loaded from index.")
+            RAG = load_index(index_path)
+            logger.info("RAG model for session %s loaded from index.", session_id)
+            return RAG
         except Exception as e:
-            logger.error(f"Error loading RAG model for session {session_id}: {e}")
+            logger.error("Error loading RAG model for session %s: %s", session_id, e)
     else:
-        logger.error(f"Index path {index_path} does not exist.")
+        logger.error("Index path %s does not exist.", index_path)
+    return None
+
+# LRU cache of RAG models per session, loaded lazily on first access
+RAG_models = SessionIndexCache(
+    load_rag_model_for_session,
+    max_entries=int(os.getenv('INDEX_CACHE_MAX_ENTRIES', 32)),
+    max_bytes=int(os.getenv('INDEX_CACHE_MAX_BYTES', 8 * 1024 ** 3)),
+    # Picks up versions published by indexing jobs in other workers
+    is_stale=lambda session_id, RAG: index_is_stale(RAG, os.path.join(INDEX_FOLDER, session_id))
+)
+
+def session_id_for(request: Request) -> str:
+    if 'session_id' not in request.session:
+        request.session['session_id'] = str(uuid.uuid4())
+    return request.session['session_id']
+
+def save_chat_exchange(session_id: str, query: str, response: str, images: list):
+    """
+    Appends a query and its answer to the session's chat history.
+    """
+    message_count = session_store.append_messages(session_id, [
+        {"role": "user", "content": query},
+        {"role": "assistant", "content": response, "images": images}
+    ], folder=SESSION_FOLDER)
+    # Name the session after its first question
+    if message_count == 2:
+        session_store.update_session_meta(session_id, folder=SESSION_FOLDER, session_name=query[:50])
+
+async def get_session_index(session_id: str):
+    RAG = await run_bounded(retrieval_executor, RAG_models.get_or_load, session_id)
+    if RAG is None:
+        raise HTTPException(status_code=404, detail="No index found for this session")
+    return RAG
 
 # Routes
 
@@ -66,66 +166,165 @@ def load_rag_model_for_session(session_id: str):
 async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 @app.post("/upload")
-async def upload_file(file: UploadFile):
+async def upload_file(request: Request, file: UploadFile):
     try:
         # Sanitize filename
         filename = secure_filename(file.filename)
         
-        # Define the file path where the file will be saved
-        file_location = Path(UPLOAD_FOLDER) / filename
+        # Define the file path where the file will be saved, in the session's document folder
+        session_folder = Path(UPLOAD_FOLDER) / session_id_for(request)
+        session_folder.mkdir(parents=True, exist_ok=True)
+        file_location = session_folder / filename
         
         # Save the file
-        with open(file_location, "wb") as f:
-            f.write(await file.read())
+        data = await file.read()
+        await run_in_threadpool(file_location.write_bytes, data)
 
         return {"info": f"File '{filename}' uploaded successfully."}
     except Exception as e:
-        logger.error(f"Error uploading file: {e}")
+        logger.error("Error uploading file: %s", e)
         raise HTTPException(status_code=500, detail="Error uploading file")
 
 @app.get("/new_session")
 async def new_session(request: Request):
     session_id = str(uuid.uuid4())
     request.session['session_id'] = session_id
-    session_files = os.listdir(SESSION_FOLDER)
-    session_number = len([f for f in session_files if f.endswith('.json')]) + 1
-    session_name = f"Session {session_number}"
-    
-    session_file = os.path.join(SESSION_FOLDER, f"{session_id}.json")
-    session_data = {
-        'session_name': session_name,
-        'chat_history': [],
-        'indexed_files': []
-    }
-    with open(session_file, 'w') as f:
-        json.dump(session_data, f)
+    session_name = await run_in_threadpool(session_store.next_session_name, SESSION_FOLDER)
+    await run_in_threadpool(session_store.create_session, session_id, session_name, SESSION_FOLDER)
 
     return {"info": "New session started", "session_id": session_id}
 
+@app.on_event("startup")
+async def preload():
+    # Preload models and indexes and run the warm-up query off the event loop; /readyz answers 503 until done
+    start_warmup(RAG_models.get_or_load, SESSION_FOLDER)
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    return JSONResponse(readiness(), status_code=200 if is_ready() else 503)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+@app.get("/sessions")
+async def list_sessions(offset: int = 0, limit: int = 50):
+    limit = min(limit, 500)
+    sessions = await run_in_threadpool(session_store.list_sessions, SESSION_FOLDER, offset, limit)
+    total = await run_in_threadpool(session_store.count_sessions, SESSION_FOLDER)
+    return {"success": True, "sessions": sessions, "total": total, "offset": offset, "limit": limit}
+
 @app.get("/get_indexed_files/{session_id}")
 async def get_indexed_files(session_id: str):
-    session_file = os.path.join(SESSION_FOLDER, f"{session_id}.json")
-    if os.path.exists(session_file):
-        with open(session_file, 'r') as f:
-            session_data = json.load(f)
-        indexed_files = session_data.get('indexed_files', [])
-        return {"success": True, "indexed_files": indexed_files}
+    meta = await run_in_threadpool(session_store.load_session_meta, session_id, SESSION_FOLDER)
+    if meta is not None:
+        return {"success": True, "indexed_files": meta.get('indexed_files', [])}
     else:
         raise HTTPException(status_code=404, detail="Session not found")
 
-@app.post("/index_documents")
-async def index_documents_endpoint(session_id: str):
-    load_rag_model_for_session(session_id)
-    index_documents(session_id)
-    return {"info": f"Documents indexed for session {session_id}"}
+@app.post("/index_documents", status_code=202)
+async def index_documents_endpoint(request: Request):
+    session_id = session_id_for(request)
+    session_folder = os.path.join(UPLOAD_FOLDER, session_id)
+    if not os.path.isdir(session_folder):
+        raise HTTPException(status_code=404, detail="No uploaded documents for this session")
+
+    def on_indexed(job, RAG):
+        # Swap the new index version in; cached results of the old one no longer apply
+        RAG_models.put(job.session_id, RAG)
+        invalidate_session(job.session_id)
+        # The documents the index covers, not conversion state or the PDFs generated from them
+        session_store.add_indexed_files(job.session_id, indexed_documents(session_folder, job.index_path),
+                                        folder=SESSION_FOLDER)
+
+    try:
+        job = indexing_jobs.submit(session_id, session_folder, os.path.join(INDEX_FOLDER, session_id),
+                                   request.session.get('indexer_model', 'vidore/colpali'), on_complete=on_indexed)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return {"info": f"Indexing queued for session {session_id}", "job_id": job.job_id}
+
+@app.get("/index_jobs/{job_id}")
+async def index_job_status(job_id: str):
+    job = indexing_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+class QueryRequest(BaseModel):
+    query: str
+    model_choice: str = 'qwen'
+    resized_height: int = 280
+    resized_width: int = 280
+    k: int = 3
 
 @app.post("/generate_response")
-async def generate_response_endpoint(request: Request):
-    session_id = request.session.get('session_id')
-    if session_id not in RAG_models:
-        load_rag_model_for_session(session_id)
-    response = generate_response(session_id)
-    return {"response": response}
+async def generate_response_endpoint(request: Request, body: QueryRequest):
+    check_model_choice(body.model_choice)
+    session_id = session_id_for(request)
+    RAG = await get_session_index(session_id)
+    images = await run_bounded(retrieval_executor, retrieve_documents, RAG, body.query, session_id, body.k)
+    response = await run_bounded(generation_executor(body.model_choice), generate_response, images, body.query,
+                                 session_id, body.resized_height, body.resized_width, body.model_choice)
+    await run_in_threadpool(save_chat_exchange, session_id, body.query, response, images)
+    return {"response": response, "images": images}
+
+@app.post("/generate_response/stream")
+async def generate_response_stream_endpoint(request: Request, body: QueryRequest):
+    """
+    Streams the answer to a query as Server-Sent Events: 'images', then
+    'token' events as text is generated, then 'done'.
+    """
+    check_model_choice(body.model_choice)
+    session_id = session_id_for(request)
+    RAG = await get_session_index(session_id)
+    images = await run_bounded(retrieval_executor, retrieve_documents, RAG, body.query, session_id, body.k)
+
+    # The generator runs on the backend's executor and hands chunks to the event loop
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    done = object()
+
+    # Set when the client goes away, so generation stops instead of running to the end
+    disconnected = threading.Event()
+
+    def produce():
+        try:
+            for text in generate_response_stream(images, body.query, session_id, body.resized_height,
+                                                 body.resized_width, body.model_choice, stop_event=disconnected):
+                if disconnected.is_set():
+                    break
+                loop.call_soon_threadsafe(chunks.put_nowait, text)
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, done)
+
+    try:
+        generation_executor(body.model_choice).submit(produce)
+    except ExecutorSaturatedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    async def events():
+        yield f"event: images\ndata: {json.dumps({'images': images})}\n\n"
+        texts = []
+        try:
+            while True:
+                text = await chunks.get()
+                if text is done:
+                    break
+                texts.append(text)
+                yield f"event: token\ndata: {json.dumps({'text': text})}\n\n"
+        finally:
+            # Reached on cancellation or close when the client disconnects
+            disconnected.set()
+        await run_in_threadpool(save_chat_exchange, session_id, body.query, ''.join(texts), images)
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # Run FastAPI app
 if __name__ == "__main__":
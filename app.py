@@ -2,14 +2,23 @@ import os
 import uuid
 import json
 import time  # Add this import at the top of the file
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from contextlib import closing
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify, stream_with_context, send_from_directory, abort
 from markupsafe import Markup
-from models.indexer import index_documents
-from models.retriever import retrieve_documents
-from models.responder import generate_response
+from models.indexer import index_documents, delete_index
+from models.encoders import load_index, index_is_stale
+from models.retriever import retrieve_documents, invalidate_session, cache_stats
+from models.responder import generate_response, generate_response_stream, generation_backends
+from models.model_loader import measure_import_costs, model_cache_stats, model_precisions
+from models.cache import SessionIndexCache
+from models.vision_cache import vision_cache_stats
+from models.page_store import register_reference_source, PAGE_STORE_FOLDER, INDEXED_PAGE_FOLDER, THUMBNAIL_FOLDER, THUMBNAIL_SIZES, make_thumbnail
+from models.jobs import IndexingJobQueue, QueueFullError
+from models import session_store
+from models.metrics import CONTENT_TYPE, register_queue, render_metrics
+from models.warmup import start_warmup, is_ready, readiness
 from werkzeug.utils import secure_filename
 from logger import get_logger
-from byaldi import RAGMultiModalModel
 import markdown
 
 # Set the TOKENIZERS_PARALLELISM environment variable to suppress warnings
@@ -25,6 +34,10 @@ logger = get_logger(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploaded_documents'
 app.config['STATIC_FOLDER'] = 'static'
 app.config['SESSION_FOLDER'] = 'sessions'
+# Number of recent messages rendered on the chat page (0 renders the whole history)
+app.config['CHAT_HISTORY_LIMIT'] = int(os.getenv('CHAT_HISTORY_LIMIT', 0)) or None
+# Number of sessions listed per page in the sidebar
+app.config['SESSION_LIST_PAGE_SIZE'] = int(os.getenv('SESSION_LIST_PAGE_SIZE', 50))
 app.config['INDEX_FOLDER'] = os.path.join(os.getcwd(), '.byaldi')  # Set to .byaldi folder in current directory
 
 # Create necessary directories if they don't exist
@@ -32,49 +45,90 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['STATIC_FOLDER'], exist_ok=True)
 os.makedirs(app.config['SESSION_FOLDER'], exist_ok=True)
 
-# Initialize global variables
-RAG_models = {}  # Dictionary to store RAG models per session
-app.config['INITIALIZATION_DONE'] = False  # Flag to track initialization
-logger.info("Application started.")
+# Bounds for the cache of loaded session indexes
+app.config['INDEX_CACHE_MAX_ENTRIES'] = int(os.getenv('INDEX_CACHE_MAX_ENTRIES', 32))
+app.config['INDEX_CACHE_MAX_BYTES'] = int(os.getenv('INDEX_CACHE_MAX_BYTES', 8 * 1024 ** 3))
 
 def load_rag_model_for_session(session_id):
     """
     Loads the RAG model for the given session_id from the index on disk.
+
+    Returns:
+        RAGMultiModalModel: The loaded model, or None if there is no usable index.
     """
     index_path = os.path.join(app.config['INDEX_FOLDER'], session_id)
 
     if os.path.exists(index_path):
         try:
-            RAG = RAGMultiModalModel.from_index(index_path)
-            RAG_models[session_id] = RAG
-            logger.info(f"RAG model for session {session_id} loaded from index.")
+            RAG = load_index(index_path)
+            logger.info("RAG model for session %s loaded from index.", session_id)
+            return RAG
         except Exception as e:
-            logger.error(f"Error loading RAG model for session {session_id}: {e}")
+            logger.error("Error loading RAG model for session %s: %s", session_id, e)
     else:
-        logger.warning(f"No index found for session {session_id}.")
+        logger.warning("No index found for session %s.", session_id)
+    return None
+
+# LRU cache of RAG models per session, loaded lazily on first access
+RAG_models = SessionIndexCache(
+    load_rag_model_for_session,
+    max_entries=app.config['INDEX_CACHE_MAX_ENTRIES'],
+    max_bytes=app.config['INDEX_CACHE_MAX_BYTES'],
+    # Picks up versions published by indexing jobs in other workers
+    is_stale=lambda session_id, RAG: index_is_stale(RAG, os.path.join(app.config['INDEX_FOLDER'], session_id))
+)
+
+# Background indexing; each finished job swaps its session's new index into RAG_models
+app.config['INDEXING_WORKERS'] = int(os.getenv('INDEXING_WORKERS', 1))
+app.config['INDEXING_MAX_PENDING'] = int(os.getenv('INDEXING_MAX_PENDING', 16))
+indexing_jobs = IndexingJobQueue(
+    max_workers=app.config['INDEXING_WORKERS'],
+    max_pending=app.config['INDEXING_MAX_PENDING']
+)
+register_queue('indexing', indexing_jobs.pending)
+
+# Pages shown in saved chat histories are never collected from the page store
+register_reference_source('chat history', lambda: session_store.referenced_images(app.config['SESSION_FOLDER']))
+
+# Opt-in report of the cold import cost of each generation backend
+if os.getenv('REPORT_IMPORT_COSTS'):
+    measure_import_costs()
+
+# Preload models and indexes and run the warm-up query in the background; /readyz
+# answers 503 until it finishes. Under the debug reloader only the serving child warms up.
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    start_warmup(RAG_models.get_or_load, app.config['SESSION_FOLDER'])
+logger.info("Application started.")
 
-def load_existing_indexes():
+def save_chat_exchange(session_id, query, parsed_response, retrieved_images):
     """
-    Loads all existing indexes from the .byaldi folder when the application starts.
+    Appends a user query and the assistant's answer to the session's chat history.
     """
-    global RAG_models
-    if os.path.exists(app.config['INDEX_FOLDER']):
-        for session_id in os.listdir(app.config['INDEX_FOLDER']):
-            if os.path.isdir(os.path.join(app.config['INDEX_FOLDER'], session_id)):
-                load_rag_model_for_session(session_id)
-    else:
-        logger.warning("No .byaldi folder found. No existing indexes to load.")
+    message_count = session_store.append_messages(session_id, [
+        {"role": "user", "content": query},
+        {
+            "role": "assistant",
+            "content": parsed_response,
+            "images": retrieved_images  # Keep relative paths for frontend
+        }
+    ], folder=app.config['SESSION_FOLDER'])
+
+    # Update session name if it's the first message
+    if message_count == 2:  # First user message and AI response
+        session_store.update_session_meta(session_id, folder=app.config['SESSION_FOLDER'],
+                                          session_name=query[:50])  # Truncate to 50 characters
+
+def thumbnails_of(retrieved_images, size=THUMBNAIL_SIZES[0]):
+    """
+    Returns the URLs of the thumbnails of retrieved pages, for display in chat messages.
+    """
+    return [url_for('page_thumbnail', size=size, page=img) for img in retrieved_images]
 
-@app.before_request
-def initialize_app():
+def sse_event(event, data):
     """
-    Initializes the application by loading existing indexes.
-    This will run before the first request, but only once.
+    Formats a Server-Sent Event with a JSON payload.
     """
-    if not app.config['INITIALIZATION_DONE']:
-        load_existing_indexes()
-        app.config['INITIALIZATION_DONE'] = True
-        logger.info("Application initialized and indexes loaded.")
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @app.before_request
 def make_session_permanent():
@@ -93,15 +147,15 @@ def chat():
         session['session_id'] = str(uuid.uuid4())
 
     session_id = session['session_id']
-    session_file = os.path.join(app.config['SESSION_FOLDER'], f"{session_id}.json")
-
-    # Load session data from file
-    if os.path.exists(session_file):
-        with open(session_file, 'r') as f:
-            session_data = json.load(f)
-            chat_history = session_data.get('chat_history', [])
-            session_name = session_data.get('session_name', 'Untitled Session')
-            indexed_files = session_data.get('indexed_files', [])
+
+    # Load session data; POSTs only need the metadata, not the chat history
+    history_limit = 0 if request.method == 'POST' else app.config['CHAT_HISTORY_LIMIT']
+    session_data = session_store.load_session(session_id, history_limit=history_limit,
+                                              folder=app.config['SESSION_FOLDER'])
+    if session_data is not None:
+        chat_history = session_data['chat_history']
+        session_name = session_data['session_name']
+        indexed_files = session_data['indexed_files']
     else:
         chat_history = []
         session_name = 'Untitled Session'
@@ -120,36 +174,33 @@ def chat():
                     file_path = os.path.join(session_folder, filename)
                     file.save(file_path)
                     uploaded_files.append(filename)
-                    logger.info(f"File saved: {file_path}")
+                    logger.info("File saved: %s", file_path)
             
             if uploaded_files:
+                index_name = session_id
+                index_path = os.path.join(app.config['INDEX_FOLDER'], index_name)
+                indexer_model = session.get('indexer_model', 'vidore/colpali')
+
+                def on_indexed(job, RAG):
+                    # Swap the new index version in and record the files once it is live
+                    RAG_models.put(job.session_id, RAG)
+                    invalidate_session(job.session_id)
+                    session_store.add_indexed_files(job.session_id, uploaded_files, session_name,
+                                                    folder=app.config['SESSION_FOLDER'])
+
                 try:
-                    index_name = session_id
-                    index_path = os.path.join(app.config['INDEX_FOLDER'], index_name)
-                    indexer_model = session.get('indexer_model', 'vidore/colpali')
-                    RAG = index_documents(session_folder, index_name=index_name, index_path=index_path, indexer_model=indexer_model)
-                    if RAG is None:
-                        raise ValueError("Indexing failed: RAG model is None")
-                    RAG_models[session_id] = RAG
-                    session['index_name'] = index_name
-                    session['session_folder'] = session_folder
-                    indexed_files.extend(uploaded_files)
-                    session_data = {
-                        'session_name': session_name,
-                        'chat_history': chat_history,
-                        'indexed_files': indexed_files
-                    }
-                    with open(session_file, 'w') as f:
-                        json.dump(session_data, f)
-                    logger.info("Documents indexed successfully.")
-                    return jsonify({
-                        "success": True, 
-                        "message": "Files indexed successfully.",
-                        "indexed_files": indexed_files
-                    })
-                except Exception as e:
-                    logger.error(f"Error indexing documents: {str(e)}")
-                    return jsonify({"success": False, "message": f"Error indexing files: {str(e)}"})
+                    job = indexing_jobs.submit(session_id, session_folder, index_path, indexer_model, on_complete=on_indexed)
+                except QueueFullError as e:
+                    logger.warning("Indexing request rejected: %s", e)
+                    return jsonify({"success": False, "message": str(e)}), 429
+                session['index_name'] = index_name
+                session['session_folder'] = session_folder
+                return jsonify({
+                    "success": True,
+                    "message": "Indexing started.",
+                    "job_id": job.job_id,
+                    "indexed_files": indexed_files
+                })
             else:
                 return jsonify({"success": False, "message": "No files were uploaded."})
 
@@ -162,13 +213,13 @@ def chat():
                 resized_width = session.get('resized_width', 280)
                 
                 # Retrieve relevant documents
-                rag_model = RAG_models.get(session_id)
+                rag_model = RAG_models.get_or_load(session_id)
                 if rag_model is None:
-                    logger.error(f"RAG model not found for session {session_id}")
+                    logger.error("RAG model not found for session %s", session_id)
                     return jsonify({"success": False, "message": "RAG model not found for this session."})
                 
                 retrieved_images = retrieve_documents(rag_model, query, session_id)
-                logger.info(f"Retrieved images: {retrieved_images}")
+                logger.info("Retrieved images: %s", retrieved_images)
                 
                 # Generate response with full image paths
                 full_image_paths = [os.path.join(app.static_folder, img) for img in retrieved_images]
@@ -177,30 +228,13 @@ def chat():
                 # Parse markdown in the response
                 parsed_response = Markup(markdown.markdown(response))
 
-                # Update chat history
-                chat_history.append({"role": "user", "content": query})
-                chat_history.append({
-                    "role": "assistant", 
-                    "content": parsed_response, 
-                    "images": retrieved_images  # Keep relative paths for frontend
-                })
-                
-                # Update session name if it's the first message
-                if len(chat_history) == 2:  # First user message and AI response
-                    session_name = query[:50]  # Truncate to 50 characters
-                
-                session_data = {
-                    'session_name': session_name,
-                    'chat_history': chat_history,
-                    'indexed_files': indexed_files
-                }
-                with open(session_file, 'w') as f:
-                    json.dump(session_data, f)
-                
+                save_chat_exchange(session_id, query, parsed_response, retrieved_images)
+
                 # Render the new messages
                 new_messages_html = render_template('chat_messages.html', messages=[
                     {"role": "user", "content": query},
-                    {"role": "assistant", "content": parsed_response, "images": retrieved_images}
+                    {"role": "assistant", "content": parsed_response, "images": retrieved_images,
+                     "thumbnails": thumbnails_of(retrieved_images)}
                 ])
                 
                 return jsonify({
@@ -208,19 +242,13 @@ def chat():
                     "html": new_messages_html
                 })
             except Exception as e:
-                logger.error(f"Error generating response: {e}")
+                logger.error("Error generating response: %s", e)
                 return jsonify({"success": False, "message": f"An error occurred while generating the response: {str(e)}"})
 
     # For GET requests, render the chat page
-    session_files = os.listdir(app.config['SESSION_FOLDER'])
-    chat_sessions = []
-    for file in session_files:
-        if file.endswith('.json'):
-            s_id = file[:-5]
-            with open(os.path.join(app.config['SESSION_FOLDER'], file), 'r') as f:
-                data = json.load(f)
-                name = data.get('session_name', 'Untitled Session')
-                chat_sessions.append({'id': s_id, 'name': name})
+    # The sidebar shows the most recently updated sessions; older ones are paged in from /sessions
+    chat_sessions = session_store.list_sessions(app.config['SESSION_FOLDER'],
+                                                limit=app.config['SESSION_LIST_PAGE_SIZE'])
 
     model_choice = session.get('model', 'qwen')
     resized_height = session.get('resized_height', 280)
@@ -231,11 +259,74 @@ def chat():
                            resized_height=resized_height, resized_width=resized_width,
                            session_name=session_name, indexed_files=indexed_files)
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Answers a query as a Server-Sent Events stream: an 'images' event with the
+    retrieved pages, 'token' events as text is generated, then 'done' with the
+    rendered message once it has been saved to the session.
+    """
+    session_id = session['session_id']
+    query = request.form.get('query', '')
+    generation_model = session.get('generation_model', 'qwen')
+    resized_height = session.get('resized_height', 280)
+    resized_width = session.get('resized_width', 280)
+
+    rag_model = RAG_models.get_or_load(session_id)
+    if rag_model is None:
+        logger.error("RAG model not found for session %s", session_id)
+        return jsonify({"success": False, "message": "RAG model not found for this session."}), 404
+
+    retrieved_images = retrieve_documents(rag_model, query, session_id)
+    full_image_paths = [os.path.join(app.static_folder, img) for img in retrieved_images]
+
+    def events():
+        yield sse_event('images', {"images": retrieved_images, "thumbnails": thumbnails_of(retrieved_images)})
+        chunks = []
+        # Closed when the client disconnects, which stops local generation at the next token
+        with closing(generate_response_stream(full_image_paths, query, session_id, resized_height, resized_width,
+                                              generation_model)) as stream:
+            for text in stream:
+                chunks.append(text)
+                yield sse_event('token', {"text": text})
+        parsed_response = Markup(markdown.markdown(''.join(chunks)))
+        save_chat_exchange(session_id, query, parsed_response, retrieved_images)
+        html = render_template('chat_messages.html', messages=[
+            {"role": "user", "content": query},
+            {"role": "assistant", "content": parsed_response, "images": retrieved_images,
+             "thumbnails": thumbnails_of(retrieved_images)}
+        ])
+        yield sse_event('done', {"html": html})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/thumbnails/<int:size>/<path:page>')
+def page_thumbnail(size, page):
+    """
+    Serves the WebP thumbnail of a stored page, generating it if needed.
+    """
+    if (size not in THUMBNAIL_SIZES or not page.startswith((PAGE_STORE_FOLDER + '/', INDEXED_PAGE_FOLDER + '/'))
+            or '..' in page.split('/')):
+        abort(404)
+    if not os.path.exists(os.path.join(app.static_folder, page)):
+        abort(404)
+    response = send_from_directory(app.static_folder, make_thumbnail(page, size), max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.after_request
+def cache_content_addressed(response):
+    # Stored pages and thumbnails are named by content hash, so they never change
+    content_addressed = (f"/static/{PAGE_STORE_FOLDER}/", f"/static/{INDEXED_PAGE_FOLDER}/", f"/static/{THUMBNAIL_FOLDER}/")
+    if request.path.startswith(content_addressed) and response.status_code == 200:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @app.route('/switch_session/<session_id>')
 def switch_session(session_id):
     session['session_id'] = session_id
-    if session_id not in RAG_models:
-        load_rag_model_for_session(session_id)
+    RAG_models.get_or_load(session_id)
     flash(f"Switched to session.", "info")
     return redirect(url_for('chat'))
 
@@ -243,17 +334,8 @@ def switch_session(session_id):
 def rename_session():
     session_id = request.form.get('session_id')
     new_session_name = request.form.get('new_session_name', 'Untitled Session')
-    session_file = os.path.join(app.config['SESSION_FOLDER'], f"{session_id}.json")
-
-    if os.path.exists(session_file):
-        with open(session_file, 'r') as f:
-            session_data = json.load(f)
-        
-        session_data['session_name'] = new_session_name
-
-        with open(session_file, 'w') as f:
-            json.dump(session_data, f)
-
+    if session_store.update_session_meta(session_id, folder=app.config['SESSION_FOLDER'],
+                                         session_name=new_session_name):
         return jsonify({"success": True, "message": "Session name updated."})
     else:
         return jsonify({"success": False, "message": "Session not found."})
@@ -261,29 +343,25 @@ def rename_session():
 @app.route('/delete_session/<session_id>', methods=['POST'])
 def delete_session(session_id):
     try:
-        session_file = os.path.join(app.config['SESSION_FOLDER'], f"{session_id}.json")
-        if os.path.exists(session_file):
-            os.remove(session_file)
+        session_store.delete_session(session_id, folder=app.config['SESSION_FOLDER'])
         
         session_folder = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
         if os.path.exists(session_folder):
             import shutil
             shutil.rmtree(session_folder)
         
-        session_images_folder = os.path.join('static', 'images', session_id)
-        if os.path.exists(session_images_folder):
-            import shutil
-            shutil.rmtree(session_images_folder)
-        
+        # Removing the index drops its page references, and its pages once nothing else refers to them
         RAG_models.pop(session_id, None)
+        delete_index(os.path.join(app.config['INDEX_FOLDER'], session_id))
+        invalidate_session(session_id)
         
         if session.get('session_id') == session_id:
             session['session_id'] = str(uuid.uuid4())
         
-        logger.info(f"Session {session_id} deleted.")
+        logger.info("Session %s deleted.", session_id)
         return jsonify({"success": True, "message": "Session deleted successfully."})
     except Exception as e:
-        logger.error(f"Error deleting session {session_id}: {e}")
+        logger.error("Error deleting session %s: %s", session_id, e)
         return jsonify({"success": False, "message": f"An error occurred while deleting the session: {str(e)}"})
 
 @app.route('/settings', methods=['GET', 'POST'])
@@ -293,12 +371,16 @@ def settings():
         generation_model = request.form.get('generation_model', 'qwen')
         resized_height = request.form.get('resized_height', 280)
         resized_width = request.form.get('resized_width', 280)
+        if generation_model not in generation_backends():
+            flash(f"Unknown generation model '{generation_model}'.", "error")
+            return redirect(url_for('settings'))
         session['indexer_model'] = indexer_model
         session['generation_model'] = generation_model
         session['resized_height'] = resized_height
         session['resized_width'] = resized_width
         session.modified = True
-        logger.info(f"Settings updated: indexer_model={indexer_model}, generation_model={generation_model}, resized_height={resized_height}, resized_width={resized_width}")
+        logger.info("Settings updated: indexer_model=%s, generation_model=%s, resized_height=%s, resized_width=%s",
+                    indexer_model, generation_model, resized_height, resized_width)
         flash("Settings updated.", "success")
         return redirect(url_for('chat'))
     else:
@@ -316,28 +398,61 @@ def settings():
 def new_session():
     session_id = str(uuid.uuid4())
     session['session_id'] = session_id
-    session_files = os.listdir(app.config['SESSION_FOLDER'])
-    session_number = len([f for f in session_files if f.endswith('.json')]) + 1
-    session_name = f"Session {session_number}"
-    session_file = os.path.join(app.config['SESSION_FOLDER'], f"{session_id}.json")
-    session_data = {
-        'session_name': session_name,
-        'chat_history': [],
-        'indexed_files': []
-    }
-    with open(session_file, 'w') as f:
-        json.dump(session_data, f)
+    session_name = session_store.next_session_name(app.config['SESSION_FOLDER'])
+    session_store.create_session(session_id, session_name, folder=app.config['SESSION_FOLDER'])
     flash("New chat session started.", "success")
     return redirect(url_for('chat'))
 
+@app.route('/sessions')
+def list_chat_sessions():
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', app.config['SESSION_LIST_PAGE_SIZE'], type=int), 500)
+    sessions = session_store.list_sessions(app.config['SESSION_FOLDER'], offset=offset, limit=limit)
+    return jsonify({
+        "success": True,
+        "sessions": sessions,
+        "total": session_store.count_sessions(app.config['SESSION_FOLDER']),
+        "offset": offset,
+        "limit": limit
+    })
+
+@app.route('/index_jobs')
+def list_index_jobs():
+    session_id = request.args.get('session_id', session.get('session_id'))
+    jobs = [job.to_dict() for job in indexing_jobs.jobs_for_session(session_id)]
+    return jsonify({"success": True, "jobs": jobs})
+
+@app.route('/index_jobs/<job_id>')
+def index_job_status(job_id):
+    job = indexing_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found."}), 404
+    return jsonify({"success": True, "job": job.to_dict()})
+
+@app.route('/healthz')
+def healthz():
+    # Liveness: the process is up and serving requests
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    # Readiness: models and indexes are loaded and warm
+    return jsonify(readiness()), 200 if is_ready() else 503
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype=CONTENT_TYPE)
+
+@app.route('/index_cache_stats')
+def index_cache_stats():
+    return jsonify({"indexes": RAG_models.stats(), **cache_stats(), "vision_inputs": vision_cache_stats(),
+                    "models": {**model_cache_stats(), "precisions": model_precisions()}})
+
 @app.route('/get_indexed_files/<session_id>')
 def get_indexed_files(session_id):
-    session_file = os.path.join(app.config['SESSION_FOLDER'], f"{session_id}.json")
-    if os.path.exists(session_file):
-        with open(session_file, 'r') as f:
-            session_data = json.load(f)
-            indexed_files = session_data.get('indexed_files', [])
-        return jsonify({"success": True, "indexed_files": indexed_files})
+    meta = session_store.load_session_meta(session_id, folder=app.config['SESSION_FOLDER'])
+    if meta is not None:
+        return jsonify({"success": True, "indexed_files": meta.get('indexed_files', [])})
     else:
         return jsonify({"success": False, "message": "Session not found."})
 
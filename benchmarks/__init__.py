@@ -0,0 +1,10 @@
+# benchmarks/__init__.py
+#
+# Offline benchmarks of the retrieve -> generate pipeline. A tiny random-weight
+# encoder and stub generators stand in for the real models, so runs need
+# neither model weights nor API keys:
+#
+#   python -m benchmarks run --pages 10,100,1000 --concurrency 4
+#   python -m benchmarks compare benchmarks/results/a.json benchmarks/results/b.json
+#   python -m benchmarks pooling --requests 200 --concurrency 8
+#   python -m benchmarks sessions --messages 2000
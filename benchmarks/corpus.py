@@ -0,0 +1,74 @@
+# benchmarks/corpus.py
+
+import io
+import os
+import base64
+import random
+from PIL import Image, ImageDraw
+
+# Words queries are drawn from, so the query encoder sees varied tokens
+_WORDS = ('experience', 'python', 'education', 'skills', 'projects', 'manager', 'degree', 'university',
+          'certification', 'leadership', 'backend', 'machine', 'learning', 'cloud', 'team', 'years',
+          'internship', 'languages', 'awards', 'publications', 'contact', 'summary', 'research', 'design')
+
+def synthetic_page(index, width=256, seed=0):
+    """
+    Renders a deterministic page image with a distinct layout per index.
+
+    Args:
+        index (int): The page number; different numbers give different pages.
+        width (int): The page width in pixels; the height follows A4 proportions.
+        seed (int): The corpus seed.
+
+    Returns:
+        Image: The page.
+    """
+    rng = random.Random(seed * 1_000_003 + index)
+    height = int(width * 1.414)
+    page = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(page)
+    draw.text((8, 8), f"Page {index}", fill='black')
+    y = 28
+    while y < height - 12:
+        line_width = rng.randint(width // 3, width - 16)
+        shade = rng.randint(0, 160)
+        draw.rectangle((8, y, 8 + line_width, y + 5), fill=(shade, shade, shade))
+        y += rng.choice((10, 10, 10, 24))
+    return page
+
+def page_payloads(count, width=256, seed=0):
+    """
+    Returns count synthetic pages as base64 PNGs, as Byaldi stores them.
+    """
+    payloads = []
+    for index in range(count):
+        buffer = io.BytesIO()
+        synthetic_page(index, width, seed).save(buffer, format='PNG')
+        payloads.append(base64.b64encode(buffer.getvalue()).decode())
+    return payloads
+
+def write_corpus(folder, count, width=256, seed=0):
+    """
+    Writes count synthetic single-page documents to folder as PNG files.
+
+    Returns:
+        list: The file names.
+    """
+    os.makedirs(folder, exist_ok=True)
+    names = []
+    for index in range(count):
+        name = f"page_{index:05d}.png"
+        synthetic_page(index, width, seed).save(os.path.join(folder, name))
+        names.append(name)
+    return names
+
+def synthetic_queries(count, seed=0, words=(3, 8)):
+    """
+    Returns count distinct queries, so result caches only hit when queries are repeated on purpose.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for index in range(count):
+        length = rng.randint(*words)
+        queries.append(' '.join(rng.choice(_WORDS) for _ in range(length)) + f" #{index}")
+    return queries
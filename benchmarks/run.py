@@ -0,0 +1,282 @@
+# benchmarks/run.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FOLDER = os.path.join(REPO_ROOT, 'benchmarks', 'results')
+
+def percentile(values, fraction):
+    """
+    Returns the given percentile (0..1) of values, interpolating between ranks.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize(seconds, wall_seconds=None):
+    """
+    Summarises per-call durations as latency percentiles in milliseconds,
+    plus throughput when the wall time of the whole run is given.
+    """
+    ms = [s * 1000 for s in seconds]
+    summary = {
+        'count': len(ms),
+        'mean_ms': sum(ms) / len(ms) if ms else None,
+        'p50_ms': percentile(ms, 0.5),
+        'p90_ms': percentile(ms, 0.9),
+        'p99_ms': percentile(ms, 0.99),
+        'max_ms': max(ms) if ms else None
+    }
+    if wall_seconds:
+        summary['throughput_per_second'] = len(ms) / wall_seconds
+    return summary
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def _run_concurrently(fn, items, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = list(pool.map(lambda item: _timed(fn, *item)[0], items))
+    return timings, time.perf_counter() - start
+
+def bench_corpus(pages, args):
+    """
+    Runs every stage against a synthetic corpus of the given number of pages.
+    """
+    from models.indexer import index_documents
+    from models.encoders import load_index
+    from models import retriever
+    from models.retriever import retrieve_documents, retrieve_documents_batch
+    from models.responder import generate_response
+    from benchmarks.corpus import page_payloads, write_corpus, synthetic_queries
+    from benchmarks.stubs import STUB_INDEXER_MODEL, synthetic_index
+
+    result = {'pages': pages, 'stages': {}}
+    stages = result['stages']
+    session_id = f"bench-{pages}"
+
+    # Indexing through index_documents, with the stub encoder doing the embedding
+    if pages <= args.index_max_pages:
+        folder = os.path.join('uploaded_documents', session_id)
+        write_corpus(folder, pages, args.page_width, args.seed)
+        index_dir = os.path.join('.byaldi', session_id)
+        seconds, _ = _timed(index_documents, folder, index_name=session_id, index_path=index_dir,
+                            indexer_model=STUB_INDEXER_MODEL, page_storage=args.page_storage)
+        stages['index'] = {'seconds': seconds, 'pages_per_second': pages / seconds}
+        stages['index_load'] = summarize([_timed(load_index, index_dir)[0] for _ in range(args.repeat_loads)])
+
+    # Retrieval against an in-memory index of synthetic pages
+    RAG = synthetic_index(page_payloads(pages, args.page_width, args.seed), dim=args.dim, seed=args.seed)
+    retriever._result_cache.clear()
+    retriever._embedding_cache.clear()
+    queries = synthetic_queries(args.queries, args.seed)
+    cold = [_timed(retrieve_documents, RAG, query, session_id, args.k) for query in queries]
+    stages['retrieve_cold'] = summarize([seconds for seconds, _ in cold])
+    stages['retrieve_cached'] = summarize([_timed(retrieve_documents, RAG, query, session_id, args.k)[0]
+                                           for query in queries])
+    retriever._result_cache.clear()
+    retriever._embedding_cache.clear()
+    batch_seconds, _ = _timed(retrieve_documents_batch, RAG, queries, session_id, args.k)
+    stages['retrieve_batch'] = {'queries': len(queries), 'seconds': batch_seconds,
+                                'queries_per_second': len(queries) / batch_seconds}
+
+    # Generation per backend, and the whole pipeline, under concurrent load
+    images = [found for _, found in cold]
+    for backend in args.backends:
+        requests = [(found, query, session_id, args.resized_height, args.resized_width, backend)
+                    for found, query in zip(images, queries)]
+        timings, wall = _run_concurrently(generate_response, requests, args.concurrency)
+        stages[f"generate[{backend}]"] = summarize(timings, wall)
+
+        retriever._result_cache.clear()
+
+        def pipeline(query):
+            found = retrieve_documents(RAG, query, session_id, args.k)
+            return generate_response(found, query, session_id, args.resized_height, args.resized_width, backend)
+
+        timings, wall = _run_concurrently(pipeline, [(query,) for query in queries], args.concurrency)
+        stages[f"end_to_end[{backend}]"] = summarize(timings, wall)
+
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def run(args):
+    """
+    Runs the benchmark in a scratch directory and writes the results as JSON.
+    """
+    sys.path.insert(0, REPO_ROOT)
+    workdir = tempfile.mkdtemp(prefix='resumebot-bench-')
+    os.environ.setdefault('LOG_FILE', os.path.join(workdir, 'bench.log'))
+    os.environ.setdefault('LOG_CONSOLE_LEVEL', 'WARNING')
+    os.environ.setdefault('GENERATION_BATCH_SIZE', str(args.concurrency))
+    os.chdir(workdir)
+    try:
+        import torch
+        from benchmarks.stubs import install_stub_encoder, install_stub_backends
+
+        torch.manual_seed(args.seed)
+        install_stub_encoder(args.dim)
+        install_stub_backends(args.local_latency_ms, args.local_per_image_ms, args.remote_latency_ms)
+
+        results = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'label': args.label,
+            'config': {key: value for key, value in vars(args).items() if key not in ('func', 'output')},
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'torch': torch.__version__,
+                'torch_threads': torch.get_num_threads()
+            },
+            'corpora': []
+        }
+        for pages in args.pages:
+            print(f"Benchmarking {pages} pages...", flush=True)
+            results['corpora'].append(bench_corpus(pages, args))
+    finally:
+        os.chdir(REPO_ROOT)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_FOLDER, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_results(results)
+    print(f"Results written to {output}")
+    return results
+
+def print_results(results):
+    print(f"{'pages':>7}  {'stage':<28}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'per s':>10}")
+    for corpus in results['corpora']:
+        for stage, stats in corpus['stages'].items():
+            if 'p50_ms' in stats:
+                rate = stats.get('throughput_per_second')
+                print(f"{corpus['pages']:>7}  {stage:<28}{stats['p50_ms']:>10.2f}{stats['p90_ms']:>10.2f}"
+                      f"{stats['p99_ms']:>10.2f}{rate if rate is not None else float('nan'):>10.2f}")
+            else:
+                rate = stats.get('pages_per_second', stats.get('queries_per_second'))
+                print(f"{corpus['pages']:>7}  {stage:<28}{stats['seconds'] * 1000:>10.2f}{'':>20}{rate:>10.2f}")
+        print(f"{corpus['pages']:>7}  {'peak RSS MB':<28}{corpus['peak_rss_mb']:>10.1f}")
+
+def _flatten(results):
+    metrics = {}
+    for corpus in results['corpora']:
+        for stage, stats in corpus['stages'].items():
+            for name, value in stats.items():
+                if name != 'count' and isinstance(value, (int, float)):
+                    metrics[f"{corpus['pages']}/{stage}/{name}"] = value
+        metrics[f"{corpus['pages']}/peak_rss_mb"] = corpus['peak_rss_mb']
+    return metrics
+
+def compare(args):
+    """
+    Prints the relative change of every metric between two result files.
+
+    Returns:
+        int: 1 if any metric regressed by more than the threshold, else 0.
+    """
+    with open(args.baseline) as f:
+        baseline = _flatten(json.load(f))
+    with open(args.candidate) as f:
+        candidate = _flatten(json.load(f))
+    regressions = 0
+    print(f"{'metric':<52}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for name in sorted(set(baseline) & set(candidate)):
+        before, after = baseline[name], candidate[name]
+        change = (after - before) / before * 100 if before else 0.0
+        # Latency, time and memory should go down; rates should go up
+        higher_is_better = name.endswith(('per_second',))
+        regressed = change < -args.threshold if higher_is_better else change > args.threshold
+        regressions += regressed
+        print(f"{name:<52}{before:>12.2f}{after:>12.2f}{change:>9.1f}%{'  REGRESSION' if regressed else ''}")
+    print(f"{regressions} regressions above {args.threshold:.0f}%.")
+    return 1 if regressions else 0
+
+def _int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def check_pooling(args):
+    sys.path.insert(0, REPO_ROOT)
+    from benchmarks.stub_server import check_pooling as run_check
+    return run_check(args)
+
+def check_compaction(args):
+    sys.path.insert(0, REPO_ROOT)
+    from benchmarks.session_check import check_compaction as run_check
+    return run_check(args)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Offline benchmarks of the retrieve -> generate pipeline.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run the benchmark and save the results as JSON.')
+    run_parser.add_argument('--pages', type=_int_list, default=[10, 100, 1000, 10000],
+                            help='Comma-separated corpus sizes in pages.')
+    run_parser.add_argument('--queries', type=int, default=50, help='Queries per corpus.')
+    run_parser.add_argument('--k', type=int, default=3, help='Pages retrieved per query.')
+    run_parser.add_argument('--concurrency', type=int, default=4, help='Concurrent generation requests.')
+    run_parser.add_argument('--backends', type=lambda v: v.split(','), default=['stub-local', 'stub-remote'])
+    run_parser.add_argument('--local-latency-ms', type=float, default=50, help='Stub local latency per batch.')
+    run_parser.add_argument('--local-per-image-ms', type=float, default=10, help='Stub local latency per image.')
+    run_parser.add_argument('--remote-latency-ms', type=float, default=200, help='Stub remote latency per call.')
+    run_parser.add_argument('--index-max-pages', type=int, default=1000,
+                            help='Largest corpus also indexed through index_documents.')
+    run_parser.add_argument('--page-storage', choices=('index', 'page_store'), default='index',
+                            help='Where index_documents keeps page images.')
+    run_parser.add_argument('--repeat-loads', type=int, default=5, help='Index loads timed per corpus.')
+    run_parser.add_argument('--dim', type=int, default=128, help='Stub embedding dimension.')
+    run_parser.add_argument('--page-width', type=int, default=256, help='Synthetic page width in pixels.')
+    run_parser.add_argument('--resized-height', type=int, default=280)
+    run_parser.add_argument('--resized-width', type=int, default=280)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--label', default='', help='Free-form label stored with the results.')
+    run_parser.add_argument('--output', help='Result file; defaults to benchmarks/results/<timestamp>.json.')
+    run_parser.add_argument('--keep-workdir', action='store_true', help='Keep the scratch directory.')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='Compare two result files.')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help='Percent change reported as a regression.')
+    compare_parser.set_defaults(func=compare)
+
+    pooling_parser = commands.add_parser('pooling', help='Check connection reuse against a local stub API server.')
+    pooling_parser.add_argument('--requests', type=int, default=200)
+    pooling_parser.add_argument('--concurrency', type=int, default=8)
+    pooling_parser.add_argument('--latency-ms', type=float, default=10, help='Stub server latency per response.')
+    pooling_parser.set_defaults(func=check_pooling)
+
+    sessions_parser = commands.add_parser('sessions', help='Check that session logs are compacted on append.')
+    sessions_parser.add_argument('--messages', type=int, default=2000)
+    sessions_parser.add_argument('--compact-bytes', type=int, default=16 * 1024,
+                                 help='Compaction threshold used for the check.')
+    sessions_parser.set_defaults(func=check_compaction)
+
+    args = parser.parse_args(argv)
+    outcome = args.func(args)
+    return outcome if isinstance(outcome, int) else 0
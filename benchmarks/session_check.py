@@ -0,0 +1,65 @@
+# benchmarks/session_check.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+def _log_lines(log_path):
+    with open(log_path, 'r') as f:
+        return f.read().splitlines()
+
+def check_compaction(args):
+    """
+    Appends exchanges to a scratch session, tears its log as a crash during a
+    write would, and checks that appends compact the log on their own: after
+    the next append following a tear, and whenever the log has grown by the
+    compaction threshold.
+
+    Returns:
+        int: 0 if every check held, 1 otherwise.
+    """
+    os.environ.setdefault('LOG_CONSOLE_LEVEL', 'WARNING')
+    from models import session_store
+
+    folder = tempfile.mkdtemp(prefix='resumebot-sessions-')
+    session_store.SESSION_COMPACT_BYTES = args.compact_bytes
+    session_id = 'compaction-check'
+    log_path = os.path.join(folder, f"{session_id}.jsonl")
+    exchange = [{'role': 'user', 'content': 'ping'}, {'role': 'assistant', 'content': 'pong', 'images': []}]
+    failures = []
+    try:
+        session_store.create_session(session_id, 'Compaction check', folder)
+        start = time.perf_counter()
+        for _ in range(args.messages // 2):
+            count = session_store.append_messages(session_id, exchange, folder)
+        seconds = time.perf_counter() - start
+        compacted = session_store.load_session_meta(session_id, folder).get('compacted_size', 0)
+        if not compacted:
+            failures.append(f"log of {os.path.getsize(log_path)} bytes was never compacted "
+                            f"(threshold {args.compact_bytes} bytes)")
+        if os.path.getsize(log_path) - compacted >= args.compact_bytes:
+            failures.append('log grew past the threshold since its last compaction')
+
+        with open(log_path, 'a') as f:
+            f.write(json.dumps(exchange[0])[:10])
+        count = session_store.append_messages(session_id, exchange, folder)
+        lines = _log_lines(log_path)
+        torn = [line for line in lines if not line.startswith('{') or not line.endswith('}')]
+        if torn:
+            failures.append(f"{len(torn)} torn lines left after the next append")
+        if count != len(lines):
+            failures.append(f"message count {count} does not match the {len(lines)} lines in the log")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print(f"{args.messages} messages appended in {seconds:.2f}s with compaction every "
+          f"{args.compact_bytes} bytes; {count} messages kept.")
+    for failure in failures:
+        print(f"FAIL: {failure}.", file=sys.stderr)
+    if failures:
+        return 1
+    print('OK: appends compacted the log.')
+    return 0
@@ -0,0 +1,113 @@
+# benchmarks/stub_server.py
+
+import os
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1, so clients may keep connections open between requests
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        self.server.record(self.client_address)
+        time.sleep(self.server.latency)
+        body = json.dumps({
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': 'Stub answer.'}}],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 2, 'total_tokens': 3}
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubAPIServer(ThreadingHTTPServer):
+    """
+    Local OpenAI-compatible chat completions endpoint that counts the TCP
+    connections its clients open, to check connection reuse.
+
+    Args:
+        latency (float): Seconds each response is delayed.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.01):
+        super().__init__(('127.0.0.1', 0), _StubHandler)
+        self.latency = latency
+        self.requests = 0
+        self.connections = set()
+        self._lock = threading.Lock()
+
+    def record(self, client_address):
+        with self._lock:
+            self.requests += 1
+            self.connections.add(client_address)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, name='stub-api', daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+def check_pooling(args):
+    """
+    Sends concurrent chat completions through the shared pooled client to a
+    local stub server, and checks that connections are reused within the
+    configured pool rather than opened per request.
+
+    Returns:
+        int: 0 if the pool held, 1 otherwise.
+    """
+    with StubAPIServer(latency=args.latency_ms / 1000.0) as server:
+        # Read by models.clients at import, so set before importing it
+        os.environ['OPENAI_BASE_URL'] = server.base_url
+        os.environ.setdefault('OPENAI_API_KEY', 'stub')
+        os.environ.setdefault('LOG_CONSOLE_LEVEL', 'WARNING')
+        from models import clients
+
+        try:
+            import openai  # noqa: F401
+            client = clients.openai_client()
+
+            def send(_):
+                client.chat.completions.create(model='stub', messages=[{'role': 'user', 'content': 'ping'}])
+        except ImportError:
+            http = clients.http_client()
+
+            def send(_):
+                http.post(f"{server.base_url}/chat/completions", json={'model': 'stub'}).raise_for_status()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(send, range(args.requests)))
+        seconds = time.perf_counter() - start
+        clients.close_clients()
+
+    limit = min(args.concurrency, clients.REMOTE_MAX_CONNECTIONS)
+    print(f"{server.requests} requests over {len(server.connections)} connections in {seconds:.2f}s "
+          f"(concurrency {args.concurrency}, pool limit {clients.REMOTE_MAX_CONNECTIONS}).")
+    if server.requests != args.requests or len(server.connections) > limit:
+        print(f"FAIL: expected {args.requests} requests over at most {limit} connections.", file=sys.stderr)
+        return 1
+    print('OK: connections were reused.')
+    return 0
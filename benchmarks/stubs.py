@@ -0,0 +1,200 @@
+# benchmarks/stubs.py
+
+import time
+import zlib
+import torch
+from byaldi import RAGMultiModalModel
+from byaldi.colpali import ColPaliModel
+from models import encoders
+from models.model_loader import register_backend, load_model
+from models.responder import register_generator
+from models.vision_cache import base64_image, rgb_image
+
+# The model name the stub encoder is registered under; byaldi requires "colpali" in it
+STUB_INDEXER_MODEL = 'stub/colpali-tiny'
+
+class TinyEncoder(torch.nn.Module):
+    """
+    Random-weight stand-in for ColPali: a few thousand parameters that map
+    image patches and query tokens to multi-vector embeddings.
+
+    Args:
+        dim (int): The embedding dimension.
+        grid (int): Images are pooled to grid x grid patches, one vector each.
+        vocab_size (int): The number of hashed query token ids.
+    """
+
+    def __init__(self, dim=128, grid=8, vocab_size=4096):
+        super().__init__()
+        generator = torch.Generator().manual_seed(0)
+        self.grid = grid
+        self.patch = torch.nn.Linear(3, dim)
+        self.tokens = torch.nn.Embedding(vocab_size, dim)
+        with torch.no_grad():
+            self.patch.weight.copy_(torch.randn(self.patch.weight.shape, generator=generator))
+            self.patch.bias.copy_(torch.randn(self.patch.bias.shape, generator=generator))
+            self.tokens.weight.copy_(torch.randn(self.tokens.weight.shape, generator=generator))
+
+    @property
+    def dtype(self):
+        return self.patch.weight.dtype
+
+    def forward(self, pixel_values=None, input_ids=None):
+        if pixel_values is not None:
+            patches = torch.nn.functional.adaptive_avg_pool2d(pixel_values, self.grid)
+            embeddings = self.patch(patches.flatten(2).transpose(1, 2))
+        else:
+            embeddings = self.tokens(input_ids)
+        return torch.nn.functional.normalize(embeddings, dim=-1)
+
+class StubProcessor:
+    """
+    Stand-in for the ColPali processor: fixed-size pixel tensors for pages,
+    hashed word ids for queries, and late-interaction (MaxSim) scoring.
+    """
+
+    def __init__(self, image_size=64, vocab_size=4096, max_query_tokens=16):
+        self.image_size = image_size
+        self.vocab_size = vocab_size
+        self.max_query_tokens = max_query_tokens
+
+    def process_images(self, images):
+        tensors = []
+        for image in images:
+            image = image.convert('RGB').resize((self.image_size, self.image_size))
+            data = torch.frombuffer(bytearray(image.tobytes()), dtype=torch.uint8)
+            tensors.append(data.view(self.image_size, self.image_size, 3).permute(2, 0, 1).float() / 255)
+        return {'pixel_values': torch.stack(tensors)}
+
+    def process_queries(self, queries):
+        ids = []
+        for query in queries:
+            words = (query.lower().split() or [''])[:self.max_query_tokens]
+            row = [zlib.crc32(word.encode('utf-8')) % self.vocab_size for word in words]
+            ids.append(row + [0] * (self.max_query_tokens - len(row)))
+        return {'input_ids': torch.tensor(ids, dtype=torch.long)}
+
+    def score(self, qs, ps, batch_size=256):
+        queries = torch.nn.utils.rnn.pad_sequence(list(qs), batch_first=True)
+        scores = []
+        for start in range(0, len(ps), batch_size):
+            pages = torch.nn.utils.rnn.pad_sequence(list(ps[start:start + batch_size]), batch_first=True)
+            scores.append(torch.einsum('qtd,psd->qpts', queries, pages).amax(dim=3).sum(dim=2))
+        return torch.cat(scores, dim=1)
+
+def make_stub_encoder(dim=128, index_root='.byaldi'):
+    """
+    Builds a RAGMultiModalModel whose ColPali model is the tiny stub, without
+    loading any weights.
+    """
+    colpali = ColPaliModel.__new__(ColPaliModel)
+    colpali.pretrained_model_name_or_path = STUB_INDEXER_MODEL
+    colpali.model_name = STUB_INDEXER_MODEL
+    colpali.n_gpu = 0
+    colpali.device = 'cpu'
+    colpali.verbose = 0
+    colpali.load_from_index = False
+    colpali.kwargs = {}
+    colpali.index_root = index_root
+    colpali.index_name = None
+    colpali.collection = {}
+    colpali.indexed_embeddings = []
+    colpali.embed_id_to_doc_id = {}
+    colpali.doc_id_to_metadata = {}
+    colpali.doc_ids_to_file_names = {}
+    colpali.doc_ids = set()
+    colpali.full_document_collection = False
+    colpali.highest_doc_id = -1
+    colpali.resize_stored_images = False
+    colpali.max_image_width = None
+    colpali.max_image_height = None
+    colpali.model = TinyEncoder(dim=dim).eval()
+    colpali.processor = StubProcessor()
+    RAG = RAGMultiModalModel.__new__(RAGMultiModalModel)
+    RAG.model = colpali
+    return RAG
+
+def install_stub_encoder(dim=128):
+    """
+    Makes STUB_INDEXER_MODEL resolvable by models.encoders, so index_documents
+    and load_index run the real pipeline on the stub.
+    """
+    encoders._encoders[STUB_INDEXER_MODEL] = make_stub_encoder(dim)
+    return STUB_INDEXER_MODEL
+
+def synthetic_index(pages, dim=128, tokens_per_page=64, seed=0):
+    """
+    Builds an in-memory index of random page embeddings without encoding anything.
+
+    Args:
+        pages (list): Base64 page images, one per indexed page.
+        dim (int): The embedding dimension.
+        tokens_per_page (int): The number of vectors per page.
+        seed (int): The random seed.
+
+    Returns:
+        RAGMultiModalModel: A model ready for retrieve_documents.
+    """
+    install_stub_encoder(dim)
+    RAG = encoders.new_index_model(STUB_INDEXER_MODEL)
+    colpali = RAG.model
+    generator = torch.Generator().manual_seed(seed)
+    for embed_id, payload in enumerate(pages):
+        embedding = torch.randn(tokens_per_page, dim, generator=generator)
+        colpali.indexed_embeddings.append(torch.nn.functional.normalize(embedding, dim=-1))
+        colpali.embed_id_to_doc_id[embed_id] = {'doc_id': embed_id // 10, 'page_id': embed_id % 10 + 1}
+        colpali.collection[embed_id] = payload
+    colpali.doc_ids = set(entry['doc_id'] for entry in colpali.embed_id_to_doc_id.values())
+    colpali.highest_doc_id = max(colpali.doc_ids, default=-1)
+    colpali.index_name = f"synthetic-{len(pages)}"
+    RAG.index_version = 1
+
+    def search(query, k=3):
+        # Same results as the retriever's search path, for callers of the byaldi API
+        from models.retriever import encode_queries, search_embeddings
+        return search_embeddings(RAG, encode_queries(RAG, [query]), k)[0]
+
+    RAG.search = search
+    return RAG
+
+# Latency of the stub generators, in seconds; set by install_stub_backends
+_latency = {'stub-local': 0.05, 'stub-local-per-image': 0.01, 'stub-remote': 0.2}
+
+@register_backend('stub-local')
+def _load_stub_local():
+    # A small module so the model cache has something to size
+    return torch.nn.Linear(16, 16)
+
+@register_backend('stub-remote', cache=False)
+def _load_stub_remote():
+    return None
+
+def _run_stub_local_batch(requests):
+    load_model('stub-local')
+    images = 0
+    for valid_images, _, resized_height, resized_width in requests:
+        for path in valid_images:
+            # Decoded once and cached, like the inputs of the real local backends
+            rgb_image(path).resize((resized_width, resized_height))
+            images += 1
+    # A batch costs one forward pass plus a little per image, as with padded batches
+    time.sleep(_latency['stub-local'] + _latency['stub-local-per-image'] * images)
+    return [f"Stub answer to '{query}' from {len(valid_images)} pages." for valid_images, query, _, _ in requests]
+
+def _generate_stub_remote(valid_images, query, resized_height, resized_width):
+    load_model('stub-remote')
+    payload = sum(len(base64_image(path)) for path in valid_images)
+    # Waiting on the network releases the GIL, like a real API call
+    time.sleep(_latency['stub-remote'])
+    return f"Stub answer to '{query}' from {len(valid_images)} pages ({payload} bytes sent)."
+
+def install_stub_backends(local_latency_ms=50, local_per_image_ms=10, remote_latency_ms=200):
+    """
+    Registers the 'stub-local' (micro-batched) and 'stub-remote' generators.
+    """
+    _latency['stub-local'] = local_latency_ms / 1000.0
+    _latency['stub-local-per-image'] = local_per_image_ms / 1000.0
+    _latency['stub-remote'] = remote_latency_ms / 1000.0
+    register_generator('stub-local', _run_stub_local_batch, batched=True)
+    register_generator('stub-remote', _generate_stub_remote)
+    return ['stub-local', 'stub-remote']
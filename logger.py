@@ -1,11 +1,71 @@
 # logger.py
 
+import os
+import queue
+import atexit
 import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Log file and its size-based rotation
+LOG_FILE = os.getenv('LOG_FILE', 'app.log')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 ** 2))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+
+# Default level of every module logger, and per-module overrides,
+# e.g. LOG_LEVELS="models.retriever=INFO,models.page_store=WARNING"
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG').upper()
+LOG_LEVELS = dict(
+    (name.strip(), level.strip().upper())
+    for name, _, level in (item.partition('=') for item in os.getenv('LOG_LEVELS', '').split(','))
+    if name.strip() and level.strip()
+)
+LOG_CONSOLE_LEVEL = os.getenv('LOG_CONSOLE_LEVEL', 'INFO').upper()
+
+_queue = queue.SimpleQueue()
+_listener = None
+_listener_lock = threading.Lock()
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Enqueues records as they are, so %-style messages are only formatted by
+    the background writer, never on the calling thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+def _start_listener():
+    # One background thread writes every record to the console and the rotating log file
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+        # Console handler
+        c_handler = logging.StreamHandler()
+        c_handler.setLevel(LOG_CONSOLE_LEVEL)
+        c_handler.setFormatter(formatter)
+
+        # File handler
+        f_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+        f_handler.setLevel(logging.DEBUG)
+        f_handler.setFormatter(formatter)
+
+        _listener = QueueListener(_queue, c_handler, f_handler, respect_handler_level=True)
+        _listener.start()
+        # Flush what is still queued when the process exits
+        atexit.register(_listener.stop)
 
 def get_logger(name):
     """
     Creates a logger with the specified name.
 
+    Records are handed to a queue and written by a single background thread,
+    so logging never blocks the caller on I/O. The level comes from
+    LOG_LEVELS for the module, or LOG_LEVEL.
+
     Args:
         name (str): The name of the logger.
 
@@ -13,25 +73,10 @@ def get_logger(name):
         Logger: Configured logger instance.
     """
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(LOG_LEVELS.get(name, LOG_LEVEL))
 
     if not logger.handlers:
-        # Console handler
-        c_handler = logging.StreamHandler()
-        c_handler.setLevel(logging.INFO)
-
-        # File handler
-        f_handler = logging.FileHandler('app.log')
-        f_handler.setLevel(logging.DEBUG)
-
-        # Create formatters and add them to handlers
-        c_format = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
-        f_format = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
-        c_handler.setFormatter(c_format)
-        f_handler.setFormatter(f_format)
-
-        # Add handlers to the logger
-        logger.addHandler(c_handler)
-        logger.addHandler(f_handler)
+        _start_listener()
+        logger.addHandler(_DeferredQueueHandler(_queue))
 
     return logger
@@ -3,12 +3,13 @@ import uuid
 import json
 import streamlit as st
 from models.indexer import index_documents
+from models.encoders import load_index
 from models.retriever import retrieve_documents
 from models.responder import generate_response
 from pathlib import Path
 from logger import get_logger
-from PIL import Image
-from byaldi import RAGMultiModalModel
+from models.page_store import THUMBNAIL_SIZES, make_thumbnail, register_reference_source
+from models import session_store
 
 # Initialize logger
 logger = get_logger(__name__)
@@ -18,35 +19,39 @@ UPLOAD_FOLDER = 'uploaded_documents'
 SESSION_FOLDER = 'sessions'
 INDEX_FOLDER = os.path.join(os.getcwd(), '.byaldi')
 STATIC_FOLDER = os.path.join(os.getcwd(), 'static/images')
+# Number of recent messages loaded when switching to a session
+CHAT_HISTORY_LIMIT = int(os.getenv('CHAT_HISTORY_LIMIT', 0)) or 200
+# Number of sessions offered in the session switcher
+SESSION_LIST_PAGE_SIZE = int(os.getenv('SESSION_LIST_PAGE_SIZE', 50))
 
 # Ensure necessary directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(SESSION_FOLDER, exist_ok=True)
 os.makedirs(STATIC_FOLDER, exist_ok=True)
 
+# Pages shown in saved chat histories are never collected from the page store
+register_reference_source('chat history', lambda: session_store.referenced_images(SESSION_FOLDER))
+
 # Function to load RAG model for session
 def load_rag_model_for_session(session_id):
     index_path = os.path.join(INDEX_FOLDER, session_id)
     if os.path.exists(index_path):
         try:
-            RAG = RAGMultiModalModel.from_index(index_path)
+            RAG = load_index(index_path)
             st.session_state['RAG_models'][session_id] = RAG
-            logger.info(f"RAG model for session {session_id} loaded from index.")
+            logger.info("RAG model for session %s loaded from index.", session_id)
         except Exception as e:
-            logger.error(f"Error loading RAG model for session {session_id}: {e}")
+            logger.error("Error loading RAG model for session %s: %s", session_id, e)
     else:
-        logger.warning(f"No index found for session {session_id}.")
-
-# Function to save session data
-def save_session_data(session_id, session_name, chat_history, indexed_files):
-    session_file = os.path.join(SESSION_FOLDER, f"{session_id}.json")
-    session_data = {
-        'session_name': session_name,
-        'chat_history': chat_history,
-        'indexed_files': indexed_files
-    }
-    with open(session_file, 'w') as f:
-        json.dump(session_data, f)
+        logger.warning("No index found for session %s.", session_id)
+
+# Function to start a new session
+def create_new_session():
+    st.session_state['session_id'] = str(uuid.uuid4())
+    session_name = session_store.next_session_name(SESSION_FOLDER)
+    st.session_state['session_name'] = session_name
+    st.session_state['chat_history'] = []
+    session_store.create_session(st.session_state['session_id'], session_name, folder=SESSION_FOLDER)
 
 # Initialize session state
 if 'session_id' not in st.session_state:
@@ -70,27 +75,34 @@ with st.sidebar:
 
     # Check if the session ID exists; if not, prompt user to create a new session
     if st.session_state['session_id'] is None:
-        st.session_state['session_id'] = str(uuid.uuid4())
-        session_name = f"Session {len(os.listdir(SESSION_FOLDER)) + 1}"
-        save_session_data(st.session_state['session_id'], session_name, [], [])
-        st.session_state['session_name'] = session_name
+        create_new_session()
         st.success(f"New session created: {st.session_state['session_id']}")
 
     st.write(f"Current session ID: {st.session_state['session_id']}")
 
     # Option to start a new session
     if st.button("Start New Session"):
-        st.session_state['session_id'] = str(uuid.uuid4())
-        session_name = f"Session {len(os.listdir(SESSION_FOLDER)) + 1}"
-        st.session_state['session_name'] = session_name
-        save_session_data(st.session_state['session_id'], session_name, [], [])
+        create_new_session()
         st.success(f"New session started: {st.session_state['session_id']}")
     
     # Session switching option
-    session_files = [f for f in os.listdir(SESSION_FOLDER) if f.endswith('.json')]
-    if session_files:
-        selected_session = st.selectbox("Switch Session", session_files)
-        st.session_state['session_id'] = selected_session[:-5]  # Remove '.json'
+    chat_sessions = session_store.list_sessions(SESSION_FOLDER, limit=SESSION_LIST_PAGE_SIZE)
+    if chat_sessions:
+        session_names = {s['id']: s['name'] for s in chat_sessions}
+        if st.session_state['session_id'] not in session_names:
+            # The current session may be older than the listed page
+            current_meta = session_store.load_session_meta(st.session_state['session_id'], folder=SESSION_FOLDER)
+            if current_meta is not None:
+                session_names[st.session_state['session_id']] = current_meta.get('session_name', 'Untitled Session')
+        session_ids = list(session_names)
+        current = session_ids.index(st.session_state['session_id']) if st.session_state['session_id'] in session_names else 0
+        selected_session = st.selectbox("Switch Session", session_ids, index=current, format_func=session_names.get)
+        if selected_session != st.session_state['session_id']:
+            st.session_state['session_id'] = selected_session
+            st.session_state['session_name'] = session_names[selected_session]
+            # Only the recent part of the history is shown, so only that is read
+            st.session_state['chat_history'] = session_store.recent_messages(selected_session, CHAT_HISTORY_LIMIT,
+                                                                             folder=SESSION_FOLDER)
         load_rag_model_for_session(st.session_state['session_id'])
         st.success(f"Switched to session: {st.session_state['session_id']}")
 
@@ -130,7 +142,8 @@ if 'uploaded_files' in st.session_state and st.session_state['uploaded_files']:
             index_path = os.path.join(INDEX_FOLDER, index_name)
             RAG = index_documents(session_folder, index_name=index_name, index_path=index_path)
             st.session_state['RAG_models'][st.session_state['session_id']] = RAG
-            save_session_data(st.session_state['session_id'], st.session_state['session_name'], st.session_state['chat_history'], st.session_state['uploaded_files'])
+            session_store.add_indexed_files(st.session_state['session_id'], st.session_state['uploaded_files'],
+                                            st.session_state['session_name'], folder=SESSION_FOLDER)
             st.success("Documents indexed successfully.")
         except Exception as e:
             st.error(f"Error indexing documents: {e}")
@@ -158,30 +171,36 @@ if user_query:
                                             st.session_state['generation_model'])
             
             # Update chat history
-            st.session_state['chat_history'].append({"role": "user", "content": user_query})
-            st.session_state['chat_history'].append({"role": "assistant", "content": response})
+            exchange = [{"role": "user", "content": user_query},
+                        {"role": "assistant", "content": response, "images": retrieved_documents}]
+            st.session_state['chat_history'].extend(exchange)
+            session_store.append_messages(st.session_state['session_id'], exchange, folder=SESSION_FOLDER)
 
             # Display response
             st.write("**Assistant**:", response)
 
-            # Display images from the response
-            if retrieved_documents:
-                # Create columns for horizontal layout
-                num_images = len(retrieved_documents)
-                cols = st.columns(num_images)  # Create one column per image
-
-                for idx, image_path in enumerate(retrieved_documents):
-                    full_image_path = os.path.join(STATIC_FOLDER, image_path.split('/')[-2], image_path.split('/')[-1])
-                    logger.info(f"Checking image path: {full_image_path}")
-                    if os.path.exists(full_image_path):
-                        # Resize the image to 280x280
-                        img = Image.open(full_image_path)
-                        img_resized = img.resize((280, 280))
-                        with cols[idx]:  # Place each image in its own column
-                            st.image(img_resized, caption=f"Retrieved Image: {os.path.basename(full_image_path)}")
-                    else:
-                        with cols[idx]:
-                            st.warning(f"Image not found: {image_path}")
+            # Keep the retrieved pages across reruns, so they can be expanded on demand
+            st.session_state['retrieved_documents'] = retrieved_documents
 
     except Exception as e:
-        st.error(f"Error generating response: {e}")
\ No newline at end of file
+        st.error(f"Error generating response: {e}")
+
+# Display images from the last response
+retrieved_documents = st.session_state.get('retrieved_documents', [])
+if retrieved_documents:
+    # Create columns for horizontal layout
+    num_images = len(retrieved_documents)
+    cols = st.columns(num_images)  # Create one column per image
+
+    for idx, image_path in enumerate(retrieved_documents):
+        full_image_path = os.path.join('static', image_path)
+        if os.path.exists(full_image_path):
+            # Show the pre-rendered thumbnail; the full page is only loaded on demand
+            thumbnail = os.path.join('static', make_thumbnail(image_path, THUMBNAIL_SIZES[0]))
+            with cols[idx]:  # Place each image in its own column
+                st.image(thumbnail, caption=f"Retrieved Image: {os.path.basename(full_image_path)}")
+                if st.toggle("Show full page", key=f"full-page-{idx}-{image_path}"):
+                    st.image(full_image_path)
+        else:
+            with cols[idx]:
+                st.warning(f"Image not found: {image_path}")
@@ -0,0 +1,98 @@
+# models/batcher.py
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+class BatchQueueFullError(Exception):
+    """Raised when a micro-batcher's queue has no room for another request."""
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into batches for a single worker thread.
+
+    The worker waits for a first request, then keeps collecting for up to
+    max_wait_ms or until max_batch_size requests are queued, and calls
+    run_batch with the list of requests. run_batch must return one result
+    per request, in order; each caller gets its own result back. A result
+    that is an exception is raised to its caller alone, and if run_batch
+    raises for a batch of several requests, each is retried on its own, so
+    one bad request never fails the requests batched with it.
+
+    Args:
+        run_batch (callable): Processes a list of requests, returning a list of results.
+        max_batch_size (int): The maximum number of requests per batch.
+        max_wait_ms (float): How long to wait for more requests after the first.
+        max_queue (int): The maximum number of requests waiting for a batch.
+        name (str): The name used for the worker thread and in log messages.
+    """
+
+    def __init__(self, run_batch, max_batch_size=4, max_wait_ms=10, max_queue=64, name='batcher'):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._worker.start()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, request):
+        """
+        Queues a request and blocks until its result is ready.
+
+        Raises:
+            BatchQueueFullError: If the queue is full.
+        """
+        future = Future()
+        try:
+            self._queue.put_nowait((request, future))
+        except queue.Full:
+            raise BatchQueueFullError(f"{self.name} queue is full ({self._queue.maxsize} requests waiting).")
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, batch):
+        requests = [request for request, _ in batch]
+        start = time.perf_counter()
+        try:
+            results = self.run_batch(requests)
+            if len(results) != len(batch):
+                raise ValueError(f"{self.name} returned {len(results)} results for {len(batch)} requests")
+        except Exception as e:
+            logger.error("Error in %s batch of %d: %s", self.name, len(batch), e)
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                # Find the failing requests by running each on its own
+                for item in batch:
+                    self._run([item])
+            return
+        logger.info("%s ran a batch of %d in %.2fs.", self.name, len(batch), time.perf_counter() - start)
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _loop(self):
+        while True:
+            self._run(self._collect())
@@ -0,0 +1,241 @@
+# models/cache.py
+
+import time
+import threading
+from collections import OrderedDict
+from models.metrics import register_cache
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by entry count and/or size.
+
+    Args:
+        max_entries (int): The maximum number of entries, or None for no limit.
+        max_bytes (int): The maximum total size of entries, or None for no limit.
+        sizeof (callable): Returns the size in bytes of a value.
+        on_evict (callable): Called with (key, value) when an entry is evicted.
+        name (str): The name used in log messages.
+        ttl (float): Seconds after insertion at which an entry expires, or None.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None, on_evict=None, name='cache', ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: 0)
+        self.on_evict = on_evict
+        self.name = name
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._expires = {}
+        self._pinned = set()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        register_cache(self)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value and marks it as most recently used.
+        """
+        with self._lock:
+            if key in self._entries:
+                if self.ttl is not None and self._expires[key] < time.monotonic():
+                    self._remove(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        Inserts or replaces a value, evicting least-recently-used entries as needed.
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = value
+            self._sizes[key] = size
+            if self.ttl is not None:
+                self._expires[key] = time.monotonic() + self.ttl
+            self._total_bytes += size
+            evicted = self._evict(keep=key)
+        self._notify_evicted(evicted)
+
+    def _remove(self, key):
+        self._total_bytes -= self._sizes.pop(key)
+        self._expires.pop(key, None)
+        return self._entries.pop(key)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key)
+
+    def discard_where(self, predicate):
+        """
+        Removes every entry whose key satisfies predicate.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._expires.clear()
+            self._total_bytes = 0
+
+    def pin(self, key):
+        """
+        Exempts a key from eviction, whether or not it is cached yet.
+        """
+        with self._lock:
+            self._pinned.add(key)
+
+    def unpin(self, key):
+        with self._lock:
+            self._pinned.discard(key)
+
+    def size_of(self, key):
+        with self._lock:
+            return self._sizes.get(key)
+
+    def make_room(self, nbytes):
+        """
+        Evicts entries until nbytes more would fit in the byte budget.
+        """
+        with self._lock:
+            evicted = self._evict(extra_bytes=nbytes)
+        self._notify_evicted(evicted)
+
+    def _over_budget(self, extra_bytes=0):
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self._total_bytes + extra_bytes > self.max_bytes
+
+    def _evict(self, keep=None, extra_bytes=0):
+        # Pinned entries and the entry just inserted are never evicted, even if over budget.
+        evicted = []
+        while self._over_budget(extra_bytes):
+            key = next((k for k in self._entries if k != keep and k not in self._pinned), None)
+            if key is None:
+                break
+            evicted.append((key, self._remove(key)))
+            self.evictions += 1
+            logger.debug("Evicted '%s' from %s.", key, self.name)
+        return evicted
+
+    def _notify_evicted(self, evicted):
+        # Called outside the lock, so callbacks may be slow or touch the cache.
+        if self.on_evict is not None:
+            for key, value in evicted:
+                self.on_evict(key, value)
+
+    def stats(self):
+        """
+        Returns the hit, miss and eviction counters and the current occupancy.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'pinned': sorted(str(key) for key in self._pinned),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+def rag_model_size(RAG):
+    """
+    Estimates the resident size in bytes of a loaded index: its embeddings,
+    unless they are memory-mapped, plus any base64 page images stored with it.
+    """
+    colpali = getattr(RAG, 'model', None)
+    if colpali is None:
+        return 0
+    size = 0
+    # Memory-mapped embeddings are shared page cache, not memory this process owns
+    if not getattr(RAG, 'embeddings_mapped', False):
+        for embedding in getattr(colpali, 'indexed_embeddings', []):
+            size += embedding.element_size() * embedding.nelement()
+    for payload in getattr(colpali, 'collection', {}).values():
+        size += len(payload)
+    return size
+
+class SessionIndexCache(LRUCache):
+    """
+    LRU cache of per-session RAG models that loads indexes lazily on first access.
+
+    Args:
+        loader (callable): Loads the RAG model for a session id, or returns None.
+        max_entries (int): The maximum number of loaded indexes.
+        max_bytes (int): The memory budget for loaded indexes.
+        is_stale (callable): Called with (session_id, RAG); returns True when a
+            newer version is on disk and the cached one must be reloaded.
+    """
+
+    def __init__(self, loader, max_entries=None, max_bytes=None, is_stale=None):
+        super().__init__(max_entries=max_entries, max_bytes=max_bytes,
+                         sizeof=rag_model_size, name='session index cache')
+        self.loader = loader
+        self.is_stale = is_stale
+        self._load_locks = {}
+
+    def get_or_load(self, session_id):
+        """
+        Returns the RAG model for the session, loading it from disk on a miss
+        or when a newer version has been published since it was loaded.
+        """
+        RAG = self.get(session_id)
+        if RAG is not None and self.is_stale is not None and self.is_stale(session_id, RAG):
+            logger.info("Index of session %s changed on disk; reloading it.", session_id)
+            with self._lock:
+                if self._entries.get(session_id) is RAG:
+                    self._remove(session_id)
+            RAG = None
+        if RAG is not None:
+            return RAG
+        with self._lock:
+            load_lock = self._load_locks.setdefault(session_id, threading.Lock())
+        with load_lock:
+            # Another request may have loaded it while we waited.
+            with self._lock:
+                if session_id in self._entries:
+                    self._entries.move_to_end(session_id)
+                    return self._entries[session_id]
+            RAG = self.loader(session_id)
+            if RAG is not None:
+                self.put(session_id, RAG)
+        with self._lock:
+            self._load_locks.pop(session_id, None)
+        return RAG
@@ -0,0 +1,126 @@
+# models/clients.py
+
+import os
+import threading
+from dotenv import load_dotenv
+from logger import get_logger
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Connection pool, timeout and retry settings shared by the remote backends
+REMOTE_MAX_CONNECTIONS = int(os.getenv('REMOTE_MAX_CONNECTIONS', 32))
+REMOTE_MAX_KEEPALIVE = int(os.getenv('REMOTE_MAX_KEEPALIVE', 16))
+REMOTE_KEEPALIVE_SECONDS = float(os.getenv('REMOTE_KEEPALIVE_SECONDS', 60))
+REMOTE_CONNECT_TIMEOUT = float(os.getenv('REMOTE_CONNECT_TIMEOUT', 5))
+REMOTE_READ_TIMEOUT = float(os.getenv('REMOTE_READ_TIMEOUT', 120))
+REMOTE_MAX_RETRIES = int(os.getenv('REMOTE_MAX_RETRIES', 3))
+REMOTE_RETRY_BACKOFF_SECONDS = float(os.getenv('REMOTE_RETRY_BACKOFF_SECONDS', 0.5))
+
+# Base URLs, overridable to point a backend at a proxy or a local stub server
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+GROQ_BASE_URL = os.getenv('GROQ_BASE_URL') or None
+GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT') or None
+GEMINI_MODEL_NAME = os.getenv('GEMINI_MODEL_NAME', 'gemini-1.5-flash-002')
+
+# One long-lived client per provider, created on first use
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _get_or_create(provider, factory):
+    client = _clients.get(provider)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(provider)
+        if client is None:
+            client = factory()
+            _clients[provider] = client
+            logger.info("Created pooled client for '%s'.", provider)
+        return client
+
+def http_client():
+    """
+    Returns the keep-alive connection pool shared by the HTTP API clients.
+    """
+    def create():
+        import httpx
+        limits = httpx.Limits(max_connections=REMOTE_MAX_CONNECTIONS,
+                              max_keepalive_connections=REMOTE_MAX_KEEPALIVE,
+                              keepalive_expiry=REMOTE_KEEPALIVE_SECONDS)
+        return httpx.Client(
+            timeout=httpx.Timeout(REMOTE_READ_TIMEOUT, connect=REMOTE_CONNECT_TIMEOUT),
+            # The pool belongs to the transport; httpx ignores Client limits when a transport is given.
+            # Retries cover failed connection attempts; request retries are left to the SDKs.
+            transport=httpx.HTTPTransport(limits=limits, retries=REMOTE_MAX_RETRIES)
+        )
+    return _get_or_create('http', create)
+
+def openai_client():
+    """
+    Returns the shared OpenAI client.
+
+    The SDK retries rate limits, 5xx responses and timeouts with exponential
+    backoff up to REMOTE_MAX_RETRIES times.
+    """
+    def create():
+        from openai import OpenAI
+        return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL,
+                      http_client=http_client(), max_retries=REMOTE_MAX_RETRIES)
+    return _get_or_create('openai', create)
+
+def groq_client():
+    """
+    Returns the shared Groq client, with the same pooling and retries as openai_client.
+    """
+    def create():
+        from groq import Groq
+        api_key = os.getenv("GROQ_API_KEY")
+        if not api_key:
+            raise ValueError("GROQ_API_KEY not found in .env file")
+        return Groq(api_key=api_key, base_url=GROQ_BASE_URL,
+                    http_client=http_client(), max_retries=REMOTE_MAX_RETRIES)
+    return _get_or_create('groq', create)
+
+def gemini_model():
+    """
+    Returns the shared Gemini model. genai.configure runs once per process,
+    so its transport and connections are reused across requests.
+    """
+    def create():
+        import google.generativeai as genai
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found in .env file")
+        client_options = {'api_endpoint': GEMINI_API_ENDPOINT} if GEMINI_API_ENDPOINT else None
+        genai.configure(api_key=api_key, client_options=client_options)
+        return genai.GenerativeModel(GEMINI_MODEL_NAME)
+    return _get_or_create('gemini', create)
+
+def gemini_request_options():
+    """
+    Returns the timeout and retry policy for Gemini generate_content calls.
+    """
+    from google.api_core import retry
+    return {
+        'timeout': REMOTE_READ_TIMEOUT,
+        'retry': retry.Retry(initial=REMOTE_RETRY_BACKOFF_SECONDS, multiplier=2,
+                             maximum=REMOTE_RETRY_BACKOFF_SECONDS * 2 ** REMOTE_MAX_RETRIES,
+                             timeout=REMOTE_READ_TIMEOUT)
+    }
+
+def close_clients():
+    """
+    Closes the pooled connections, e.g. on shutdown or after changing API keys.
+    """
+    with _clients_lock:
+        clients = dict(_clients)
+        _clients.clear()
+    for provider, client in clients.items():
+        if hasattr(client, 'close'):
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning("Error closing client for '%s': %s", provider, e)
@@ -1,25 +1,127 @@
 # models/converters.py
 
 import os
-from docx2pdf import convert
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from logger import get_logger
 
 logger = get_logger(__name__)
 
-def convert_docs_to_pdfs(folder_path):
+# Hashes of the sources each PDF was converted from, kept in the document folder
+CONVERSION_STATE_FILENAME = '.conversions.json'
+
+# Upper bound on concurrent conversions (each one drives a Word instance)
+MAX_CONVERSION_WORKERS = int(os.getenv('CONVERSION_WORKERS', min(4, os.cpu_count() or 1)))
+
+def _source_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _load_state(folder_path):
+    state_path = os.path.join(folder_path, CONVERSION_STATE_FILENAME)
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_state(folder_path, state):
+    state_path = os.path.join(folder_path, CONVERSION_STATE_FILENAME)
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+def _is_fresh(doc_path, pdf_path, state_entry):
+    """
+    A PDF is up to date if it is newer than its source, or if it was
+    converted from a source with the same content hash.
+
+    Returns:
+        tuple: Whether the PDF is fresh, and the source hash if one was computed.
+    """
+    if not os.path.exists(pdf_path):
+        return False, None
+    if os.path.getmtime(pdf_path) >= os.path.getmtime(doc_path):
+        return True, None
+    source_hash = _source_hash(doc_path)
+    return state_entry == source_hash, source_hash
+
+def converted_pdfs(folder_path):
+    """
+    Returns the PDFs convert_docs_to_pdfs generated in a folder.
+
+    Returns:
+        dict: PDF filename -> filename of the document it was converted from.
+    """
+    return {os.path.splitext(source)[0] + '.pdf': source for source in _load_state(folder_path)}
+
+def _convert_one(doc_path, pdf_path):
+    # Runs in a worker process; imported here so the parent never loads docx2pdf.
+    from docx2pdf import convert
+    start = time.perf_counter()
+    convert(doc_path, pdf_path)
+    return time.perf_counter() - start
+
+def convert_docs_to_pdfs(folder_path, max_workers=None):
     """
     Converts .doc and .docx files in the folder to PDFs.
 
+    Conversions run in a bounded process pool. Files whose PDF is already up
+    to date are skipped, and a failed conversion is reported without aborting
+    the rest of the batch.
+
     Args:
         folder_path (str): The path to the folder containing documents.
+        max_workers (int): The maximum number of concurrent conversions.
+
+    Returns:
+        list: One dict per document with 'filename', 'status' ('converted',
+        'skipped' or 'failed'), 'seconds' and 'error'.
     """
-    try:
-        for filename in os.listdir(folder_path):
-            if filename.lower().endswith(('.doc', '.docx')):
-                doc_path = os.path.join(folder_path, filename)
-                pdf_path = os.path.splitext(doc_path)[0] + '.pdf'
-                convert(doc_path, pdf_path)
-                logger.info(f"Converted '{filename}' to PDF.")
-    except Exception as e:
-        logger.error(f"Error converting documents to PDFs: {e}")
-        raise
\ No newline at end of file
+    state = _load_state(folder_path)
+    report = []
+    pending = {}
+
+    for filename in sorted(os.listdir(folder_path)):
+        if not filename.lower().endswith(('.doc', '.docx')):
+            continue
+        doc_path = os.path.join(folder_path, filename)
+        pdf_path = os.path.splitext(doc_path)[0] + '.pdf'
+        fresh, source_hash = _is_fresh(doc_path, pdf_path, state.get(filename))
+        if fresh:
+            report.append({'filename': filename, 'status': 'skipped', 'seconds': 0.0, 'error': None})
+            logger.debug("Skipped '%s', PDF is up to date.", filename)
+            continue
+        pending[filename] = (doc_path, pdf_path, source_hash or _source_hash(doc_path))
+
+    if pending:
+        workers = min(max_workers or MAX_CONVERSION_WORKERS, len(pending))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_convert_one, doc_path, pdf_path): filename
+                for filename, (doc_path, pdf_path, _) in pending.items()
+            }
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    seconds = future.result()
+                    state[filename] = pending[filename][2]
+                    report.append({'filename': filename, 'status': 'converted', 'seconds': seconds, 'error': None})
+                    logger.info("Converted '%s' to PDF in %.2fs.", filename, seconds)
+                except Exception as e:
+                    report.append({'filename': filename, 'status': 'failed', 'seconds': 0.0, 'error': str(e)})
+                    logger.error("Error converting '%s' to PDF: %s", filename, e)
+        _save_state(folder_path, state)
+
+    failed = sum(1 for r in report if r['status'] == 'failed')
+    logger.info("Document conversion finished: %d converted, %d skipped, %d failed.",
+                len(pending) - failed, len(report) - len(pending), failed)
+    return report
@@ -0,0 +1,145 @@
+# models/embedding_store.py
+
+import os
+import json
+import warnings
+import threading
+import numpy as np
+import torch
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Flat page embeddings next to byaldi's .pt chunks, opened read-only with mmap
+EMBEDDINGS_FILENAME = 'embeddings.bin'
+OFFSETS_FILENAME = 'embeddings.offsets.npy'
+LAYOUT_FILENAME = 'embeddings.json'
+LAYOUT_VERSION = 1
+
+# Whether indexes get flat embedding files that workers map instead of loading
+MMAP_EMBEDDINGS = os.getenv('MMAP_EMBEDDINGS', '1').lower() not in ('0', 'false', 'no')
+
+# Each page starts on a 64-byte boundary, so every page view is cache-line aligned
+ALIGNMENT = 64
+
+# numpy has no bfloat16, so bf16 embeddings are stored as their raw 16-bit patterns
+_STORAGE_DTYPES = {
+    'float32': (np.float32, torch.float32),
+    'float16': (np.float16, torch.float16),
+    'bfloat16': (np.int16, torch.bfloat16),
+}
+
+def _dtype_name(dtype):
+    return str(dtype).replace('torch.', '')
+
+def _atomic_replace(path, write):
+    # Unique per writer, as workers may migrate the same index concurrently
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def write_embeddings(index_dir, embeddings):
+    """
+    Writes page embeddings as one flat file plus an offsets table.
+
+    Args:
+        index_dir (str): The directory of the index.
+        embeddings (list): One (tokens, dim) tensor per embedding id.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    if not embeddings:
+        remove_embeddings(index_dir)
+        return 0
+    dtype = embeddings[0].dtype
+    if _dtype_name(dtype) not in _STORAGE_DTYPES:
+        dtype = torch.float32
+    dim = int(embeddings[0].shape[-1])
+    itemsize = torch.empty((), dtype=dtype).element_size()
+    align = ALIGNMENT // itemsize
+
+    # (start element, token count) per embedding id
+    offsets = np.zeros((len(embeddings), 2), dtype=np.int64)
+    position = 0
+    for embed_id, embedding in enumerate(embeddings):
+        position = -(-position // align) * align
+        offsets[embed_id] = (position, embedding.shape[0])
+        position += embedding.shape[0] * dim
+
+    def write_data(f):
+        written = 0
+        for (start, _), embedding in zip(offsets.tolist(), embeddings):
+            if start > written:
+                f.write(b'\0' * ((start - written) * itemsize))
+            data = embedding.detach().to('cpu', dtype).contiguous()
+            if dtype == torch.bfloat16:
+                data = data.view(torch.int16)
+            f.write(data.numpy().tobytes())
+            written = start + data.nelement()
+
+    data_path = os.path.join(index_dir, EMBEDDINGS_FILENAME)
+    _atomic_replace(data_path, write_data)
+    _atomic_replace(os.path.join(index_dir, OFFSETS_FILENAME), lambda f: np.save(f, offsets))
+    # The layout is written last; readers only trust the arrays once it names them
+    layout = {'version': LAYOUT_VERSION, 'dtype': _dtype_name(dtype), 'dim': dim,
+              'count': len(embeddings), 'elements': position}
+    _atomic_replace(os.path.join(index_dir, LAYOUT_FILENAME), lambda f: f.write(json.dumps(layout).encode()))
+    size = os.path.getsize(data_path)
+    logger.info("Wrote %d page embeddings (%.1f MiB, %s) to '%s'.", len(embeddings), size / 1024 ** 2,
+                layout['dtype'], index_dir)
+    return size
+
+def load_embeddings(index_dir, count=None):
+    """
+    Maps the flat embeddings of an index into memory, read-only and zero-copy.
+
+    Pages are shared through the OS page cache by every process that maps
+    the same index, and are only read from disk when first scored.
+
+    Args:
+        index_dir (str): The directory of the index.
+        count (int): The expected number of embeddings; a mismatch means the
+            flat file is stale.
+
+    Returns:
+        list: One (tokens, dim) tensor view per embedding id, or None if the
+            index has no usable flat embeddings.
+    """
+    layout_path = os.path.join(index_dir, LAYOUT_FILENAME)
+    if not os.path.exists(layout_path):
+        return None
+    try:
+        with open(layout_path) as f:
+            layout = json.load(f)
+        if layout.get('version') != LAYOUT_VERSION or layout['dtype'] not in _STORAGE_DTYPES:
+            return None
+        if count is not None and layout['count'] != count:
+            logger.warning("Flat embeddings in '%s' hold %d pages, expected %d; ignoring them.",
+                           index_dir, layout['count'], count)
+            return None
+        np_dtype, torch_dtype = _STORAGE_DTYPES[layout['dtype']]
+        offsets = np.load(os.path.join(index_dir, OFFSETS_FILENAME))
+        data = np.memmap(os.path.join(index_dir, EMBEDDINGS_FILENAME), dtype=np_dtype, mode='r',
+                         shape=(layout['elements'],))
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Could not map flat embeddings in '%s': %s", index_dir, e)
+        return None
+
+    with warnings.catch_warnings():
+        # The mapping is read-only; tensors over it must never be written to
+        warnings.simplefilter('ignore', UserWarning)
+        flat = torch.from_numpy(data)
+    if torch_dtype == torch.bfloat16:
+        flat = flat.view(torch.bfloat16)
+    dim = layout['dim']
+    return [flat[start:start + tokens * dim].view(tokens, dim) for start, tokens in offsets.tolist()]
+
+def remove_embeddings(index_dir):
+    for name in (LAYOUT_FILENAME, OFFSETS_FILENAME, EMBEDDINGS_FILENAME):
+        path = os.path.join(index_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,190 @@
+# models/encoders.py
+
+import os
+import copy
+import gzip
+import json
+import threading
+import time
+import torch
+from byaldi import RAGMultiModalModel
+from models.metrics import INDEX_LOAD_SECONDS
+from models.embedding_store import MMAP_EMBEDDINGS, load_embeddings, write_embeddings
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# References to page images stored outside the index, next to the index files
+PAGE_REFS_FILENAME = 'page_refs.json'
+
+# One resident ColPali/ColQwen2 encoder per indexer model name
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+def get_encoder(indexer_model):
+    """
+    Returns the shared encoder for the given indexer model, loading it once.
+
+    The returned model never holds an index itself; use new_index_model or
+    load_index to get a model with its own embeddings that reuses its weights.
+
+    Args:
+        indexer_model (str): The name of the indexer model.
+
+    Returns:
+        RAGMultiModalModel: The shared encoder.
+    """
+    encoder = _encoders.get(indexer_model)
+    if encoder is not None:
+        return encoder
+    with _encoders_lock:
+        if indexer_model not in _encoders:
+            encoder = RAGMultiModalModel.from_pretrained(indexer_model)
+            if encoder is None:
+                raise ValueError(f"Failed to initialize RAGMultiModalModel with model {indexer_model}")
+            _encoders[indexer_model] = encoder
+            logger.info("Encoder '%s' loaded and shared.", indexer_model)
+        return _encoders[indexer_model]
+
+def new_index_model(indexer_model, index_root='.byaldi'):
+    """
+    Creates an empty RAG model that shares the encoder weights of indexer_model.
+
+    Args:
+        indexer_model (str): The name of the indexer model.
+        index_root (str): The directory the index will be exported under.
+
+    Returns:
+        RAGMultiModalModel: A model ready for RAG.index().
+    """
+    encoder = get_encoder(indexer_model)
+    # A shallow copy shares the torch model and processor but gets its own index state.
+    colpali = copy.copy(encoder.model)
+    colpali.index_root = index_root
+    colpali.index_name = None
+    colpali.collection = {}
+    colpali.indexed_embeddings = []
+    colpali.embed_id_to_doc_id = {}
+    colpali.doc_id_to_metadata = {}
+    colpali.doc_ids_to_file_names = {}
+    colpali.doc_ids = set()
+    colpali.highest_doc_id = -1
+    RAG = RAGMultiModalModel.__new__(RAGMultiModalModel)
+    RAG.model = colpali
+    # "doc_id:page_id" -> path of pages kept in the page store instead of the collection
+    RAG.page_refs = {}
+    # Keys caches of query embeddings, which only depend on the encoder
+    RAG.indexer_model = indexer_model
+    return RAG
+
+def _read_json(index_dir, name):
+    gz_path = os.path.join(index_dir, name + '.gz')
+    if os.path.exists(gz_path):
+        with gzip.open(gz_path, 'rt') as f:
+            return json.load(f)
+    plain_path = os.path.join(index_dir, name)
+    if os.path.exists(plain_path):
+        with open(plain_path, 'r') as f:
+            return json.load(f)
+    return {}
+
+def _chunk_files(chunk_dir, suffix):
+    if not os.path.isdir(chunk_dir):
+        return []
+    names = [n for n in os.listdir(chunk_dir) if n.endswith(suffix)]
+    # Chunks are named by their starting offset, e.g. embeddings_500.pt or 500.json.gz
+    return sorted(names, key=lambda n: int(n[:-len(suffix)].split('_')[-1]))
+
+def index_is_stale(RAG, index_path):
+    """
+    Whether a newer version of a loaded index has been swapped in on disk
+    since it was loaded, e.g. by the indexing job of another worker.
+
+    Args:
+        RAG (RAGMultiModalModel): An index returned by load_index.
+        index_path (str): The path the index was loaded from.
+
+    Returns:
+        bool: True if index_path now resolves to another version.
+    """
+    loaded = getattr(RAG, 'index_path', None)
+    return loaded is not None and os.path.realpath(index_path) != loaded
+
+def load_index(index_path, mmap=True):
+    """
+    Loads an index from disk onto the shared encoder of the model it was built with.
+
+    This reads the same files as RAGMultiModalModel.from_index but does not
+    instantiate a new copy of the encoder weights. Page embeddings are mapped
+    read-only from the flat embedding files when the index has them, so
+    every worker on a host shares one copy through the page cache.
+
+    Args:
+        index_path (str): The directory of the index on disk.
+        mmap (bool): Whether to map the flat embedding files. Indexes that
+            will be modified and exported again must be loaded into memory.
+
+    Returns:
+        RAGMultiModalModel: The RAG model with the indexed documents.
+    """
+    start = time.perf_counter()
+    index_name = os.path.basename(os.path.abspath(index_path))
+    # Resolved once, so every file is read from the same version even if a new one is swapped in
+    index_path = os.path.realpath(index_path)
+    index_config = _read_json(index_path, 'index_config.json')
+    if 'model_name' not in index_config:
+        raise ValueError(f"No index config found at '{index_path}'")
+
+    RAG = new_index_model(index_config['model_name'], index_root=os.path.dirname(index_path))
+    colpali = RAG.model
+    colpali.index_name = index_name
+    colpali.full_document_collection = index_config.get('full_document_collection', False)
+    colpali.resize_stored_images = index_config.get('resize_stored_images', False)
+    colpali.max_image_width = index_config.get('max_image_width')
+    colpali.max_image_height = index_config.get('max_image_height')
+
+    colpali.embed_id_to_doc_id = {int(k): v for k, v in _read_json(index_path, 'embed_id_to_doc_id.json').items()}
+    mapped = load_embeddings(index_path, count=len(colpali.embed_id_to_doc_id)) if mmap else None
+    if mapped is not None:
+        colpali.indexed_embeddings = mapped
+    else:
+        embeddings_dir = os.path.join(index_path, 'embeddings')
+        for name in _chunk_files(embeddings_dir, '.pt'):
+            colpali.indexed_embeddings.extend(torch.load(os.path.join(embeddings_dir, name), map_location='cpu'))
+        if mmap and MMAP_EMBEDDINGS and colpali.indexed_embeddings:
+            # Indexes built before flat files existed get them on first load
+            try:
+                write_embeddings(index_path, colpali.indexed_embeddings)
+                mapped = load_embeddings(index_path, count=len(colpali.embed_id_to_doc_id))
+            except OSError as e:
+                logger.warning("Could not write flat embeddings for '%s': %s", index_path, e)
+            if mapped is not None:
+                colpali.indexed_embeddings = mapped
+    # Mapped embeddings live in the shared page cache rather than this process's heap
+    RAG.embeddings_mapped = mapped is not None
+
+    colpali.doc_ids = set(int(entry['doc_id']) for entry in colpali.embed_id_to_doc_id.values())
+    colpali.highest_doc_id = index_config.get('highest_doc_id', max(colpali.doc_ids, default=-1))
+    colpali.doc_ids_to_file_names = {int(k): v for k, v in _read_json(index_path, 'doc_ids_to_file_names.json').items()}
+    colpali.doc_id_to_metadata = {int(k): v for k, v in _read_json(index_path, 'metadata.json').items()}
+
+    if colpali.full_document_collection:
+        collection_dir = os.path.join(index_path, 'collection')
+        for name in _chunk_files(collection_dir, '.json.gz'):
+            with gzip.open(os.path.join(collection_dir, name), 'rt') as f:
+                colpali.collection.update({int(k): v for k, v in json.load(f).items()})
+
+    RAG.page_refs = _read_json(index_path, PAGE_REFS_FILENAME)
+
+    # Bumped by every indexing run; used to key caches of results against this index
+    manifest = _read_json(index_path, 'manifest.json')
+    RAG.index_version = manifest.get('version', 0)
+    RAG.indexer_model = manifest.get('indexer_model') or index_config['model_name']
+    # The version directory read, so a newer version swapped in on disk can be detected
+    RAG.index_path = index_path
+
+    INDEX_LOAD_SECONDS.observe(time.perf_counter() - start)
+    logger.info("Index '%s' loaded with %d pages (%s) on shared encoder '%s'.", colpali.index_name,
+                len(colpali.indexed_embeddings), 'mapped' if RAG.embeddings_mapped else 'in memory',
+                index_config['model_name'])
+    return RAG
@@ -0,0 +1,83 @@
+# models/executors.py
+
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+class ExecutorSaturatedError(Exception):
+    """
+    Raised when a BoundedExecutor has no room for another task.
+
+    Attributes:
+        retry_after (int): Suggested seconds to wait before retrying.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class BoundedExecutor:
+    """
+    Thread pool that rejects work instead of queueing it without limit.
+
+    At most max_workers tasks run at once and at most max_queue more wait;
+    beyond that submit raises ExecutorSaturatedError with a retry hint based
+    on the recent average task duration.
+
+    Args:
+        name (str): The name used for worker threads and in log messages.
+        max_workers (int): The number of tasks that may run concurrently.
+        max_queue (int): The number of tasks that may wait for a worker.
+    """
+
+    def __init__(self, name, max_workers, max_queue):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_in_flight = max_workers + max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._in_flight = 0
+        self._avg_seconds = None
+        self._lock = threading.Lock()
+
+    def depth(self):
+        with self._lock:
+            return self._in_flight
+
+    def retry_after(self):
+        with self._lock:
+            avg = self._avg_seconds or 1.0
+            return max(1, math.ceil(avg * self._in_flight / self.max_workers))
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules fn(*args, **kwargs) and returns a concurrent.futures.Future.
+
+        Raises:
+            ExecutorSaturatedError: If max_workers + max_queue tasks are already in flight.
+        """
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                full = True
+            else:
+                full = False
+                self._in_flight += 1
+        if full:
+            retry_after = self.retry_after()
+            logger.warning("%s is saturated; rejecting task (retry after %ss).", self.name, retry_after)
+            raise ExecutorSaturatedError(f"{self.name} is busy, retry later.", retry_after)
+        return self._executor.submit(self._run, fn, args, kwargs)
+
+    def _run(self, fn, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._in_flight -= 1
+                # Exponentially weighted average of task duration, for retry hints
+                self._avg_seconds = elapsed if self._avg_seconds is None else 0.8 * self._avg_seconds + 0.2 * elapsed
@@ -1,48 +1,483 @@
 # models/indexer.py
 
 import os
-from byaldi import RAGMultiModalModel
-from models.converters import convert_docs_to_pdfs
+import json
+import shutil
+import hashlib
+import tempfile
+from models.converters import convert_docs_to_pdfs, converted_pdfs
+from models.encoders import PAGE_REFS_FILENAME, new_index_model, load_index
+from models.page_store import store_indexed_page, collect_indexed_pages, referenced_pages
+from models.embedding_store import MMAP_EMBEDDINGS, write_embeddings, remove_embeddings
 from logger import get_logger
 
 logger = get_logger(__name__)
 
-def index_documents(folder_path, index_name='document_index', index_path=None, indexer_model='vidore/colpali'):
+# File types Byaldi can embed directly
+INDEXABLE_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+
+# Per-index manifest of indexed files, stored next to the .byaldi index files
+MANIFEST_FILENAME = 'manifest.json'
+
+# Where page images are kept: 'index' stores them base64 in the index (held in
+# memory while it is loaded); 'page_store' writes them to the page store at
+# index time and keeps only their paths in the index
+PAGE_STORAGE = os.getenv('PAGE_STORAGE', 'index')
+
+def file_hash(file_path, chunk_size=1024 * 1024):
+    """
+    Computes the SHA-256 hash of a file's contents.
+
+    Args:
+        file_path (str): The path to the file.
+        chunk_size (int): The number of bytes to read at a time.
+
+    Returns:
+        str: The hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(index_dir):
+    """
+    Loads the manifest of an index, or None if it has none.
+
+    Args:
+        index_dir (str): The directory of the index on disk.
+
+    Returns:
+        dict: The manifest, or None.
+    """
+    manifest_path = os.path.join(index_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read manifest '%s': %s", manifest_path, e)
+        return None
+
+def save_manifest(index_dir, manifest):
+    """
+    Atomically writes the manifest of an index.
+
+    Args:
+        index_dir (str): The directory of the index on disk.
+        manifest (dict): The manifest to write.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    manifest_path = os.path.join(index_dir, MANIFEST_FILENAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def scan_folder(folder_path):
+    """
+    Hashes every indexable file in the folder.
+
+    Args:
+        folder_path (str): The path to the folder containing documents.
+
+    Returns:
+        dict: Mapping of filename to its content hash.
+    """
+    files = {}
+    for filename in sorted(os.listdir(folder_path)):
+        file_path = os.path.join(folder_path, filename)
+        if os.path.isfile(file_path) and filename.lower().endswith(INDEXABLE_EXTENSIONS):
+            files[filename] = file_hash(file_path)
+    return files
+
+def diff_manifest(entries, files):
+    """
+    Compares the files recorded in a manifest with the files now in the folder.
+
+    Args:
+        entries (dict): The manifest's files, mapping filename to its entry.
+        files (dict): Mapping of filename to content hash, as from scan_folder.
+
+    Returns:
+        tuple: The indexed files that were changed or removed, and the files
+            to index, i.e. the new ones and the changed ones.
+    """
+    stale = [name for name, entry in entries.items() if files.get(name) != entry['sha256']]
+    added = [name for name in files if name not in entries or name in stale]
+    return stale, added
+
+def indexed_documents(folder_path, index_dir):
+    """
+    Returns the uploaded documents an index covers: the files in its
+    manifest, with PDFs converted from Word documents reported as the
+    document they were converted from.
+
+    Args:
+        folder_path (str): The folder the index was built from.
+        index_dir (str): The directory of the index on disk.
+
+    Returns:
+        list: Sorted filenames.
+    """
+    manifest = load_manifest(index_dir) or {}
+    sources = converted_pdfs(folder_path)
+    return sorted(set(sources.get(name, name) for name in manifest.get('files', {})))
+
+def render_pages(file_path):
+    """
+    Renders the pages of a PDF or image file, one at a time.
+
+    Yields:
+        tuple: The 1-based page number and the page image.
+    """
+    from PIL import Image
+    if file_path.lower().endswith('.pdf'):
+        from pdf2image import convert_from_path
+        with tempfile.TemporaryDirectory() as output_folder:
+            paths = convert_from_path(file_path, thread_count=max((os.cpu_count() or 2) - 1, 1),
+                                      output_folder=output_folder, paths_only=True)
+            for page_id, path in enumerate(paths, start=1):
+                with Image.open(path) as image:
+                    image.load()
+                    yield page_id, image
+    else:
+        with Image.open(file_path) as image:
+            image.load()
+            yield 1, image
+
+def _add_file(RAG, file_path, page_storage='index'):
+    """
+    Embeds a file page by page into an already initialised index.
+
+    In 'index' storage each page is kept base64 in the index collection; in
+    'page_store' storage it is written to the page store and its path is
+    recorded in RAG.page_refs. The index is not exported: Byaldi's
+    add_to_index would rewrite the whole index after every file, so the
+    caller exports it once all files are added.
+
+    Returns:
+        tuple: The doc_id assigned and the number of pages embedded.
+    """
+    colpali = RAG.model
+    doc_id = colpali.highest_doc_id + 1
+    store_collection = page_storage == 'index'
+    pages = 0
+    for page_id, image in render_pages(file_path):
+        if not store_collection:
+            RAG.page_refs[f"{doc_id}:{page_id}"] = store_indexed_page(image)
+        colpali._add_to_index(image, store_collection, doc_id, page_id=page_id)
+        pages += 1
+    if not pages:
+        raise ValueError(f"No pages rendered from '{file_path}'")
+    colpali.doc_ids.add(doc_id)
+    colpali.doc_ids_to_file_names[doc_id] = str(file_path)
+    return doc_id, pages
+
+def remove_documents(RAG, doc_ids):
+    """
+    Drops every page of the given documents from a loaded index.
+
+    Embedding ids are positions in the embeddings list, so the remaining pages
+    are renumbered to keep them contiguous.
+
+    Args:
+        RAG (RAGMultiModalModel): The RAG model with the indexed documents.
+        doc_ids (iterable): The doc_ids to remove.
+
+    Returns:
+        int: The number of pages removed.
+    """
+    doc_ids = set(int(d) for d in doc_ids)
+    if not doc_ids:
+        return 0
+    colpali = RAG.model
+    embeddings, embed_id_to_doc_id, collection = [], {}, {}
+    removed = 0
+    for embed_id in range(len(colpali.indexed_embeddings)):
+        entry = colpali.embed_id_to_doc_id[embed_id]
+        if int(entry['doc_id']) in doc_ids:
+            removed += 1
+            continue
+        new_id = len(embeddings)
+        embeddings.append(colpali.indexed_embeddings[embed_id])
+        embed_id_to_doc_id[new_id] = entry
+        if embed_id in colpali.collection:
+            collection[new_id] = colpali.collection[embed_id]
+    colpali.indexed_embeddings = embeddings
+    colpali.embed_id_to_doc_id = embed_id_to_doc_id
+    colpali.collection = collection
+    for doc_id in doc_ids:
+        colpali.doc_ids.discard(doc_id)
+        colpali.doc_ids_to_file_names.pop(doc_id, None)
+        colpali.doc_id_to_metadata.pop(doc_id, None)
+    # Page references are keyed by doc_id, which is not renumbered
+    page_refs = getattr(RAG, 'page_refs', {})
+    for key in [key for key in page_refs if int(key.split(':')[0]) in doc_ids]:
+        del page_refs[key]
+    return removed
+
+def _clear_chunk_files(index_dir):
+    # Byaldi exports embeddings and the collection in numbered chunks; when an
+    # index shrinks, chunks from the larger version would otherwise be reloaded.
+    for sub in ('embeddings', 'collection'):
+        chunk_dir = os.path.join(index_dir, sub)
+        if os.path.isdir(chunk_dir):
+            for name in os.listdir(chunk_dir):
+                os.remove(os.path.join(chunk_dir, name))
+
+def count_pages(file_path):
+    """
+    Counts the pages Byaldi will embed for a file.
+
+    Args:
+        file_path (str): The path to a PDF or image file.
+
+    Returns:
+        int: The number of pages.
+    """
+    if file_path.lower().endswith('.pdf'):
+        from pdf2image import pdfinfo_from_path
+        return int(pdfinfo_from_path(file_path)['Pages'])
+    return 1
+
+def _full_index(folder_path, files, index_dir, indexer_model, progress, page_storage='index'):
+    """
+    Builds a new index from scratch and returns it with its manifest entries.
+    """
+    # Reuses the resident encoder for indexer_model instead of loading new weights
+    RAG = new_index_model(indexer_model, index_root=os.path.dirname(os.path.abspath(index_dir)))
+    logger.info("RAG model initialized with %s.", indexer_model)
+
+    colpali = RAG.model
+    colpali.index_name = os.path.basename(index_dir)
+    colpali.full_document_collection = page_storage == 'index'
+    colpali.max_image_width = None
+    colpali.max_image_height = None
+    entries = {}
+    for filename in files:
+        doc_id, pages = _add_file(RAG, os.path.join(folder_path, filename), page_storage)
+        entries[filename] = {'sha256': files[filename], 'doc_id': doc_id, 'pages': pages}
+        progress(pages)
+    # Exported once, so building N files writes the index once rather than N times
+    colpali._export_index()
+    return RAG, entries
+
+def _version_dir(index_dir, version):
+    return f"{index_dir}.v{version}"
+
+def _version_dirs(index_dir):
+    # {version: directory} of every version of the index kept on disk
+    parent, name = os.path.split(index_dir)
+    versions = {}
+    for entry in os.listdir(parent) if os.path.isdir(parent) else []:
+        suffix = entry[len(name) + 2:] if entry.startswith(name + '.v') else ''
+        if suffix.isdigit():
+            versions[int(suffix)] = os.path.join(parent, entry)
+    return versions
+
+def _swap_in(staging_dir, index_dir, version):
+    """
+    Publishes staging_dir as the given version of the index.
+
+    Each version lives in its own directory next to index_dir, and index_dir
+    is a symlink to the current one that is replaced atomically, so it always
+    resolves to a complete index. The previous version is kept for readers
+    still loading it; older ones are removed.
+    """
+    version_dir = _version_dir(index_dir, version)
+    if os.path.lexists(version_dir):
+        shutil.rmtree(version_dir)
+    os.rename(staging_dir, version_dir)
+    if os.path.isdir(index_dir) and not os.path.islink(index_dir):
+        # An index from before versioned directories is moved aside once; a directory
+        # cannot be replaced by a symlink atomically, so this is the only swap with a gap
+        os.rename(index_dir, _version_dir(index_dir, version - 1))
+    link_path = f"{index_dir}.{os.getpid()}.link"
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(os.path.basename(version_dir), link_path)
+    os.replace(link_path, index_dir)
+
+    for number, path in _version_dirs(index_dir).items():
+        if number < version - 1:
+            shutil.rmtree(path, ignore_errors=True)
+    if os.path.exists(index_dir + '.old'):
+        shutil.rmtree(index_dir + '.old', ignore_errors=True)
+
+def indexed_page_refs(index_root):
+    """
+    Returns the page paths that the indexes under index_root refer to,
+    including the previous versions kept for readers still loading them.
+
+    Returns:
+        set: Page paths relative to the static folder.
+    """
+    pages = set()
+    if not os.path.isdir(index_root):
+        return pages
+    for entry in os.listdir(index_root):
+        page_refs_path = os.path.join(index_root, entry, PAGE_REFS_FILENAME)
+        if os.path.islink(os.path.join(index_root, entry)) or not os.path.exists(page_refs_path):
+            continue
+        with open(page_refs_path, 'r') as f:
+            pages.update(json.load(f).values())
+    return pages
+
+def _collect_unreferenced_pages(index_root):
+    # Pages dropped from an index stay referenced by the previous version kept
+    # next to it, so they are collected once the version after that is swapped in
+    try:
+        collect_indexed_pages(indexed_page_refs(index_root), referenced=referenced_pages())
+    except Exception as e:
+        logger.error("Indexed page GC failed: %s", e)
+
+def delete_index(index_dir):
+    """
+    Removes every version of an index, then the indexed pages that no other
+    index or chat history refers to.
+
+    Args:
+        index_dir (str): The index path, a symlink to its current version.
+    """
+    index_dir = os.path.abspath(index_dir)
+    for path in list(_version_dirs(index_dir).values()) + [index_dir + '.staging', index_dir + '.old']:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+    if os.path.islink(index_dir):
+        os.remove(index_dir)
+    elif os.path.isdir(index_dir):
+        shutil.rmtree(index_dir, ignore_errors=True)
+    _collect_unreferenced_pages(os.path.dirname(index_dir))
+
+def index_documents(folder_path, index_name='document_index', index_path=None, indexer_model='vidore/colpali',
+                    incremental=True, progress_callback=None, page_storage=None):
     """
     Indexes documents in the specified folder using Byaldi.
 
+    With incremental indexing, a manifest of file hashes is kept next to the
+    index and only new or changed files are embedded; pages of deleted or
+    replaced files are dropped from the existing index. The new version is
+    built in a staging directory and swapped in when complete, so the
+    previous version stays usable until then. The index path is a symlink
+    to the directory of the current version.
+
     Args:
         folder_path (str): The path to the folder containing documents to index.
         index_name (str): The name of the index to create or update.
         index_path (str): The path where the index should be saved.
         indexer_model (str): The name of the indexer model to use.
+        incremental (bool): Whether to update an existing index in place.
+        progress_callback (callable): Called with (pages_embedded, pages_total).
+        page_storage (str): 'index' or 'page_store'; PAGE_STORAGE by default.
 
     Returns:
         RAGMultiModalModel: The RAG model with the indexed documents.
     """
+    page_storage = page_storage or PAGE_STORAGE
+    if page_storage not in ('index', 'page_store'):
+        raise ValueError(f"Unknown page storage '{page_storage}'")
     try:
-        logger.info(f"Starting document indexing in folder: {folder_path}")
+        logger.info("Starting document indexing in folder: %s", folder_path)
         # Convert non-PDF documents to PDFs
         convert_docs_to_pdfs(folder_path)
         logger.info("Conversion of non-PDF documents to PDFs completed.")
 
-        # Initialize RAG model
-        RAG = RAGMultiModalModel.from_pretrained(indexer_model)
-        if RAG is None:
-            raise ValueError(f"Failed to initialize RAGMultiModalModel with model {indexer_model}")
-        logger.info(f"RAG model initialized with {indexer_model}.")
+        index_dir = os.path.abspath(index_path or os.path.join('.byaldi', index_name))
+        staging_dir = index_dir + '.staging'
+        files = scan_folder(folder_path)
+        if not files:
+            raise ValueError(f"No indexable documents found in '{folder_path}'")
+
+        previous_manifest = load_manifest(index_dir)
+        manifest = previous_manifest if incremental else None
+        if manifest is not None and manifest.get('indexer_model') != indexer_model:
+            logger.info("Indexer model changed from '%s' to '%s', rebuilding index.",
+                        manifest.get('indexer_model'), indexer_model)
+            manifest = None
+        if manifest is not None and manifest.get('page_storage', 'index') != page_storage:
+            logger.info("Page storage changed from '%s' to '%s', rebuilding index.",
+                        manifest.get('page_storage', 'index'), page_storage)
+            manifest = None
+
+        entries = dict(manifest.get('files', {})) if manifest is not None else {}
+        stale, added = diff_manifest(entries, files)
+
+        if manifest is not None and not stale and not added:
+            logger.info("Index '%s' is up to date.", index_name)
+            if progress_callback is not None:
+                # Nothing to embed; report the job as complete
+                progress_callback(0, 0)
+            return load_index(index_dir)
+
+        pages_total = sum(count_pages(os.path.join(folder_path, name)) for name in added)
+        pages_embedded = 0
+
+        def progress(pages):
+            nonlocal pages_embedded
+            pages_embedded += pages
+            if progress_callback is not None:
+                progress_callback(pages_embedded, pages_total)
+
+        progress(0)
+        if os.path.exists(staging_dir):
+            shutil.rmtree(staging_dir)
+
+        if manifest is None:
+            RAG, entries = _full_index(folder_path, files, staging_dir, indexer_model, progress, page_storage)
+            logger.info("Full index built with %d files.", len(entries))
+        else:
+            shutil.copytree(os.path.realpath(index_dir), staging_dir)
+            # In memory, since the embeddings are exported again from this copy
+            RAG = load_index(staging_dir, mmap=False)
+
+            removed = remove_documents(RAG, [entries[name]['doc_id'] for name in stale])
+            for name in stale:
+                del entries[name]
+
+            _clear_chunk_files(staging_dir)
+            if added:
+                for filename in added:
+                    doc_id, pages = _add_file(RAG, os.path.join(folder_path, filename), page_storage)
+                    entries[filename] = {'sha256': files[filename], 'doc_id': doc_id, 'pages': pages}
+                    progress(pages)
+                    logger.info("Embedded '%s' (%d pages).", filename, pages)
+            RAG.model._export_index()
+            logger.info("Incremental index update: %d files embedded, %d files dropped (%d pages).",
+                        len(added), len(stale), removed)
+
+        # Versions keep increasing across full rebuilds so caches never confuse two builds
+        version = max([(previous_manifest or {}).get('version', 0), *_version_dirs(index_dir)]) + 1
 
-        # Index the documents in the folder
-        RAG.index(
-            input_path=folder_path,
-            index_name=index_name,
-            store_collection_with_index=True,
-            overwrite=True
-        )
+        if MMAP_EMBEDDINGS:
+            write_embeddings(staging_dir, RAG.model.indexed_embeddings)
+        else:
+            remove_embeddings(staging_dir)
+        page_refs_path = os.path.join(staging_dir, PAGE_REFS_FILENAME)
+        if RAG.page_refs:
+            with open(page_refs_path, 'w') as f:
+                json.dump(RAG.page_refs, f)
+        elif os.path.exists(page_refs_path):
+            os.remove(page_refs_path)
+        save_manifest(staging_dir, {
+            'indexer_model': indexer_model,
+            'page_storage': page_storage,
+            'version': version,
+            'files': entries
+        })
+        _swap_in(staging_dir, index_dir, version)
+        # Reloaded from the published version, so the copy callers cache maps the shared
+        # flat embeddings instead of keeping the build's copy on the heap
+        del RAG
+        RAG = load_index(index_dir)
+        if previous_manifest is not None:
+            _collect_unreferenced_pages(os.path.dirname(index_dir))
 
-        logger.info(f"Indexing completed. Index saved at '{index_path}'.")
+        logger.info("Indexing completed. Index version %d saved at '%s'.", version, index_dir)
 
         return RAG
     except Exception as e:
-        logger.error(f"Error during indexing: {str(e)}")
-        raise
\ No newline at end of file
+        logger.error("Error during indexing: %s", e)
+        raise
@@ -0,0 +1,146 @@
+# models/jobs.py
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from models.indexer import index_documents
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+class QueueFullError(Exception):
+    """Raised when the indexing queue has no room for another job."""
+
+class IndexingJob:
+    """
+    State of one background indexing run for a session.
+    """
+
+    def __init__(self, session_id, folder_path, index_path, indexer_model):
+        self.job_id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.folder_path = folder_path
+        self.index_path = index_path
+        self.indexer_model = indexer_model
+        self.state = 'queued'
+        self.pages_embedded = 0
+        self.pages_total = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        pages_remaining = None
+        if self.pages_total is not None:
+            pages_remaining = max(self.pages_total - self.pages_embedded, 0)
+        return {
+            'job_id': self.job_id,
+            'session_id': self.session_id,
+            'state': self.state,
+            'pages_embedded': self.pages_embedded,
+            'pages_total': self.pages_total,
+            'pages_remaining': pages_remaining,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+class IndexingJobQueue:
+    """
+    Runs index_documents in a bounded pool of background workers.
+
+    Jobs for the same session run one at a time. When a job succeeds, the new
+    index is handed to on_complete, which is expected to swap it into the
+    registry of loaded indexes; until then queries keep using the old one.
+
+    Args:
+        max_workers (int): The number of jobs that may run concurrently.
+        max_pending (int): The maximum number of queued or running jobs.
+        on_complete (callable): Called with (job, RAG) after a successful run.
+        retention_seconds (float): How long finished jobs stay queryable.
+    """
+
+    def __init__(self, max_workers=1, max_pending=16, on_complete=None, retention_seconds=3600):
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self.on_complete = on_complete
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='indexer')
+        self._jobs = {}
+        self._session_locks = {}  # session_id -> [lock, jobs queued or running for the session]
+        self._lock = threading.Lock()
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.state in ('queued', 'running'))
+
+    def submit(self, session_id, folder_path, index_path, indexer_model, on_complete=None):
+        """
+        Queues an indexing job for a session.
+
+        Returns:
+            IndexingJob: The queued job.
+
+        Raises:
+            QueueFullError: If max_pending jobs are already queued or running.
+        """
+        job = IndexingJob(session_id, folder_path, index_path, indexer_model)
+        with self._lock:
+            self._prune()
+            active = sum(1 for j in self._jobs.values() if j.state in ('queued', 'running'))
+            if active >= self.max_pending:
+                raise QueueFullError(f"Indexing queue is full ({active} jobs pending).")
+            self._jobs[job.job_id] = job
+            entry = self._session_locks.setdefault(session_id, [threading.Lock(), 0])
+            entry[1] += 1
+        self._executor.submit(self._run, job, entry[0], on_complete or self.on_complete)
+        logger.info("Queued indexing job %s for session %s.", job.job_id, session_id)
+        return job
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [j.job_id for j in self._jobs.values() if j.finished_at is not None and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def _run(self, job, session_lock, on_complete):
+        with session_lock:
+            job.state = 'running'
+            job.started_at = time.time()
+
+            def progress(pages_embedded, pages_total):
+                job.pages_embedded = pages_embedded
+                job.pages_total = pages_total
+
+            try:
+                RAG = index_documents(job.folder_path, index_name=job.session_id, index_path=job.index_path,
+                                      indexer_model=job.indexer_model, progress_callback=progress)
+                if on_complete is not None:
+                    on_complete(job, RAG)
+                job.state = 'done'
+                logger.info("Indexing job %s finished in %.1fs.", job.job_id, time.time() - job.started_at)
+            except Exception as e:
+                job.state = 'failed'
+                job.error = str(e)
+                logger.error("Indexing job %s failed: %s", job.job_id, e)
+            finally:
+                job.finished_at = time.time()
+        self._release_session_lock(job.session_id)
+
+    def _release_session_lock(self, session_id):
+        # Dropped once no job of the session is queued or running, so the dict does not grow per session
+        with self._lock:
+            entry = self._session_locks[session_id]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._session_locks[session_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs_for_session(self, session_id):
+        with self._lock:
+            return sorted((job for job in self._jobs.values() if job.session_id == session_id),
+                          key=lambda job: job.created_at)
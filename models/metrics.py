@@ -0,0 +1,187 @@
+# models/metrics.py
+
+import time
+import bisect
+import weakref
+import threading
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from cache hits up to cold model loads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_metrics = []
+_metrics_lock = threading.Lock()
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._lock = threading.Lock()
+        self._values = {}
+        with _metrics_lock:
+            _metrics.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        if self.collect is not None:
+            for labels, value in self.collect():
+                self._set(value, **labels)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    """
+    A monotonically increasing count, e.g. of errors per backend. If
+    collect is given, it is called at render time and returns (labels dict,
+    value) pairs read from counts kept elsewhere, e.g. cache hits.
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down. If collect is given, it is called at
+    render time and returns (labels dict, value) pairs, e.g. queue depths.
+    """
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self._set(value, **labels)
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, e.g. the latency of a pipeline stage.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the with block, including when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_sample(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+# Pipeline stages
+INDEX_LOAD_SECONDS = Histogram('resumebot_index_load_seconds', 'Time to load a session index from disk.')
+QUERY_ENCODE_SECONDS = Histogram('resumebot_query_encode_seconds', 'Time to encode a batch of queries.')
+SEARCH_SECONDS = Histogram('resumebot_search_seconds', 'Time to score queries against an index.')
+PAGE_MATERIALIZE_SECONDS = Histogram('resumebot_page_materialize_seconds',
+                                     'Time to write the retrieved pages of one query to the page store.')
+PREPROCESS_SECONDS = Histogram('resumebot_generation_preprocess_seconds',
+                               'Time to turn pages and a query into backend inputs.', ['backend'])
+GENERATION_SECONDS = Histogram('resumebot_generation_seconds', 'Time to generate a response.', ['backend'])
+GENERATION_ERRORS = Counter('resumebot_generation_errors_total', 'Failed generations.', ['backend'])
+SESSION_IO_SECONDS = Histogram('resumebot_session_io_seconds', 'Time spent reading and writing session files.',
+                               ['operation'])
+
+# Caches, read from their own counters at scrape time
+_caches = weakref.WeakSet()
+
+def register_cache(cache):
+    """
+    Exposes an LRUCache's hit, miss and eviction counters and its occupancy.
+    """
+    _caches.add(cache)
+
+def _cache_stat(stat):
+    def collect():
+        return [({'cache': cache.name}, cache.stats()[stat]) for cache in list(_caches)]
+    return collect
+
+CACHE_HITS = Counter('resumebot_cache_hits_total', 'Lookups served from cache.', ['cache'], _cache_stat('hits'))
+CACHE_MISSES = Counter('resumebot_cache_misses_total', 'Lookups not served from cache.', ['cache'],
+                       _cache_stat('misses'))
+CACHE_EVICTIONS = Counter('resumebot_cache_evictions_total', 'Entries evicted from cache.', ['cache'],
+                          _cache_stat('evictions'))
+CACHE_ENTRIES = Gauge('resumebot_cache_entries', 'Entries currently cached.', ['cache'], _cache_stat('entries'))
+CACHE_BYTES = Gauge('resumebot_cache_bytes', 'Estimated bytes currently cached.', ['cache'], _cache_stat('bytes'))
+
+# Queues; each source reports its depth through a callable
+_queues = {}
+
+def register_queue(name, depth):
+    """
+    Exposes the depth of a queue, read by calling depth() at scrape time.
+    """
+    _queues[name] = depth
+
+QUEUE_DEPTH = Gauge('resumebot_queue_depth', 'Requests waiting or running in a queue.', ['queue'],
+                    lambda: [({'queue': name}, depth()) for name, depth in list(_queues.items())])
+
+def render_metrics():
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    with _metrics_lock:
+        metrics = list(_metrics)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -1,14 +1,13 @@
 # models/model_loader.py
 
 import os
-import torch
-from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
-from transformers import MllamaForConditionalGeneration
-from vllm.sampling_params import SamplingParams
-from transformers import AutoModelForCausalLM
-import google.generativeai as genai
-from vllm import LLM
-from groq import Groq
+import gc
+import sys
+import time
+import json
+import importlib
+import threading
+import subprocess
 
 from dotenv import load_dotenv
 
@@ -16,16 +15,297 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from logger import get_logger
+from models.cache import LRUCache
+from models.clients import gemini_model, groq_client, openai_client
 
 logger = get_logger(__name__)
 
-# Cache for loaded models
-_model_cache = {}
+def _default_model_budget():
+    # 60% of physical memory, where the platform reports it
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') * 0.6)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+# Memory budget for resident generation models, and models that are never evicted
+MODEL_CACHE_MAX_BYTES = int(os.getenv('MODEL_CACHE_MAX_BYTES', 0)) or _default_model_budget()
+PINNED_MODELS = [name.strip() for name in os.getenv('PINNED_MODELS', '').split(',') if name.strip()]
+
+def model_resident_size(loaded):
+    """
+    Estimates the resident size in bytes of a loaded backend from the
+    parameters and buffers of the torch modules it holds.
+    """
+    parts = loaded if isinstance(loaded, tuple) else (loaded,)
+    size = 0
+    for part in parts:
+        if hasattr(part, 'parameters') and hasattr(part, 'buffers'):
+            for tensor in list(part.parameters()) + list(part.buffers()):
+                size += tensor.element_size() * tensor.nelement()
+            for module in part.modules():
+                # Dynamically quantized layers keep packed int8 weights outside parameters()
+                if callable(getattr(module, 'weight', None)) and hasattr(module, '_packed_params'):
+                    weight = module.weight()
+                    size += weight.element_size() * weight.nelement()
+    return size
+
+def _on_model_evicted(model_choice, loaded):
+    logger.info("Evicting model '%s' (%.2f GiB) from cache.", model_choice,
+                model_resident_size(loaded) / 1024 ** 3)
+    _loaded_precisions.pop(model_choice, None)
+
+def _release_memory():
+    """
+    Frees the tensors of evicted models once no request holds them any more.
+    """
+    start = time.perf_counter()
+    gc.collect()
+    if 'torch' in sys.modules:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        if hasattr(torch, 'mps') and torch.backends.mps.is_available():
+            torch.mps.empty_cache()
+    logger.info("Released memory of evicted models in %.2fs.", time.perf_counter() - start)
+
+# Cache for loaded models, least recently used evicted first when over budget
+_model_cache = LRUCache(max_bytes=MODEL_CACHE_MAX_BYTES, sizeof=model_resident_size,
+                        on_evict=_on_model_evicted, name='model cache')
+for _name in PINNED_MODELS:
+    _model_cache.pin(_name)
+
+# Last measured size of each backend, used to make room before loading it again
+_model_sizes = {}
+
+# Serialises first loads of cached models, so the room made for one load is not
+# taken by another and a model is never loaded twice by concurrent callers
+_load_lock = threading.Lock()
+
+def pin_model(model_choice):
+    """
+    Keeps a model resident regardless of the memory budget, e.g. the default model.
+    """
+    _model_cache.pin(model_choice)
+
+def unpin_model(model_choice):
+    _model_cache.unpin(model_choice)
+
+def model_cache_stats():
+    return _model_cache.stats()
+
+# Numeric precision of local backends: 'auto', 'fp32', 'fp16', 'bf16', 'int8-dynamic'
+# (int8 linear layers quantized at load), or 'int8-weight' / 'int4-weight'
+# (weight-only, needs optimum-quanto). Per-backend overrides use the form
+# MODEL_PRECISIONS="qwen=bf16,molmo=int8-dynamic".
+PRECISIONS = ('auto', 'fp32', 'fp16', 'bf16', 'int8-dynamic', 'int8-weight', 'int4-weight')
+MODEL_PRECISION = os.getenv('MODEL_PRECISION', 'auto').lower()
+MODEL_PRECISIONS = dict(
+    (name.strip(), precision.strip().lower())
+    for name, _, precision in (item.partition('=') for item in os.getenv('MODEL_PRECISIONS', '').split(','))
+    if name.strip() and precision.strip()
+)
+
+# Precision each resident backend was converted to when it was loaded
+_loaded_precisions = {}
+
+def cpu_supports_bf16():
+    """
+    Whether the CPU has native bf16 instructions (AVX512-BF16 or AMX), where
+    bf16 matmuls run faster than fp32 instead of being emulated.
+    """
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def resolve_precision(model_choice, device):
+    """
+    Returns the precision a backend is loaded in on the given device.
+
+    'auto' means fp16 on accelerators, and bf16 or fp32 on CPU depending on
+    native bf16 support. Quantized precisions only apply on CPU; elsewhere
+    they fall back to 'auto'.
+    """
+    precision = MODEL_PRECISIONS.get(model_choice, MODEL_PRECISION)
+    if precision not in PRECISIONS:
+        logger.warning("Unknown precision '%s' for model '%s'; using 'auto'.", precision, model_choice)
+        precision = 'auto'
+    if device != 'cpu' and precision.startswith('int'):
+        logger.warning("Precision '%s' is only supported on CPU; using 'auto' on %s.", precision, device)
+        precision = 'auto'
+    if precision == 'auto':
+        if device != 'cpu':
+            return 'fp16'
+        return 'bf16' if cpu_supports_bf16() else 'fp32'
+    return precision
+
+def load_dtype(precision):
+    """
+    Returns the torch dtype to load weights in before any quantization.
+    """
+    import torch
+    if precision == 'fp16':
+        return torch.float16
+    if precision == 'bf16':
+        return torch.bfloat16
+    if precision in ('int8-weight', 'int4-weight') and cpu_supports_bf16():
+        # Weight-only quantization keeps bf16 activations
+        return torch.bfloat16
+    # Dynamic quantization converts fp32 linear layers
+    return torch.float32
+
+def apply_precision(model_choice, model, precision):
+    """
+    Quantizes a loaded model in place of its linear layers, once at load time.
+
+    Args:
+        model_choice (str): The backend, for logging and model_precisions().
+        model (torch.nn.Module): The model loaded with load_dtype(precision).
+        precision (str): The resolved precision.
+
+    Returns:
+        torch.nn.Module: The model to cache.
+    """
+    start = time.perf_counter()
+    if precision == 'int8-dynamic':
+        import torch
+        # In place, so the fp32 weights are never held twice
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif precision in ('int8-weight', 'int4-weight'):
+        from optimum.quanto import quantize, freeze, qint8, qint4
+        quantize(model, weights=qint8 if precision == 'int8-weight' else qint4)
+        freeze(model)
+    _loaded_precisions[model_choice] = precision
+    if precision.startswith('int'):
+        logger.info("Quantized model '%s' to %s in %.2fs.", model_choice, precision, time.perf_counter() - start)
+    return model
+
+def set_precision(model_choice, precision):
+    """
+    Switches a backend's precision, e.g. to compare accuracy and latency.
+
+    A resident model loaded in another precision is dropped, so the next
+    load_model converts it afresh.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}'; expected one of {PRECISIONS}.")
+    MODEL_PRECISIONS[model_choice] = precision
+    _loaded_precisions.pop(model_choice, None)
+    if _model_cache.pop(model_choice) is not None:
+        _model_sizes.pop(model_choice, None)
+        _release_memory()
+
+def model_precisions():
+    """
+    Returns the precision each backend was last loaded in.
+    """
+    return dict(_loaded_precisions)
+
+# Registry of generation backends: name -> {'loader', 'imports', 'cache', 'repo_id'}.
+# Each backend's heavy dependencies are imported only when it is first loaded.
+_backends = {}
+
+# Seconds spent importing each backend's dependencies in this process
+_import_times = {}
+
+def register_backend(name, imports=(), cache=True, repo_id=None):
+    """
+    Registers a loader function for a generation backend.
+
+    Args:
+        name (str): The model_choice that selects the backend.
+        imports (tuple): Modules the backend needs, imported on first use.
+        cache (bool): Whether load_model should cache the loader's result.
+        repo_id (str): The Hugging Face repo of its weights, used to estimate
+            its size before the first load.
+    """
+    def decorator(loader):
+        _backends[name] = {'loader': loader, 'imports': tuple(imports), 'cache': cache, 'repo_id': repo_id}
+        return loader
+    return decorator
+
+# Bytes per parameter at each precision, for size estimates
+_PRECISION_BYTES = {'fp32': 4, 'fp16': 2, 'bf16': 2, 'int8-dynamic': 1, 'int8-weight': 1, 'int4-weight': 0.5}
+
+def estimate_model_size(model_choice):
+    """
+    Estimates the resident size of a backend before loading it: its last
+    measured size, else the parameter count in its safetensors metadata
+    times the bytes per parameter of the precision it will be loaded in.
+
+    Returns:
+        int: The estimated size in bytes, or None if unknown.
+    """
+    if model_choice in _model_sizes:
+        return _model_sizes[model_choice]
+    repo_id = _backends[model_choice]['repo_id']
+    if repo_id is None:
+        return None
+    try:
+        from huggingface_hub import get_safetensors_metadata
+        parameters = sum(get_safetensors_metadata(repo_id).parameter_count.values())
+        precision = resolve_precision(model_choice, detect_device())
+    except Exception as e:
+        logger.warning("Could not estimate the size of model '%s': %s", model_choice, e)
+        return None
+    return int(parameters * _PRECISION_BYTES.get(precision, 4))
+
+def available_backends():
+    return list(_backends)
+
+def _import_backend(name):
+    if name in _import_times:
+        return
+    start = time.perf_counter()
+    for module in _backends[name]['imports']:
+        importlib.import_module(module)
+    _import_times[name] = time.perf_counter() - start
+    logger.info("Imported dependencies of backend '%s' in %.2fs.", name, _import_times[name])
+
+def import_times():
+    """
+    Returns the seconds each backend spent importing its dependencies in this
+    process. Modules shared with an earlier backend are counted only once.
+    """
+    return dict(_import_times)
+
+def measure_import_costs(backends=None):
+    """
+    Measures the cold import time and memory of each backend's dependencies,
+    each in a fresh interpreter so shared modules are not hidden.
+
+    Args:
+        backends (list): The backends to measure; all registered ones by default.
+
+    Returns:
+        dict: backend -> {'seconds', 'max_rss_kb'} or {'error'}.
+    """
+    probe = (
+        "import importlib, json, resource, sys, time\n"
+        "start = time.perf_counter()\n"
+        "for module in sys.argv[1:]:\n"
+        "    importlib.import_module(module)\n"
+        "print(json.dumps({'seconds': time.perf_counter() - start,\n"
+        "                  'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))\n"
+    )
+    report = {}
+    for name in backends or available_backends():
+        modules = list(_backends[name]['imports'])
+        result = subprocess.run([sys.executable, '-c', probe] + modules, capture_output=True, text=True)
+        if result.returncode == 0:
+            report[name] = json.loads(result.stdout.strip().splitlines()[-1])
+        else:
+            report[name] = {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed'}
+        logger.info("Import cost of backend '%s': %s", name, report[name])
+    return report
 
 def detect_device():
     """
     Detects the best available device (CUDA, MPS, or CPU).
     """
+    import torch
     # if torch.cuda.is_available():
     #     return 'cuda'
     # if torch.backends.mps.is_available():
@@ -35,101 +315,152 @@ def detect_device():
     else:
         return 'cpu'
 
+@register_backend('qwen', imports=('torch', 'transformers', 'qwen_vl_utils'), repo_id='Qwen/Qwen2-VL-7B-Instruct')
+def _load_qwen():
+    from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
+    device = detect_device()
+    precision = resolve_precision('qwen', device)
+    model = Qwen2VLForConditionalGeneration.from_pretrained(
+        "Qwen/Qwen2-VL-7B-Instruct",
+        torch_dtype=load_dtype(precision),
+        device_map="auto"
+    )
+    processor = AutoProcessor.from_pretrained("Qwen/Qwen2-VL-7B-Instruct")
+    model.to(device)
+    model = apply_precision('qwen', model, precision)
+    logger.info("Qwen model loaded and cached.")
+    return model, processor, device
+
+@register_backend('gemini', imports=('google.generativeai',), cache=False)
+def _load_gemini():
+    # The configured model is shared process-wide, see models.clients
+    return gemini_model(), None
+
+@register_backend('gpt-4o', imports=('httpx', 'openai'), cache=False)
+def _load_gpt4o():
+    return openai_client()
+
+@register_backend('llama-vision', imports=('torch', 'transformers'), repo_id='alpindale/Llama-3.2-11B-Vision-Instruct')
+def _load_llama_vision():
+    from transformers import MllamaForConditionalGeneration, AutoProcessor
+    # Load Llama-Vision model
+    device = detect_device()
+    # model_id = "meta-llama/Llama-3.2-11B-Vision-Instruct"
+    model_id = "alpindale/Llama-3.2-11B-Vision-Instruct"
+    precision = resolve_precision('llama-vision', device)
+    model = MllamaForConditionalGeneration.from_pretrained(
+        model_id,
+        torch_dtype=load_dtype(precision),
+        device_map="auto"
+    )
+    processor = AutoProcessor.from_pretrained(model_id)
+    model.to(device)
+    model = apply_precision('llama-vision', model, precision)
+    logger.info("Llama-Vision model loaded and cached.")
+    return model, processor, device
+
+@register_backend('pixtral', imports=('torch', 'huggingface_hub', 'mistral_inference.transformer', 'mistral_common.generate'),
+                  repo_id='mistralai/Pixtral-12B-2409')
+def _load_pixtral():
+    device = detect_device()
+    mistral_models_path = os.path.join(os.getcwd(), 'mistral_models', 'Pixtral')
+
+    if not os.path.exists(mistral_models_path):
+        os.makedirs(mistral_models_path, exist_ok=True)
+        from huggingface_hub import snapshot_download
+        snapshot_download(repo_id="mistralai/Pixtral-12B-2409",
+                          allow_patterns=["params.json", "consolidated.safetensors", "tekken.json"],
+                          local_dir=mistral_models_path)
+
+    from mistral_inference.transformer import Transformer
+    from mistral_common.tokens.tokenizers.mistral import MistralTokenizer
+    from mistral_common.generate import generate
+
+    tokenizer = MistralTokenizer.from_file(os.path.join(mistral_models_path, "tekken.json"))
+    precision = resolve_precision('pixtral', device)
+    model = Transformer.from_folder(mistral_models_path, dtype=load_dtype(precision))
+    model = apply_precision('pixtral', model, precision)
+
+    logger.info("Pixtral model loaded and cached.")
+    return model, tokenizer, generate, device
+
+@register_backend('molmo', imports=('torch', 'transformers'), repo_id='allenai/MolmoE-1B-0924')
+def _load_molmo():
+    from transformers import AutoModelForCausalLM, AutoProcessor
+    device = detect_device()
+    precision = resolve_precision('molmo', device)
+    processor = AutoProcessor.from_pretrained(
+        'allenai/MolmoE-1B-0924',
+        trust_remote_code=True,
+        torch_dtype='auto',
+        device_map='auto'
+    )
+    # Converted once here rather than per request
+    model = AutoModelForCausalLM.from_pretrained(
+        'allenai/MolmoE-1B-0924',
+        trust_remote_code=True,
+        torch_dtype=load_dtype(precision),
+        device_map='auto'
+    )
+    model = apply_precision('molmo', model, precision)
+    return model, processor, device
+
+@register_backend('groq-llama-vision', imports=('httpx', 'groq'), cache=False)
+def _load_groq_llama_vision():
+    return groq_client()
+
 def load_model(model_choice):
     """
     Loads and caches the specified model.
+
+    Cached models are kept within MODEL_CACHE_MAX_BYTES by evicting the least
+    recently used unpinned models. First loads run one at a time, so
+    concurrent callers neither load the same model twice nor overrun the
+    budget by loading different models at once.
     """
-    global _model_cache
-
-    if model_choice in _model_cache:
-        logger.info(f"Model '{model_choice}' loaded from cache.")
-        return _model_cache[model_choice]
-
-    if model_choice == 'qwen':
-        device = detect_device()
-        model = Qwen2VLForConditionalGeneration.from_pretrained(
-            "Qwen/Qwen2-VL-7B-Instruct",
-            torch_dtype=torch.float16 if device != 'cpu' else torch.float32,
-            device_map="auto"
-        )
-        processor = AutoProcessor.from_pretrained("Qwen/Qwen2-VL-7B-Instruct")
-        model.to(device)
-        _model_cache[model_choice] = (model, processor, device)
-        logger.info("Qwen model loaded and cached.")
-        return _model_cache[model_choice]
-
-    elif model_choice == 'gemini':
-        # Load Gemini model
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY not found in .env file")
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash-002')  # Use the appropriate model name
-        return model, None
-
-
-    elif model_choice == 'llama-vision':
-        # Load Llama-Vision model
-        device = detect_device()
-        # model_id = "meta-llama/Llama-3.2-11B-Vision-Instruct"
-        model_id = "alpindale/Llama-3.2-11B-Vision-Instruct"
-        model = MllamaForConditionalGeneration.from_pretrained(
-            model_id,
-            torch_dtype=torch.float16 if device != 'cpu' else torch.float32,
-            device_map="auto"
-        )
-        processor = AutoProcessor.from_pretrained(model_id)
-        model.to(device)
-        _model_cache[model_choice] = (model, processor, device)
-        logger.info("Llama-Vision model loaded and cached.")
-        return _model_cache[model_choice]
-    
-    elif model_choice == "pixtral":
-        device = detect_device()
-        mistral_models_path = os.path.join(os.getcwd(), 'mistral_models', 'Pixtral')
-        
-        if not os.path.exists(mistral_models_path):
-            os.makedirs(mistral_models_path, exist_ok=True)
-            from huggingface_hub import snapshot_download
-            snapshot_download(repo_id="mistralai/Pixtral-12B-2409", 
-                              allow_patterns=["params.json", "consolidated.safetensors", "tekken.json"], 
-                              local_dir=mistral_models_path)
-
-        from mistral_inference.transformer import Transformer
-        from mistral_common.tokens.tokenizers.mistral import MistralTokenizer
-        from mistral_common.generate import generate
-
-        tokenizer = MistralTokenizer.from_file(os.path.join(mistral_models_path, "tekken.json"))
-        model = Transformer.from_folder(mistral_models_path)
-        
-        _model_cache[model_choice] = (model, tokenizer, generate, device)
-        logger.info("Pixtral model loaded and cached.")
-        return _model_cache[model_choice]
-    
-    elif model_choice == "molmo":
-        device = detect_device()
-        processor = AutoProcessor.from_pretrained(
-            'allenai/MolmoE-1B-0924',
-            trust_remote_code=True,
-            torch_dtype='auto',
-            device_map='auto'
-        )
-        model = AutoModelForCausalLM.from_pretrained(
-            'allenai/MolmoE-1B-0924',
-            trust_remote_code=True,
-            torch_dtype='auto',
-            device_map='auto'
-        )
-        _model_cache[model_choice] = (model, processor, device)
-        return _model_cache[model_choice]
-    elif model_choice == 'groq-llama-vision':
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
-            raise ValueError("GROQ_API_KEY not found in .env file")
-        client = Groq(api_key=api_key)
-        _model_cache[model_choice] = client
-        logger.info("Groq Llama Vision model loaded and cached.")
-        return _model_cache[model_choice]
-    else:
-        logger.error(f"Invalid model choice: {model_choice}")
+    model = _model_cache.get(model_choice)
+    if model is not None:
+        logger.debug("Model '%s' loaded from cache.", model_choice)
+        return model
+
+    backend = _backends.get(model_choice)
+    if backend is None:
+        logger.error("Invalid model choice: %s", model_choice)
         raise ValueError("Invalid model choice.")
+
+    _import_backend(model_choice)
+    if not backend['cache']:
+        return backend['loader']()
+
+    with _load_lock:
+        # Another caller may have loaded it while we waited
+        if model_choice in _model_cache:
+            return _model_cache.get(model_choice)
+        if MODEL_CACHE_MAX_BYTES:
+            # Free memory before loading rather than after, so peak usage stays within budget.
+            # No other load runs while the lock is held, so the room made is reserved for this one.
+            # Without an estimate, every unpinned model is evicted before the first load.
+            estimate = estimate_model_size(model_choice)
+            if estimate is None:
+                logger.info("Size of model '%s' unknown; evicting unpinned models before loading it.", model_choice)
+                estimate = MODEL_CACHE_MAX_BYTES
+            evictions = _model_cache.evictions
+            _model_cache.make_room(estimate)
+            if _model_cache.evictions != evictions:
+                _release_memory()
+
+        start = time.perf_counter()
+        model = backend['loader']()
+        evictions = _model_cache.evictions
+        _model_cache.put(model_choice, model)
+        if _model_cache.evictions != evictions:
+            _release_memory()
+        _model_sizes[model_choice] = _model_cache.size_of(model_choice) or 0
+    logger.info("Loaded model '%s' (%.2f GiB) in %.2fs; cache holds %.2f GiB.", model_choice,
+                _model_sizes[model_choice] / 1024 ** 3, time.perf_counter() - start,
+                _model_cache.stats()['bytes'] / 1024 ** 3)
+    return model
+
+if __name__ == '__main__':
+    # python -m models.model_loader [backend ...] prints the cold import cost of each backend
+    print(json.dumps(measure_import_costs(sys.argv[1:] or None), indent=2))
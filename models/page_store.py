@@ -0,0 +1,385 @@
+# models/page_store.py
+
+import io
+import os
+import time
+import base64
+import hashlib
+import threading
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Page images shared by all sessions, stored under static/ by content hash
+STATIC_FOLDER = 'static'
+PAGE_STORE_FOLDER = 'pages'
+THUMBNAIL_FOLDER = 'thumbs'
+# Pages written at index time; collected by collect_indexed_pages once no index refers to them
+INDEXED_PAGE_FOLDER = 'indexed_pages'
+
+# Longest side in pixels of the WebP thumbnails generated for every stored page
+THUMBNAIL_SIZES = tuple(int(size) for size in os.getenv('THUMBNAIL_SIZES', '280,560').split(',') if size.strip())
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 80))
+
+# Disk budget for the page store, and how long a page is protected from GC after use
+PAGE_STORE_MAX_BYTES = int(os.getenv('PAGE_STORE_MAX_BYTES', 2 * 1024 ** 3))
+PAGE_STORE_MIN_AGE_SECONDS = int(os.getenv('PAGE_STORE_MIN_AGE_SECONDS', 3600))
+# Pages this process keeps track of in memory; idle ones are forgotten first
+PAGE_STORE_MAX_TRACKED = int(os.getenv('PAGE_STORE_MAX_TRACKED', 100000))
+
+# Base64 prefixes of the image formats Byaldi may store, so no decode is needed to pick an extension
+_BASE64_SIGNATURES = (
+    ('iVBORw0KGgo', '.png'),
+    ('/9j/', '.jpg'),
+    ('UklGR', '.webp'),
+    ('R0lGOD', '.gif'),
+)
+
+_lock = threading.Lock()
+_materialised = {}  # key -> relative path of pages known to be on disk
+_last_access = {}  # key -> last time the page was returned by this process
+_bytes_since_gc = 0
+_gc_thread = None
+_reference_sources = {}  # name -> callable returning page paths still referenced, e.g. by chat histories
+
+def page_key(payload):
+    """
+    Computes the content address of a base64 page payload without decoding it.
+
+    Args:
+        payload (str): The base64-encoded page image.
+
+    Returns:
+        str: The hex digest identifying the page.
+    """
+    return hashlib.blake2b(payload.encode('ascii'), digest_size=16).hexdigest()
+
+def _extension(payload):
+    for prefix, ext in _BASE64_SIGNATURES:
+        if payload.startswith(prefix):
+            return ext
+    return '.png'
+
+def page_path(key, ext='.png'):
+    """
+    Returns the path of a page relative to the static folder.
+    """
+    return os.path.join(PAGE_STORE_FOLDER, key[:2], key + ext)
+
+def page_key_from_path(relative_path):
+    """
+    Returns the content hash of a page from its path in the store.
+    """
+    return os.path.splitext(os.path.basename(relative_path))[0]
+
+def thumbnail_path(key, size):
+    """
+    Returns the path of a page thumbnail relative to the static folder.
+    """
+    return os.path.join(THUMBNAIL_FOLDER, str(size), key[:2], key + '.webp')
+
+def make_thumbnail(relative_path, size):
+    """
+    Writes the thumbnail of a stored page if it does not exist yet.
+
+    Thumbnails are derived from content-addressed pages, so once written they
+    never change and can be served with immutable cache headers.
+
+    Args:
+        relative_path (str): The page path relative to the static folder.
+        size (int): The longest side of the thumbnail in pixels.
+
+    Returns:
+        str: The thumbnail path relative to the static folder.
+    """
+    from PIL import Image
+    thumb_relative = thumbnail_path(page_key_from_path(relative_path), size)
+    full_path = os.path.join(STATIC_FOLDER, thumb_relative)
+    if not os.path.exists(full_path):
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with Image.open(os.path.join(STATIC_FOLDER, relative_path)) as img:
+            img = img.convert('RGB')
+            img.thumbnail((size, size))
+            tmp_path = f"{full_path}.{threading.get_ident()}.tmp"
+            img.save(tmp_path, 'WEBP', quality=THUMBNAIL_QUALITY)
+        os.replace(tmp_path, full_path)
+        logger.debug("Generated thumbnail: %s", full_path)
+    return thumb_relative
+
+def thumbnails_for(relative_path):
+    """
+    Returns the thumbnail paths of a stored page, generating missing ones.
+
+    Returns:
+        dict: size -> thumbnail path relative to the static folder.
+    """
+    thumbnails = {}
+    for size in THUMBNAIL_SIZES:
+        try:
+            thumbnails[size] = make_thumbnail(relative_path, size)
+        except Exception as e:
+            logger.error("Error generating %spx thumbnail of %s: %s", size, relative_path, e)
+    return thumbnails
+
+def _touch(full_path):
+    try:
+        os.utime(full_path)
+    except OSError:
+        pass
+
+def _forget_idle(now):
+    # Called with _lock held. Pages idle for PAGE_STORE_MIN_AGE_SECONDS are protected
+    # by their mtime alone, so forgetting them only costs a stat on their next use.
+    cutoff = now - PAGE_STORE_MIN_AGE_SECONDS
+    idle = [key for key, last in _last_access.items() if last < cutoff]
+    if len(_last_access) - len(idle) > PAGE_STORE_MAX_TRACKED:
+        # Still over the bound with recent pages only; forget the least recently used half
+        idle = sorted(_last_access, key=_last_access.get)[:len(_last_access) // 2]
+    for key in idle:
+        _last_access.pop(key, None)
+        _materialised.pop(key, None)
+
+def materialize_page(payload):
+    """
+    Makes sure a base64 page exists on disk and returns its path.
+
+    Pages already written by this process are returned after a single stat,
+    which catches pages removed by a GC in another worker; otherwise the
+    payload is decoded once and its raw bytes written. A returned page's
+    mtime is refreshed at most once per half PAGE_STORE_MIN_AGE_SECONDS, so
+    GCs in other workers also see it as recently used.
+
+    Args:
+        payload (str): The base64-encoded page image.
+
+    Returns:
+        str: The path of the page relative to the static folder.
+    """
+    global _bytes_since_gc
+    key = page_key(payload)
+    now = time.time()
+    relative_path = _materialised.get(key)
+    if relative_path is not None:
+        full_path = os.path.join(STATIC_FOLDER, relative_path)
+        if os.path.exists(full_path):
+            if now - _last_access.get(key, 0) > PAGE_STORE_MIN_AGE_SECONDS / 2:
+                _touch(full_path)
+            with _lock:
+                _last_access[key] = now
+            return relative_path
+        # Collected by another worker; write it again
+        with _lock:
+            _materialised.pop(key, None)
+
+    relative_path = page_path(key, _extension(payload))
+    full_path = os.path.join(STATIC_FOLDER, relative_path)
+    if os.path.exists(full_path):
+        _touch(full_path)
+    else:
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        data = base64.b64decode(payload)
+        tmp_path = f"{full_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, full_path)
+        logger.debug("Materialised page: %s", full_path)
+        with _lock:
+            _bytes_since_gc += len(data)
+    # Thumbnails are generated once per page, the first time this process returns it
+    thumbnails_for(relative_path)
+
+    with _lock:
+        _materialised[key] = relative_path
+        _last_access[key] = now
+        if len(_last_access) > PAGE_STORE_MAX_TRACKED:
+            _forget_idle(now)
+    return relative_path
+
+def store_indexed_page(image):
+    """
+    Writes a page rendered at index time to the indexed page store, once.
+
+    The index keeps only the returned path, so loaded indexes hold no page
+    images and retrieval reads pages from disk only when they are returned.
+
+    Args:
+        image (Image): The rendered page.
+
+    Returns:
+        str: The path of the page relative to the static folder.
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    data = buffer.getvalue()
+    # Keyed like materialize_page, so a page has the same name in both stores
+    key = page_key(base64.b64encode(data).decode('ascii'))
+    relative_path = os.path.join(INDEXED_PAGE_FOLDER, key[:2], key + '.png')
+    full_path = os.path.join(STATIC_FOLDER, relative_path)
+    if os.path.exists(full_path):
+        # A page reused by an index still being built must not look idle to collect_indexed_pages
+        _touch(full_path)
+    else:
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        tmp_path = f"{full_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, full_path)
+        logger.debug("Stored indexed page: %s", full_path)
+    thumbnails_for(relative_path)
+    return relative_path
+
+def _remove_thumbnails(key):
+    # Thumbnails are shared by pages of the same content in both stores; keep them while either has the page
+    for folder in (PAGE_STORE_FOLDER, INDEXED_PAGE_FOLDER):
+        page_dir = os.path.join(STATIC_FOLDER, folder, key[:2])
+        if os.path.isdir(page_dir) and any(name.startswith(key + '.') for name in os.listdir(page_dir)):
+            return
+    for thumb_size in THUMBNAIL_SIZES:
+        try:
+            os.remove(os.path.join(STATIC_FOLDER, thumbnail_path(key, thumb_size)))
+        except OSError:
+            pass
+
+def collect_indexed_pages(indexed, referenced=(), min_age_seconds=PAGE_STORE_MIN_AGE_SECONDS):
+    """
+    Removes indexed pages that no index refers to any more, e.g. pages of
+    documents removed from a session or of indexes rebuilt from scratch.
+
+    Pages in indexed or referenced, and pages written or reused within
+    min_age_seconds (which covers indexes still being built), are kept.
+
+    Args:
+        indexed (iterable): Relative paths of the pages every index on disk refers to.
+        referenced (iterable): Relative paths of other pages that must be kept.
+        min_age_seconds (float): The minimum idle time before a page may be removed.
+
+    Returns:
+        int: The number of bytes freed.
+    """
+    root = os.path.join(STATIC_FOLDER, INDEXED_PAGE_FOLDER)
+    if not os.path.isdir(root):
+        return 0
+    keep = set(os.path.normpath(p) for p in indexed) | set(os.path.normpath(p) for p in referenced)
+    cutoff = time.time() - min_age_seconds
+    freed = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            full_path = os.path.join(dirpath, filename)
+            if os.path.relpath(full_path, STATIC_FOLDER) in keep or filename.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(full_path)
+                if stat.st_mtime > cutoff:
+                    continue
+                os.remove(full_path)
+            except OSError:
+                continue
+            freed += stat.st_size
+            _remove_thumbnails(os.path.splitext(filename)[0])
+
+    if freed:
+        logger.info("Indexed page GC freed %d bytes.", freed)
+    return freed
+
+def register_reference_source(name, source):
+    """
+    Registers a callable returning page paths that must survive garbage
+    collection, e.g. the images of saved chat histories. Registering the
+    same name again replaces the previous source.
+    """
+    _reference_sources[name] = source
+
+def referenced_pages():
+    """
+    Returns the relative paths of every page a registered source still refers to.
+    """
+    referenced = set()
+    for source in list(_reference_sources.values()):
+        try:
+            referenced.update(source())
+        except Exception as e:
+            # Evicting without knowing what is referenced could break saved chats
+            raise RuntimeError(f"Could not list referenced pages: {e}") from e
+    return referenced
+
+def _collect_in_background(max_bytes):
+    try:
+        collect_garbage(max_bytes, referenced=referenced_pages())
+    except Exception as e:
+        logger.error("Page store GC failed: %s", e)
+
+def maybe_collect_garbage(max_bytes=PAGE_STORE_MAX_BYTES):
+    """
+    Starts collect_garbage on a background thread once enough new pages have
+    been written to possibly exceed the budget, sparing pages that any
+    registered reference source still points to.
+
+    Returns:
+        bool: Whether a collection was started.
+    """
+    global _bytes_since_gc, _gc_thread
+    with _lock:
+        if _bytes_since_gc < max_bytes // 10 or (_gc_thread is not None and _gc_thread.is_alive()):
+            return False
+        _bytes_since_gc = 0
+        _gc_thread = threading.Thread(target=_collect_in_background, args=(max_bytes,),
+                                      name='page-store-gc', daemon=True)
+        _gc_thread.start()
+    return True
+
+def collect_garbage(max_bytes=PAGE_STORE_MAX_BYTES, referenced=(), min_age_seconds=PAGE_STORE_MIN_AGE_SECONDS):
+    """
+    Evicts least-recently-used pages until the store fits in max_bytes.
+
+    Pages in referenced, and pages written or returned within min_age_seconds,
+    are never evicted.
+
+    Args:
+        max_bytes (int): The disk budget for the store.
+        referenced (iterable): Relative paths of pages that must be kept.
+        min_age_seconds (float): The minimum idle time before a page may be evicted.
+
+    Returns:
+        int: The number of bytes freed.
+    """
+    root = os.path.join(STATIC_FOLDER, PAGE_STORE_FOLDER)
+    if not os.path.isdir(root):
+        return 0
+    referenced = set(os.path.normpath(p) for p in referenced)
+    pages = []
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            full_path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                continue
+            key = os.path.splitext(filename)[0]
+            last_used = max(stat.st_mtime, _last_access.get(key, 0))
+            pages.append((last_used, stat.st_size, full_path, key))
+            total += stat.st_size
+
+    freed = 0
+    cutoff = time.time() - min_age_seconds
+    for last_used, size, full_path, key in sorted(pages):
+        if total - freed <= max_bytes:
+            break
+        if last_used > cutoff or os.path.relpath(full_path, STATIC_FOLDER) in referenced:
+            continue
+        try:
+            os.remove(full_path)
+        except OSError:
+            continue
+        freed += size
+        _remove_thumbnails(key)
+        with _lock:
+            _materialised.pop(key, None)
+            _last_access.pop(key, None)
+
+    with _lock:
+        _forget_idle(time.time())
+
+    if freed:
+        logger.info("Page store GC freed %d bytes (%d bytes remain).", freed, total - freed)
+    return freed
@@ -1,13 +1,16 @@
 # models/responder.py
 
-from models.model_loader import load_model
-from transformers import GenerationConfig
-import google.generativeai as genai
+from models.model_loader import load_model, available_backends
 from dotenv import load_dotenv
 from logger import get_logger
-from openai import OpenAI
 from PIL import Image
-import torch
+from threading import Thread, Lock, Event
+from contextlib import contextmanager
+from models.batcher import MicroBatcher
+from models.clients import gemini_request_options
+from models.vision_cache import base64_image, image_data_url, qwen_image, rgb_image
+from models.metrics import PREPROCESS_SECONDS, GENERATION_SECONDS, GENERATION_ERRORS, register_queue
+import time
 import base64
 import os
 import io
@@ -15,129 +18,410 @@ import io
 
 logger = get_logger(__name__)
 
+# Starts of the messages generate_response returns in place of an answer when it fails
+ERROR_RESPONSE_PREFIXES = ('An error occurred while', 'Invalid model selected.', 'No images could be loaded',
+                           'The Gemini model did not generate')
+
+def is_error_response(text):
+    """
+    Whether a response from generate_response reports a failure rather than an answer.
+    """
+    return isinstance(text, str) and text.startswith(ERROR_RESPONSE_PREFIXES)
+
+# Backends that can stream tokens as they are generated
+STREAMING_MODELS = ('qwen', 'llama-vision', 'molmo', 'gemini', 'gpt-4o', 'groq-llama-vision')
+
 # Function to encode the image
 def encode_image(image_path):
   with open(image_path, "rb") as image_file:
     return base64.b64encode(image_file.read()).decode('utf-8')
 
+def _valid_image_paths(images):
+    # Ensure images are full paths
+    full_image_paths = [os.path.join('static', img) if not img.startswith('static') else img for img in images]
+    # Check if any valid images exist
+    return [img for img in full_image_paths if os.path.exists(img)]
+
+# Serialises changes to a shared tokenizer's padding side
+_padding_lock = Lock()
+
+@contextmanager
+def _left_padding(processor):
+    # Left padding keeps every prompt ending at the same position, so outputs can be trimmed
+    # uniformly. The tokenizer is shared with other callers, so its padding side is restored after.
+    tokenizer = processor.tokenizer
+    with _padding_lock:
+        padding_side = tokenizer.padding_side
+        tokenizer.padding_side = 'left'
+        try:
+            yield
+        finally:
+            tokenizer.padding_side = padding_side
+
+def _prepare_each(requests, prepare):
+    """
+    Prepares the requests of a batch one by one, so that a request that
+    cannot be prepared fails on its own instead of failing its batch.
+
+    Returns:
+        tuple: The prepared requests, and a dict of the exception raised for
+            each failed request by its position in requests.
+    """
+    prepared, errors = [], {}
+    for position, request in enumerate(requests):
+        try:
+            prepared.append(prepare(*request))
+        except Exception as e:
+            logger.error("Could not prepare request %d of a batch: %s", position, e)
+            errors[position] = e
+    return prepared, errors
+
+def _merge_errors(results, errors, count):
+    # Puts each failed request's exception back at its position among the results
+    results = iter(results)
+    return [errors[position] if position in errors else next(results) for position in range(count)]
+
+def _qwen_request(processor, valid_images, query, resized_height, resized_width):
+    # Ensure dimensions are multiples of 28
+    resized_height = (resized_height // 28) * 28
+    resized_width = (resized_width // 28) * 28
+
+    image_contents = []
+    for image in valid_images:
+        image_contents.append({
+            "type": "image",
+            "image": image,  # Use the full path
+            "resized_height": resized_height,
+            "resized_width": resized_width
+        })
+    messages = [
+        {
+            "role": "user",
+            "content": image_contents + [{"type": "text", "text": query}],
+        }
+    ]
+    text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    # Decoded and resized pages are cached, so repeat pages skip process_vision_info
+    return text, [qwen_image(image, resized_height, resized_width) for image in valid_images]
+
+@PREPROCESS_SECONDS.time(backend='qwen')
+def _prepare_qwen_batch(requests):
+    """
+    Builds one padded Qwen2-VL input batch from (valid_images, query, resized_height, resized_width) requests.
+
+    Returns:
+        tuple: The model, the processor, the inputs (None if no request could
+            be prepared) and the errors of the requests left out, by position.
+    """
+    # Load cached model
+    model, processor, device = load_model('qwen')
+
+    prepared, errors = _prepare_each(requests, lambda *request: _qwen_request(processor, *request))
+    if not prepared:
+        return model, processor, None, errors
+    texts = [text for text, _ in prepared]
+    batch_images = [image for _, images in prepared for image in images]
+
+    with _left_padding(processor):
+        inputs = processor(
+            text=texts,
+            images=batch_images,
+            padding=True,
+            return_tensors="pt",
+        )
+    return model, processor, inputs.to(device), errors
+
+def _prepare_qwen(valid_images, query, resized_height, resized_width):
+    model, processor, inputs, errors = _prepare_qwen_batch([(valid_images, query, resized_height, resized_width)])
+    if errors:
+        raise errors[0]
+    return model, processor, inputs
+
+def _run_qwen_batch(requests):
+    model, processor, inputs, errors = _prepare_qwen_batch(requests)
+    if inputs is None:
+        return _merge_errors([], errors, len(requests))
+    generated_ids = model.generate(**inputs, max_new_tokens=128)
+    generated_ids_trimmed = [
+        out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+    ]
+    results = processor.batch_decode(
+        generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+    )
+    return _merge_errors(results, errors, len(requests))
+
+def _llama_vision_request(processor, valid_images, query):
+    # For simplicity, use the first image
+    images = [rgb_image(valid_images[0])]
+
+    # Prepare messages
+    messages = [
+        {"role": "user", "content": [
+            {"type": "image"},
+            {"type": "text", "text": query}
+        ]}
+    ]
+    return images, processor.apply_chat_template(messages, add_generation_prompt=True)
+
+@PREPROCESS_SECONDS.time(backend='llama-vision')
+def _prepare_llama_vision_batch(requests):
+    """
+    Builds one padded Llama-Vision input batch from (valid_images, query) requests.
+
+    Returns:
+        tuple: The model, the processor, the inputs (None if no request could
+            be prepared) and the errors of the requests left out, by position.
+    """
+    # Load model, processor, and device
+    model, processor, device = load_model('llama-vision')
+
+    prepared, errors = _prepare_each(requests, lambda *request: _llama_vision_request(processor, *request))
+    if not prepared:
+        return model, processor, None, errors
+    images = [request_images for request_images, _ in prepared]
+    texts = [text for _, text in prepared]
+
+    with _left_padding(processor):
+        inputs = processor(images, texts, padding=True, return_tensors="pt").to(device)
+    return model, processor, inputs, errors
+
+def _prepare_llama_vision(valid_images, query):
+    model, processor, inputs, errors = _prepare_llama_vision_batch([(valid_images, query)])
+    if errors:
+        raise errors[0]
+    return model, processor, inputs
+
+def _run_llama_vision_batch(requests):
+    model, processor, inputs, errors = _prepare_llama_vision_batch(requests)
+    if inputs is None:
+        return _merge_errors([], errors, len(requests))
+    output = model.generate(**inputs, max_new_tokens=512)
+    results = [processor.decode(row, skip_special_tokens=True) for row in output]
+    return _merge_errors(results, errors, len(requests))
+
+# Micro-batching of concurrent requests to the local backends that support padded batches
+GENERATION_BATCH_SIZE = int(os.getenv('GENERATION_BATCH_SIZE', 4))
+GENERATION_BATCH_WAIT_MS = float(os.getenv('GENERATION_BATCH_WAIT_MS', 5))
+GENERATION_QUEUE_DEPTH = int(os.getenv('GENERATION_QUEUE_DEPTH', 64))
+
+_BATCH_RUNNERS = {
+    'qwen': _run_qwen_batch,
+    'llama-vision': _run_llama_vision_batch,
+}
+_batchers = {}
+_batchers_lock = Lock()
+
+# Generators registered at runtime, e.g. the stand-ins used by the benchmarks
+_generators = {}
+
+def register_generator(name, generate, batched=False):
+    """
+    Registers a generation function for a model_choice not built into generate_response.
+
+    Args:
+        name (str): The model_choice that selects the generator.
+        generate (callable): Called with (valid_images, query, resized_height, resized_width)
+            and returns the response text; if batched, called with a list of such
+            tuples and returns one response per tuple.
+        batched (bool): Whether requests go through the micro-batcher.
+    """
+    _generators[name] = (generate, batched)
+    if batched:
+        _BATCH_RUNNERS[name] = generate
+
+def generation_backends():
+    """
+    Returns every model_choice generate_response accepts: the built-in
+    backends and the generators registered at runtime.
+    """
+    return available_backends() + [name for name in _generators if name not in available_backends()]
+
+def _generate_batched(model_choice, request):
+    """
+    Runs one request through the backend's micro-batcher, or directly when
+    batching is disabled (GENERATION_BATCH_SIZE=1).
+    """
+    run_batch = _BATCH_RUNNERS[model_choice]
+    if GENERATION_BATCH_SIZE <= 1:
+        result = run_batch([request])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    with _batchers_lock:
+        batcher = _batchers.get(model_choice)
+        if batcher is None:
+            batcher = MicroBatcher(run_batch, max_batch_size=GENERATION_BATCH_SIZE,
+                                   max_wait_ms=GENERATION_BATCH_WAIT_MS, max_queue=GENERATION_QUEUE_DEPTH,
+                                   name=f"{model_choice} batcher")
+            _batchers[model_choice] = batcher
+            register_queue(batcher.name, batcher.depth)
+    return batcher.submit(request)
+
+@PREPROCESS_SECONDS.time(backend='molmo')
+def _prepare_molmo(valid_images, query):
+    import torch
+    model, processor, device = load_model('molmo')
+    pil_images = []
+    for img_path in valid_images[:1]:  # Process only the first image for now
+        try:
+            pil_images.append(rgb_image(img_path))
+        except Exception as e:
+            logger.error("Error opening image %s: %s", img_path, e)
+
+    if not pil_images:
+        return model, processor, None
+
+    # Process the images and text
+    inputs = processor.process(
+        images=pil_images,
+        text=query
+    )
+
+    # Move inputs to the correct device and make a batch of size 1
+    # Convert float tensors to the precision the model was loaded in, but keep integer tensors as they are
+    dtype = getattr(model, 'dtype', torch.float32)
+    inputs = {k: (v.to(device).unsqueeze(0).to(dtype) if v.dtype in [torch.float32, torch.float64] else
+                v.to(device).unsqueeze(0))
+            if isinstance(v, torch.Tensor) else v
+            for k, v in inputs.items()}
+    return model, processor, inputs
+
+def _molmo_generation_config():
+    from transformers import GenerationConfig
+    return GenerationConfig(max_new_tokens=200, stop_strings="<|endoftext|>")
+
+def _image_url_content(valid_images, query, limit=None, backend='gpt-4o'):
+    start = time.perf_counter()
+    content = [{"type": "text", "text": query}]
+    for img_path in valid_images[:limit]:
+        logger.debug("Processing image: %s", img_path)
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{base64_image(img_path)}"
+            }
+        })
+    PREPROCESS_SECONDS.observe(time.perf_counter() - start, backend=backend)
+    return content
+
+@PREPROCESS_SECONDS.time(backend='gemini')
+def _gemini_content(valid_images, query):
+    content = [query]  # Add the text query first
+    for img_path in valid_images:
+        try:
+            content.append(rgb_image(img_path))
+        except Exception as e:
+            logger.error("Error opening image %s: %s", img_path, e)
+    return content
+
+def _openai_client():
+    return load_model('gpt-4o')
+
+def _stop_on(event):
+    # Stopping criteria that end generation at the next token once event is set
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class StopOnEvent(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return event.is_set()
+
+    return StoppingCriteriaList([StopOnEvent()])
+
+def _stream_hf(generate, tokenizer, stop_event=None, **generate_kwargs):
+    """
+    Runs a Hugging Face generate call in a background thread and yields
+    decoded text as tokens are produced.
+
+    Generation stops at the next token once stop_event is set, or once the
+    consumer stops iterating, e.g. when the client of a stream disconnects.
+    """
+    import torch
+    from transformers import TextIteratorStreamer
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stop_event = stop_event or Event()
+    errors = []
+
+    def run():
+        try:
+            with torch.no_grad():
+                generate(streamer=streamer, stopping_criteria=_stop_on(stop_event), **generate_kwargs)
+        except Exception as e:
+            errors.append(e)
+            # Unblock the consumer
+            streamer.end()
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        for text in streamer:
+            if text:
+                yield text
+    finally:
+        # Also reached on GeneratorExit, so an abandoned stream frees the model
+        stop_event.set()
+    thread.join()
+    if errors:
+        raise errors[0]
+
 def generate_response(images, query, session_id, resized_height=280, resized_width=280, model_choice='qwen'):
     """
     Generates a response using the selected model based on the query and images.
     """
+    if model_choice not in generation_backends():
+        # Rejected before any metric is labelled with it, as it may come straight from a client
+        logger.error("Invalid model choice: %s", model_choice)
+        return "Invalid model selected."
+    with GENERATION_SECONDS.time(backend=model_choice):
+        return _generate_response(images, query, session_id, resized_height, resized_width, model_choice)
+
+def _generate_response(images, query, session_id, resized_height, resized_width, model_choice):
     try:
-        logger.info(f"Generating response using model '{model_choice}'.")
-        
+        logger.info("Generating response using model '%s'.", model_choice)
+
         # Convert resized_height and resized_width to integers
         resized_height = int(resized_height)
         resized_width = int(resized_width)
-        
-        # Ensure images are full paths
-        full_image_paths = [os.path.join('static', img) if not img.startswith('static') else img for img in images]
-        
-        # Check if any valid images exist
-        valid_images = [img for img in full_image_paths if os.path.exists(img)]
-        
+
+        valid_images = _valid_image_paths(images)
+
         if not valid_images:
             logger.warning("No valid images found for analysis.")
             return "No images could be loaded for analysis."
-        
+
         if model_choice == 'qwen':
-            from qwen_vl_utils import process_vision_info
-            # Load cached model
-            model, processor, device = load_model('qwen')
-            # Ensure dimensions are multiples of 28
-            resized_height = (resized_height // 28) * 28
-            resized_width = (resized_width // 28) * 28
-
-            image_contents = []
-            for image in valid_images:
-                image_contents.append({
-                    "type": "image",
-                    "image": image,  # Use the full path
-                    "resized_height": resized_height,
-                    "resized_width": resized_width
-                })
-            messages = [
-                {
-                    "role": "user",
-                    "content": image_contents + [{"type": "text", "text": query}],
-                }
-            ]
-            text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-            image_inputs, video_inputs = process_vision_info(messages)
-            inputs = processor(
-                text=[text],
-                images=image_inputs,
-                videos=video_inputs,
-                padding=True,
-                return_tensors="pt",
-            )
-            inputs = inputs.to(device)
-            generated_ids = model.generate(**inputs, max_new_tokens=128)
-            generated_ids_trimmed = [
-                out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-            ]
-            output_text = processor.batch_decode(
-                generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
-            )
+            output_text = _generate_batched('qwen', (valid_images, query, resized_height, resized_width))
             logger.info("Response generated using Qwen model.")
-            return output_text[0]
-        
+            return output_text
+
         elif model_choice == 'gemini':
             model, _ = load_model('gemini')
-            
+
             try:
-                content = [query]  # Add the text query first
-                
-                for img_path in valid_images:
-                    if os.path.exists(img_path):
-                        try:
-                            img = Image.open(img_path)
-                            content.append(img)
-                        except Exception as e:
-                            logger.error(f"Error opening image {img_path}: {e}")
-                    else:
-                        logger.warning(f"Image file not found: {img_path}")
-                
+                content = _gemini_content(valid_images, query)
+
                 if len(content) == 1:  # Only text, no images
                     return "No images could be loaded for analysis."
-                
-                response = model.generate_content(content)
-                
+
+                response = model.generate_content(content, request_options=gemini_request_options())
+
                 if response.text:
                     generated_text = response.text
                     logger.info("Response generated using Gemini model.")
                     return generated_text
                 else:
                     return "The Gemini model did not generate any text response."
-            
+
             except Exception as e:
-                logger.error(f"Error in Gemini processing: {str(e)}", exc_info=True)
+                logger.error("Error in Gemini processing: %s", e, exc_info=True)
+                GENERATION_ERRORS.inc(backend=model_choice)
                 return f"An error occurred while processing the images: {str(e)}"
-        
+
         elif model_choice == 'gpt-4o':
-            api_key = os.getenv("OPENAI_API_KEY")
-            client = OpenAI(api_key=api_key)
-            
+            client = _openai_client()
+
             try:
-                content = [{"type": "text", "text": query}]
-                
-                for img_path in valid_images:
-                    logger.info(f"Processing image: {img_path}")
-                    if os.path.exists(img_path):
-                        base64_image = encode_image(img_path)
-                        content.append({
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        })
-                    else:
-                        logger.warning(f"Image file not found: {img_path}")
-                
-                if len(content) == 1:  # Only text, no images
-                    return "No images could be loaded for analysis."
-                
+                content = _image_url_content(valid_images, query)
+
                 response = client.chat.completions.create(
                     model="gpt-4o",
                     messages=[
@@ -148,62 +432,35 @@ def generate_response(images, query, session_id, resized_height=280, resized_wid
                     ],
                     max_tokens=1024
                 )
-                
+
                 generated_text = response.choices[0].message.content
                 logger.info("Response generated using GPT-4 model.")
                 return generated_text
-            
+
             except Exception as e:
-                logger.error(f"Error in GPT-4 processing: {str(e)}", exc_info=True)
+                logger.error("Error in GPT-4 processing: %s", e, exc_info=True)
+                GENERATION_ERRORS.inc(backend=model_choice)
                 return f"An error occurred while processing the images: {str(e)}"
-        
-        elif model_choice == 'llama-vision':
-            # Load model, processor, and device
-            model, processor, device = load_model('llama-vision')
-
-            # Process images
-            # For simplicity, use the first image
-            image_path = valid_images[0] if valid_images else None
-            if image_path and os.path.exists(image_path):
-                image = Image.open(image_path).convert('RGB')
-            else:
-                return "No valid image found for analysis."
-
-            # Prepare messages
-            messages = [
-                {"role": "user", "content": [
-                    {"type": "image"},
-                    {"type": "text", "text": query}
-                ]}
-            ]
-            input_text = processor.apply_chat_template(messages, add_generation_prompt=True)
-            inputs = processor(image, input_text, return_tensors="pt").to(device)
 
+        elif model_choice == 'llama-vision':
             # Generate response
-            output = model.generate(**inputs, max_new_tokens=512)
-            response = processor.decode(output[0], skip_special_tokens=True)
-            return response
-        
+            return _generate_batched('llama-vision', (valid_images, query))
+
         elif model_choice == "pixtral":
             model, tokenizer, generate_func, device = load_model('pixtral')
 
-            def image_to_data_url(image_path):
-                with open(image_path, "rb") as image_file:
-                    encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                ext = os.path.splitext(image_path)[1][1:]  # Get the file extension
-                return f"data:image/{ext};base64,{encoded_string}"
-
             from mistral_common.protocol.instruct.messages import UserMessage, TextChunk, ImageURLChunk
             from mistral_common.protocol.instruct.request import ChatCompletionRequest
 
             # Prepare the content with text and images
-            content = [TextChunk(text=query)]
-            for img_path in valid_images[:1]:  # Use only the first image
-                content.append(ImageURLChunk(image_url=image_to_data_url(img_path)))
+            with PREPROCESS_SECONDS.time(backend='pixtral'):
+                content = [TextChunk(text=query)]
+                for img_path in valid_images[:1]:  # Use only the first image
+                    content.append(ImageURLChunk(image_url=image_data_url(img_path)))
 
-            completion_request = ChatCompletionRequest(messages=[UserMessage(content=content)])
+                completion_request = ChatCompletionRequest(messages=[UserMessage(content=content)])
 
-            encoded = tokenizer.encode_chat_completion(completion_request)
+                encoded = tokenizer.encode_chat_completion(completion_request)
 
             images = encoded.images
             tokens = encoded.tokens
@@ -213,43 +470,19 @@ def generate_response(images, query, session_id, resized_height=280, resized_wid
 
             logger.info("Response generated using Pixtral model.")
             return result
-        
-        elif model_choice == "molmo":
-            model, processor, device = load_model('molmo')
-            model = model.half()  # Convert model to half precision
-            pil_images = []
-            for img_path in valid_images[:1]:  # Process only the first image for now
-                if os.path.exists(img_path):
-                    try:
-                        img = Image.open(img_path).convert('RGB')
-                        pil_images.append(img)
-                    except Exception as e:
-                        logger.error(f"Error opening image {img_path}: {e}")
-                else:
-                    logger.warning(f"Image file not found: {img_path}")
-
-            if not pil_images:
-                return "No images could be loaded for analysis."
 
+        elif model_choice == "molmo":
             try:
-                # Process the images and text
-                inputs = processor.process(
-                    images=pil_images,
-                    text=query
-                )
-
-                # Move inputs to the correct device and make a batch of size 1
-                # Convert float tensors to half precision, but keep integer tensors as they are
-                inputs = {k: (v.to(device).unsqueeze(0).half() if v.dtype in [torch.float32, torch.float64] else 
-                            v.to(device).unsqueeze(0))
-                        if isinstance(v, torch.Tensor) else v 
-                        for k, v in inputs.items()}
+                import torch
+                model, processor, inputs = _prepare_molmo(valid_images, query)
+                if inputs is None:
+                    return "No images could be loaded for analysis."
 
                 # Generate output
                 with torch.no_grad():  # Disable gradient calculation
                     output = model.generate_from_batch(
                         inputs,
-                        GenerationConfig(max_new_tokens=200, stop_strings="<|endoftext|>"),
+                        _molmo_generation_config(),
                         tokenizer=processor.tokenizer
                     )
 
@@ -260,33 +493,14 @@ def generate_response(images, query, session_id, resized_height=280, resized_wid
                 return generated_text
 
             except Exception as e:
-                logger.error(f"Error in Molmo processing: {str(e)}", exc_info=True)
+                logger.error("Error in Molmo processing: %s", e, exc_info=True)
+                GENERATION_ERRORS.inc(backend=model_choice)
                 return f"An error occurred while processing the images: {str(e)}"
-            finally:
-                # Close the opened images to free up resources
-                for img in pil_images:
-                    img.close()              
         elif model_choice == 'groq-llama-vision':
             client = load_model('groq-llama-vision')
 
-            content = [{"type": "text", "text": query}]
-
             # Use only the first image
-            if valid_images:
-                img_path = valid_images[0]
-                if os.path.exists(img_path):
-                    base64_image = encode_image(img_path)
-                    content.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
-                        }
-                    })
-                else:
-                    logger.warning(f"Image file not found: {img_path}")
-
-            if len(content) == 1:  # Only text, no images
-                return "No images could be loaded for analysis."
+            content = _image_url_content(valid_images, query, limit=1, backend='groq-llama-vision')
 
             try:
                 chat_completion = client.chat.completions.create(
@@ -302,11 +516,92 @@ def generate_response(images, query, session_id, resized_height=280, resized_wid
                 logger.info("Response generated using Groq Llama Vision model.")
                 return generated_text
             except Exception as e:
-                logger.error(f"Error in Groq Llama Vision processing: {str(e)}", exc_info=True)
+                logger.error("Error in Groq Llama Vision processing: %s", e, exc_info=True)
+                GENERATION_ERRORS.inc(backend=model_choice)
                 return f"An error occurred while processing the image: {str(e)}"
+        elif model_choice in _generators:
+            generate, batched = _generators[model_choice]
+            request = (valid_images, query, resized_height, resized_width)
+            return _generate_batched(model_choice, request) if batched else generate(*request)
         else:
-            logger.error(f"Invalid model choice: {model_choice}")
+            logger.error("Invalid model choice: %s", model_choice)
             return "Invalid model selected."
     except Exception as e:
-        logger.error(f"Error generating response: {e}")
-        return f"An error occurred while generating the response: {str(e)}"
\ No newline at end of file
+        logger.error("Error generating response: %s", e)
+        GENERATION_ERRORS.inc(backend=model_choice)
+        return f"An error occurred while generating the response: {str(e)}"
+
+def generate_response_stream(images, query, session_id, resized_height=280, resized_width=280, model_choice='qwen',
+                             stop_event=None):
+    """
+    Generates a response like generate_response, yielding text as it is produced.
+
+    Backends without streaming support yield the whole response at once.
+    Errors are yielded as text, matching generate_response. Local generation
+    stops once stop_event is set or the generator is closed.
+    """
+    if model_choice not in STREAMING_MODELS:
+        # generate_response observes its own duration and rejects unknown backends
+        yield generate_response(images, query, session_id, resized_height, resized_width, model_choice)
+        return
+
+    start = time.perf_counter()
+    try:
+        logger.info("Streaming response using model '%s'.", model_choice)
+
+        resized_height = int(resized_height)
+        resized_width = int(resized_width)
+
+        valid_images = _valid_image_paths(images)
+        if not valid_images:
+            logger.warning("No valid images found for analysis.")
+            yield "No images could be loaded for analysis."
+            return
+
+        if model_choice == 'qwen':
+            model, processor, inputs = _prepare_qwen(valid_images, query, resized_height, resized_width)
+            yield from _stream_hf(model.generate, processor.tokenizer, stop_event, **inputs, max_new_tokens=128)
+
+        elif model_choice == 'llama-vision':
+            model, processor, inputs = _prepare_llama_vision(valid_images, query)
+            yield from _stream_hf(model.generate, processor.tokenizer, stop_event, **inputs, max_new_tokens=512)
+
+        elif model_choice == 'molmo':
+            model, processor, inputs = _prepare_molmo(valid_images, query)
+            if inputs is None:
+                yield "No images could be loaded for analysis."
+                return
+            yield from _stream_hf(model.generate_from_batch, processor.tokenizer, stop_event, batch=inputs,
+                                  generation_config=_molmo_generation_config(), tokenizer=processor.tokenizer)
+
+        elif model_choice == 'gemini':
+            model, _ = load_model('gemini')
+            content = _gemini_content(valid_images, query)
+            if len(content) == 1:  # Only text, no images
+                yield "No images could be loaded for analysis."
+                return
+            for chunk in model.generate_content(content, stream=True, request_options=gemini_request_options()):
+                if chunk.text:
+                    yield chunk.text
+
+        else:
+            if model_choice == 'gpt-4o':
+                client = _openai_client()
+                request = {"model": "gpt-4o", "max_tokens": 1024,
+                           "messages": [{"role": "user", "content": _image_url_content(valid_images, query)}]}
+            else:
+                client = load_model('groq-llama-vision')
+                request = {"model": "llava-v1.5-7b-4096-preview",
+                           "messages": [{"role": "user", "content": _image_url_content(valid_images, query, limit=1, backend='groq-llama-vision')}]}
+            for chunk in client.chat.completions.create(stream=True, **request):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+        logger.info("Streamed response using model '%s'.", model_choice)
+    except Exception as e:
+        logger.error("Error streaming response: %s", e, exc_info=True)
+        GENERATION_ERRORS.inc(backend=model_choice)
+        yield f"An error occurred while generating the response: {str(e)}"
+    finally:
+        # Failed and abandoned streams are timed too, like generate_response
+        GENERATION_SECONDS.observe(time.perf_counter() - start, backend=model_choice)
@@ -1,60 +1,217 @@
 # models/retriever.py
 
-import base64
 import os
-from PIL import Image
-from io import BytesIO
+import torch
+from byaldi.objects import Result
+from models.cache import LRUCache
+from models.page_store import materialize_page, maybe_collect_garbage
+from models.metrics import QUERY_ENCODE_SECONDS, SEARCH_SECONDS, PAGE_MATERIALIZE_SECONDS
 from logger import get_logger
-import time
-import hashlib
 
 logger = get_logger(__name__)
 
+# Search hits per (session, index version, normalised query, k)
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv('RETRIEVAL_CACHE_MAX_ENTRIES', 1024))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv('RETRIEVAL_CACHE_TTL_SECONDS', 600))
+# Query embeddings per (encoder, normalised query), reused when only k changes
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('QUERY_EMBEDDING_CACHE_MAX_ENTRIES', 1024))
+
+_result_cache = LRUCache(max_entries=RETRIEVAL_CACHE_MAX_ENTRIES, ttl=RETRIEVAL_CACHE_TTL_SECONDS,
+                         name='retrieval cache')
+_embedding_cache = LRUCache(max_entries=QUERY_EMBEDDING_CACHE_MAX_ENTRIES, ttl=RETRIEVAL_CACHE_TTL_SECONDS,
+                            name='query embedding cache')
+
+def normalize_query(query):
+    """
+    Normalises a query for cache lookups: case-folded, whitespace collapsed.
+    """
+    return ' '.join(query.casefold().split())
+
+def invalidate_session(session_id):
+    """
+    Drops cached search results for a session, e.g. after it is re-indexed or deleted.
+    """
+    return _result_cache.discard_where(lambda key: key[0] == session_id)
+
+def cache_stats():
+    """
+    Returns the counters of the retrieval and query embedding caches.
+    """
+    return {'results': _result_cache.stats(), 'query_embeddings': _embedding_cache.stats()}
+
+def encode_queries(RAG, queries):
+    """
+    Encodes queries with the index's encoder in a single forward pass.
+
+    Args:
+        RAG (RAGMultiModalModel): The RAG model with the indexed documents.
+        queries (list): The query strings.
+
+    Returns:
+        list: One multi-vector embedding tensor per query, on the CPU.
+    """
+    colpali = RAG.model
+    with QUERY_ENCODE_SECONDS.time(), torch.inference_mode():
+        batch_query = colpali.processor.process_queries(queries)
+        batch_query = {
+            key: value.to(colpali.device).to(colpali.model.dtype if value.dtype in [torch.float16, torch.bfloat16, torch.float32] else value.dtype)
+            for key, value in batch_query.items()
+        }
+        embeddings = colpali.model(**batch_query)
+    return list(torch.unbind(embeddings.to('cpu')))
+
+def _encoder_key(RAG):
+    # The indexer model recorded with the index; the encoder module itself when there is none
+    return getattr(RAG, 'indexer_model', None) or id(RAG.model.model)
+
+def _cached_query_embeddings(RAG, queries):
+    model_name = _encoder_key(RAG)
+    embeddings = {}
+    missing = []
+    for query in queries:
+        key = (model_name, normalize_query(query))
+        embedding = _embedding_cache.get(key)
+        if embedding is None:
+            if query not in missing:
+                missing.append(query)
+        else:
+            embeddings[query] = embedding
+    if missing:
+        for query, embedding in zip(missing, encode_queries(RAG, missing)):
+            _embedding_cache.put((model_name, normalize_query(query)), embedding)
+            embeddings[query] = embedding
+    return [embeddings[query] for query in queries]
+
+def _search_hits(RAG, query_embeddings, k):
+    """
+    Scores query embeddings against every indexed page with late interaction.
+
+    Returns:
+        list: One list of (embed_id, score) pairs per query, best match first.
+    """
+    colpali = RAG.model
+    if not colpali.indexed_embeddings:
+        return [[] for _ in query_embeddings]
+    with SEARCH_SECONDS.time():
+        scores = colpali.processor.score(query_embeddings, colpali.indexed_embeddings).cpu()
+        top_scores, top_ids = torch.topk(scores, min(k, scores.shape[1]), dim=1)
+    return [[(int(embed_id), float(score)) for score, embed_id in zip(row_scores, row_ids)]
+            for row_scores, row_ids in zip(top_scores.tolist(), top_ids.tolist())]
+
+def _to_results(RAG, hits):
+    # Page payloads are looked up in the index, never copied into the cache
+    colpali = RAG.model
+    results = []
+    for embed_id, score in hits:
+        doc_info = colpali.embed_id_to_doc_id[embed_id]
+        results.append(Result(
+            doc_id=doc_info['doc_id'],
+            page_num=int(doc_info['page_id']),
+            score=score,
+            metadata=colpali.doc_id_to_metadata.get(int(doc_info['doc_id']), {}),
+            base64=colpali.collection.get(embed_id)
+        ))
+    return results
+
+def search_embeddings(RAG, query_embeddings, k):
+    """
+    Scores query embeddings against every indexed page with late interaction.
+
+    Args:
+        RAG (RAGMultiModalModel): The RAG model with the indexed documents.
+        query_embeddings (list): Multi-vector embeddings, as returned by encode_queries.
+        k (int): The number of pages to return per query.
+
+    Returns:
+        list: One list of byaldi Result objects per query, best match first.
+    """
+    return [_to_results(RAG, hits) for hits in _search_hits(RAG, query_embeddings, k)]
+
+def _search_many(RAG, queries, session_id, k):
+    version = getattr(RAG, 'index_version', 0)
+    keys = [(session_id, version, normalize_query(query), k) for query in queries]
+    # The cache holds (embed_id, score) pairs, which are stable for an index version
+    hits = [_result_cache.get(key) for key in keys]
+    missing = [i for i, h in enumerate(hits) if h is None]
+    if missing:
+        # Encode and score every uncached query together
+        query_embeddings = _cached_query_embeddings(RAG, [queries[i] for i in missing])
+        for i, query_hits in zip(missing, _search_hits(RAG, query_embeddings, k)):
+            _result_cache.put(keys[i], query_hits)
+            hits[i] = query_hits
+    logger.debug("Retrieval cache hits for session %s: %d/%d.", session_id, len(queries) - len(missing), len(queries))
+    return [_to_results(RAG, query_hits) for query_hits in hits]
+
+@PAGE_MATERIALIZE_SECONDS.time()
+def _materialize_results(RAG, results):
+    page_refs = getattr(RAG, 'page_refs', {})
+    images = []
+    for result in results:
+        page_ref = page_refs.get(f"{result.doc_id}:{result.page_num}")
+        if page_ref is not None:
+            # Stored at index time; the file is only read when the page is used
+            images.append(page_ref)
+            logger.debug("Added image to list: %s", page_ref)
+        elif result.base64:
+            # Pages are shared across sessions and keyed by the hash of the stored payload
+            relative_path = materialize_page(result.base64)
+            images.append(relative_path)
+            logger.debug("Added image to list: %s", relative_path)
+        else:
+            logger.warning("No base64 data for document %s, page %s", result.doc_id, result.page_num)
+    return images
+
 def retrieve_documents(RAG, query, session_id, k=3):
     """
     Retrieves relevant documents based on the user query using Byaldi.
 
+    Results are cached per index version, so repeated questions skip the
+    query encode and search until the session is re-indexed.
+
     Args:
         RAG (RAGMultiModalModel): The RAG model with the indexed documents.
         query (str): The user's query.
-        session_id (str): The session ID to store images in per-session folder.
+        session_id (str): The session ID the query belongs to.
         k (int): The number of documents to retrieve.
 
     Returns:
-        list: A list of image filenames corresponding to the retrieved documents.
+        list: Paths, relative to the static folder, of the retrieved page images.
     """
     try:
-        logger.info(f"Retrieving documents for query: {query}")
-        results = RAG.search(query, k=k)
-        images = []
-        session_images_folder = os.path.join('static', 'images', session_id)
-        os.makedirs(session_images_folder, exist_ok=True)
-        
-        for i, result in enumerate(results):
-            if result.base64:
-                image_data = base64.b64decode(result.base64)
-                image = Image.open(BytesIO(image_data))
-                
-                # Generate a unique filename based on the image content
-                image_hash = hashlib.md5(image_data).hexdigest()
-                image_filename = f"retrieved_{image_hash}.png"
-                image_path = os.path.join(session_images_folder, image_filename)
-                
-                if not os.path.exists(image_path):
-                    image.save(image_path, format='PNG')
-                    logger.debug(f"Retrieved and saved image: {image_path}")
-                else:
-                    logger.debug(f"Image already exists: {image_path}")
-                
-                # Store the relative path from the static folder
-                relative_path = os.path.join('images', session_id, image_filename)
-                images.append(relative_path)
-                logger.info(f"Added image to list: {relative_path}")
-            else:
-                logger.warning(f"No base64 data for document {result.doc_id}, page {result.page_num}")
-        
-        logger.info(f"Total {len(images)} documents retrieved. Image paths: {images}")
+        logger.info("Retrieving documents for query: %s", query)
+        results = _search_many(RAG, [query], session_id, k)[0]
+        images = _materialize_results(RAG, results)
+        maybe_collect_garbage()
+        logger.info("Total %d documents retrieved. Image paths: %s", len(images), images)
         return images
     except Exception as e:
-        logger.error(f"Error retrieving documents: {e}")
-        return []
\ No newline at end of file
+        logger.error("Error retrieving documents: %s", e)
+        return []
+
+def retrieve_documents_batch(RAG, queries, session_id, k=3):
+    """
+    Retrieves relevant documents for several queries against the same index.
+
+    All uncached queries are encoded in one forward pass and scored against
+    the index together.
+
+    Args:
+        RAG (RAGMultiModalModel): The RAG model with the indexed documents.
+        queries (list): The user queries.
+        session_id (str): The session ID the queries belong to.
+        k (int): The number of documents to retrieve per query.
+
+    Returns:
+        list: One list of image paths per query, as returned by retrieve_documents.
+    """
+    if not queries:
+        return []
+    try:
+        logger.info("Retrieving documents for %d queries.", len(queries))
+        all_results = _search_many(RAG, list(queries), session_id, k)
+        batch_images = [_materialize_results(RAG, results) for results in all_results]
+        maybe_collect_garbage()
+        return batch_images
+    except Exception as e:
+        logger.error("Error retrieving documents: %s", e)
+        return [[] for _ in queries]
@@ -0,0 +1,168 @@
+# models/session_catalog.py
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+CATALOG_FILENAME = 'catalog.sqlite3'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    file_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sessions_by_updated ON sessions (updated_at DESC);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+class SessionCatalog:
+    """
+    SQLite index of the sessions in a folder, so listing them does not read
+    any session file.
+
+    The database runs in WAL mode, so readers never block the writer. Each
+    thread uses its own connection. A missing catalog is rebuilt once from
+    the session files already in the folder.
+
+    Args:
+        folder (str): The folder holding the sessions and the catalog.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.db_path = os.path.join(folder, CATALOG_FILENAME)
+        self._local = threading.local()
+        os.makedirs(folder, exist_ok=True)
+        is_new = not os.path.exists(self.db_path)
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+        if is_new:
+            self.rebuild()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def upsert(self, session_id, name, created_at, updated_at, file_count):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO sessions (id, name, created_at, updated_at, file_count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name, updated_at = excluded.updated_at, "
+                "file_count = excluded.file_count",
+                (session_id, name, created_at, updated_at, file_count))
+
+    def delete(self, session_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def get(self, session_id):
+        row = self._connection().execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list(self, offset=0, limit=None):
+        """
+        Returns a page of sessions, most recently updated first.
+
+        Args:
+            offset (int): The number of sessions to skip.
+            limit (int): The page size, or None for every remaining session.
+
+        Returns:
+            list: {'id', 'name', 'created_at', 'updated_at', 'file_count'} dicts.
+        """
+        rows = self._connection().execute(
+            "SELECT * FROM sessions ORDER BY updated_at DESC, id LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def next_session_number(self):
+        """
+        Returns the next number for a default session name ("Session N").
+
+        Numbers only increase, so names stay unique after sessions are deleted.
+        The write lock is taken before reading the counter, so concurrent
+        callers, in this process or another, never get the same number.
+        """
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        with conn:
+            row = conn.execute("SELECT value FROM counters WHERE name = 'session_number'").fetchone()
+            if row is None:
+                value = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] + 1
+            else:
+                value = row[0] + 1
+            conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('session_number', ?)", (value,))
+            return value
+
+    def rebuild(self):
+        """
+        Repopulates the catalog from the session files in the folder.
+
+        Returns:
+            int: The number of sessions found.
+        """
+        start = time.perf_counter()
+        rows = []
+        for filename in os.listdir(self.folder):
+            if filename.endswith('.meta.json'):
+                session_id = filename[:-len('.meta.json')]
+            elif filename.endswith('.json'):
+                # Legacy session file, not migrated yet
+                session_id = filename[:-len('.json')]
+                if os.path.exists(os.path.join(self.folder, session_id + '.meta.json')):
+                    continue
+            else:
+                continue
+            path = os.path.join(self.folder, filename)
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning("Skipping unreadable session file %s: %s", path, e)
+                continue
+            mtime = os.path.getmtime(path)
+            rows.append((session_id, data.get('session_name', 'Untitled Session'),
+                         data.get('created_at', mtime), data.get('updated_at', mtime),
+                         len(data.get('indexed_files', []))))
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions")
+            conn.executemany("INSERT INTO sessions (id, name, created_at, updated_at, file_count) "
+                             "VALUES (?, ?, ?, ?, ?)", rows)
+        logger.info("Rebuilt session catalog of %d sessions in %.2fs.", len(rows),
+                    time.perf_counter() - start)
+        return len(rows)
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def catalog_for(folder):
+    """
+    Returns the shared catalog of a session folder.
+    """
+    key = os.path.abspath(folder)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = SessionCatalog(folder)
+            _catalogs[key] = catalog
+        return catalog
@@ -0,0 +1,361 @@
+# models/session_store.py
+
+import os
+import json
+import time
+import fcntl
+from contextlib import contextmanager
+from models.session_catalog import catalog_for
+from models.metrics import SESSION_IO_SECONDS
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Each session is stored as <id>.meta.json (name, indexed files, counters),
+# replaced atomically, and <id>.jsonl, its chat history with one message per
+# line. Sending a message appends to the log, so its cost does not grow with
+# the length of the conversation.
+SESSION_FOLDER = os.getenv('SESSION_FOLDER', 'sessions')
+
+# Block size used when reading the history backwards from the end of the log
+_TAIL_BLOCK_SIZE = 64 * 1024
+
+# A log is compacted on append once it has grown by this many bytes since it
+# was last compacted, or straight away when the append had to repair a torn line
+SESSION_COMPACT_BYTES = int(os.getenv('SESSION_COMPACT_BYTES', 4 * 1024 * 1024))
+
+def _paths(session_id, folder):
+    base = os.path.join(folder, session_id)
+    return base + '.meta.json', base + '.jsonl', base + '.lock', base + '.json'
+
+@contextmanager
+def _locked(session_id, folder, shared=False):
+    # An advisory lock per session serialises writers across threads and processes
+    os.makedirs(folder, exist_ok=True)
+    lock_path = _paths(session_id, folder)[2]
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _read_meta(meta_path):
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+def _write_meta(meta_path, meta):
+    tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+    # Keep the catalog used for listing sessions in step with the metadata
+    folder, filename = os.path.split(meta_path)
+    now = time.time()
+    catalog_for(folder).upsert(filename[:-len('.meta.json')], meta.get('session_name', 'Untitled Session'),
+                               meta.get('created_at', now), meta.get('updated_at', now),
+                               len(meta.get('indexed_files', [])))
+
+def _append_lines(log_path, records):
+    """
+    Appends records to a log, one JSON object per line.
+
+    Returns:
+        tuple: The size of the log after the append, and whether a torn last
+            line had to be terminated first.
+    """
+    data = ''.join(json.dumps(record) + '\n' for record in records)
+    # A single O_APPEND write per batch, so messages of one exchange stay together
+    fd = os.open(log_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        size = os.fstat(fd).st_size
+        torn = bool(size) and os.pread(fd, 1, size - 1) != b'\n'
+        if torn:
+            # Terminate a torn last line so it does not swallow this record
+            data = '\n' + data
+        encoded = data.encode('utf-8')
+        os.write(fd, encoded)
+    finally:
+        os.close(fd)
+    return size + len(encoded), torn
+
+def _rewrite_log(log_path):
+    # Called with the session lock held
+    with open(log_path, 'r') as f:
+        messages = _parse_lines(f, log_path)
+    tmp_path = f"{log_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.writelines(json.dumps(message) + '\n' for message in messages)
+    os.replace(tmp_path, log_path)
+    return len(messages), os.path.getsize(log_path)
+
+def _parse_lines(lines, log_path):
+    messages = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            messages.append(json.loads(line))
+        except json.JSONDecodeError:
+            # A write interrupted by a crash leaves a torn line; compaction drops it
+            logger.warning("Skipping malformed line in %s.", log_path)
+    return messages
+
+def _migrate_legacy(session_id, folder):
+    # Called with the session lock held
+    meta_path, log_path, _, legacy_path = _paths(session_id, folder)
+    if os.path.exists(meta_path) or not os.path.exists(legacy_path):
+        return
+    with open(legacy_path, 'r') as f:
+        legacy = json.load(f)
+    chat_history = legacy.get('chat_history', [])
+    now = time.time()
+    if chat_history:
+        _append_lines(log_path, chat_history)
+    _write_meta(meta_path, {
+        'session_name': legacy.get('session_name', 'Untitled Session'),
+        'indexed_files': legacy.get('indexed_files', []),
+        'message_count': len(chat_history),
+        'created_at': os.path.getmtime(legacy_path),
+        'updated_at': now
+    })
+    os.remove(legacy_path)
+    logger.info("Migrated session %s to the append-only store.", session_id)
+
+def session_exists(session_id, folder=SESSION_FOLDER):
+    meta_path, _, _, legacy_path = _paths(session_id, folder)
+    return os.path.exists(meta_path) or os.path.exists(legacy_path)
+
+def create_session(session_id, session_name, folder=SESSION_FOLDER):
+    """
+    Creates an empty session, unless it already exists.
+    """
+    with _locked(session_id, folder):
+        _migrate_legacy(session_id, folder)
+        meta_path = _paths(session_id, folder)[0]
+        if os.path.exists(meta_path):
+            return
+        now = time.time()
+        _write_meta(meta_path, {'session_name': session_name, 'indexed_files': [], 'message_count': 0,
+                                'created_at': now, 'updated_at': now})
+
+def load_session_meta(session_id, folder=SESSION_FOLDER):
+    """
+    Returns the session's name, indexed files and counters without reading its history.
+
+    Returns:
+        dict: The session metadata, or None if the session does not exist.
+    """
+    meta_path = _paths(session_id, folder)[0]
+    if not os.path.exists(meta_path):
+        if not session_exists(session_id, folder):
+            return None
+        with _locked(session_id, folder):
+            _migrate_legacy(session_id, folder)
+    try:
+        return _read_meta(meta_path)
+    except FileNotFoundError:
+        return None
+
+@SESSION_IO_SECONDS.time(operation='read_recent')
+def recent_messages(session_id, limit, folder=SESSION_FOLDER):
+    """
+    Returns the last messages of a session, reading the log backwards from
+    its end so that only the requested tail is parsed.
+
+    Args:
+        session_id (str): The session ID.
+        limit (int): The maximum number of messages to return.
+        folder (str): The folder holding the sessions.
+
+    Returns:
+        list: The messages, oldest first.
+    """
+    log_path = _paths(session_id, folder)[1]
+    if limit <= 0 or not os.path.exists(log_path):
+        return []
+    with _locked(session_id, folder, shared=True), open(log_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        # One extra newline, since the log ends with one
+        while position > 0 and data.count(b'\n') <= limit:
+            read_size = min(_TAIL_BLOCK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    lines = data.decode('utf-8').splitlines()
+    if position > 0:
+        lines = lines[1:]  # The first line may be cut off at the block boundary
+    return _parse_lines(lines, log_path)[-limit:]
+
+@SESSION_IO_SECONDS.time(operation='read')
+def load_session(session_id, history_limit=None, folder=SESSION_FOLDER):
+    """
+    Loads a session in the shape of the legacy session file.
+
+    Args:
+        session_id (str): The session ID.
+        history_limit (int): Return only the last history_limit messages, or all if None.
+        folder (str): The folder holding the sessions.
+
+    Returns:
+        dict: session_name, chat_history and indexed_files, or None if the session does not exist.
+    """
+    meta = load_session_meta(session_id, folder)
+    if meta is None:
+        return None
+    if history_limit is not None:
+        chat_history = recent_messages(session_id, history_limit, folder)
+    else:
+        log_path = _paths(session_id, folder)[1]
+        chat_history = []
+        if os.path.exists(log_path):
+            with _locked(session_id, folder, shared=True), open(log_path, 'r') as f:
+                chat_history = _parse_lines(f, log_path)
+    return {'session_name': meta.get('session_name', 'Untitled Session'),
+            'chat_history': chat_history,
+            'indexed_files': meta.get('indexed_files', [])}
+
+@SESSION_IO_SECONDS.time(operation='append')
+def append_messages(session_id, messages, folder=SESSION_FOLDER):
+    """
+    Appends messages to a session's chat history, creating the session if needed.
+
+    Returns:
+        int: The number of messages in the session after the append.
+    """
+    meta_path, log_path, _, _ = _paths(session_id, folder)
+    with _locked(session_id, folder):
+        _migrate_legacy(session_id, folder)
+        now = time.time()
+        if os.path.exists(meta_path):
+            meta = _read_meta(meta_path)
+        else:
+            meta = {'session_name': 'Untitled Session', 'indexed_files': [], 'message_count': 0, 'created_at': now}
+        size, torn = _append_lines(log_path, messages)
+        meta['message_count'] = meta.get('message_count', 0) + len(messages)
+        if torn or size - meta.get('compacted_size', 0) >= SESSION_COMPACT_BYTES:
+            meta['message_count'], meta['compacted_size'] = _rewrite_log(log_path)
+            logger.info("Compacted session %s to %d messages.", session_id, meta['message_count'])
+        meta['updated_at'] = now
+        _write_meta(meta_path, meta)
+        return meta['message_count']
+
+@SESSION_IO_SECONDS.time(operation='update_meta')
+def update_session_meta(session_id, folder=SESSION_FOLDER, **fields):
+    """
+    Updates fields of an existing session's metadata, e.g. session_name.
+
+    Returns:
+        bool: Whether the session exists.
+    """
+    meta_path = _paths(session_id, folder)[0]
+    with _locked(session_id, folder):
+        _migrate_legacy(session_id, folder)
+        if not os.path.exists(meta_path):
+            return False
+        meta = _read_meta(meta_path)
+        meta.update(fields)
+        meta['updated_at'] = time.time()
+        _write_meta(meta_path, meta)
+        return True
+
+def add_indexed_files(session_id, filenames, session_name='Untitled Session', folder=SESSION_FOLDER):
+    """
+    Records files as indexed in a session, creating the session if needed.
+    """
+    create_session(session_id, session_name, folder)
+    meta_path = _paths(session_id, folder)[0]
+    with _locked(session_id, folder):
+        meta = _read_meta(meta_path)
+        files_done = meta.get('indexed_files', [])
+        files_done.extend(name for name in filenames if name not in files_done)
+        meta['indexed_files'] = files_done
+        meta['updated_at'] = time.time()
+        _write_meta(meta_path, meta)
+
+def compact_session(session_id, folder=SESSION_FOLDER):
+    """
+    Rewrites a session's log, dropping lines torn by interrupted writes, and
+    resynchronises its message count. append_messages does this on its own
+    once the log has grown by SESSION_COMPACT_BYTES or a torn line is found.
+
+    Returns:
+        int: The number of messages kept.
+    """
+    meta_path, log_path, _, _ = _paths(session_id, folder)
+    with _locked(session_id, folder):
+        _migrate_legacy(session_id, folder)
+        if not os.path.exists(log_path):
+            return 0
+        count, size = _rewrite_log(log_path)
+        if os.path.exists(meta_path):
+            meta = _read_meta(meta_path)
+            meta['message_count'], meta['compacted_size'] = count, size
+            _write_meta(meta_path, meta)
+    logger.info("Compacted session %s to %d messages.", session_id, count)
+    return count
+
+def referenced_images(folder=SESSION_FOLDER):
+    """
+    Returns the paths of every image the saved chat histories refer to, so
+    the page store never collects a page that a history still shows.
+
+    Returns:
+        set: Image paths relative to the static folder.
+    """
+    images = set()
+    if not os.path.isdir(folder):
+        return images
+    for filename in os.listdir(folder):
+        if not filename.endswith('.jsonl'):
+            continue
+        log_path = os.path.join(folder, filename)
+        try:
+            with open(log_path, 'r') as f:
+                # Only assistant messages carry images, so most lines are skipped unparsed
+                messages = _parse_lines((line for line in f if '"images"' in line), log_path)
+        except FileNotFoundError:
+            continue
+        for message in messages:
+            images.update(os.path.normpath(image) for image in message.get('images') or [])
+    return images
+
+def delete_session(session_id, folder=SESSION_FOLDER):
+    """
+    Removes all files of a session.
+    """
+    meta_path, log_path, lock_path, legacy_path = _paths(session_id, folder)
+    with _locked(session_id, folder):
+        for path in (meta_path, log_path, legacy_path):
+            if os.path.exists(path):
+                os.remove(path)
+    if os.path.exists(lock_path):
+        os.remove(lock_path)
+    catalog_for(folder).delete(session_id)
+
+def list_sessions(folder=SESSION_FOLDER, offset=0, limit=None):
+    """
+    Lists sessions from the catalog, most recently updated first, without
+    reading any session file.
+
+    Args:
+        folder (str): The folder holding the sessions.
+        offset (int): The number of sessions to skip.
+        limit (int): The page size, or None for every remaining session.
+
+    Returns:
+        list: {'id', 'name', 'created_at', 'updated_at', 'file_count'} dicts.
+    """
+    return catalog_for(folder).list(offset, limit)
+
+def count_sessions(folder=SESSION_FOLDER):
+    return catalog_for(folder).count()
+
+def next_session_name(folder=SESSION_FOLDER):
+    """
+    Returns a default name for a new session, "Session N".
+    """
+    return f"Session {catalog_for(folder).next_session_number()}"
@@ -0,0 +1,105 @@
+# models/vision_cache.py
+
+import os
+import re
+import base64
+from PIL import Image
+from models.cache import LRUCache
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Memory budget for preprocessed page inputs shared by all sessions
+VISION_CACHE_MAX_BYTES = int(os.getenv('VISION_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+
+# Page store filenames are the content hash of the page, see models.page_store
+_CONTENT_HASH = re.compile(r'^[0-9a-f]{32}$')
+
+def input_size(value):
+    """
+    Estimates the resident size in bytes of a cached input: a string, a PIL
+    image or a tensor.
+    """
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if hasattr(value, 'element_size') and hasattr(value, 'nelement'):
+        return value.element_size() * value.nelement()
+    return 0
+
+_vision_cache = LRUCache(max_bytes=VISION_CACHE_MAX_BYTES, sizeof=input_size, name='vision input cache')
+
+def page_hash(image_path):
+    """
+    Identifies a page image by content.
+
+    Pages from the page store are named by their hash, so no read is needed;
+    other files fall back to their path, size and modification time.
+    """
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    if _CONTENT_HASH.match(stem):
+        return stem
+    stat = os.stat(image_path)
+    return f"{os.path.abspath(image_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def cached_input(image_path, kind, build, resized_height=None, resized_width=None):
+    """
+    Returns a backend-ready input for a page, building it only on a miss.
+
+    Args:
+        image_path (str): The path of the page image.
+        kind (str): The input format, e.g. 'base64', 'rgb' or 'qwen'.
+        build (callable): Builds the input from image_path.
+        resized_height (int): The target height, if the input is resized.
+        resized_width (int): The target width, if the input is resized.
+
+    Returns:
+        The cached or freshly built input.
+    """
+    key = (page_hash(image_path), kind, resized_height, resized_width)
+    value = _vision_cache.get(key)
+    if value is None:
+        value = build(image_path)
+        _vision_cache.put(key, value)
+    return value
+
+def base64_image(image_path):
+    """
+    Returns the page file base64-encoded, as sent to the remote backends.
+    """
+    def build(path):
+        with open(path, 'rb') as f:
+            return base64.b64encode(f.read()).decode('utf-8')
+    return cached_input(image_path, 'base64', build)
+
+def image_data_url(image_path):
+    """
+    Returns the page as a data URL, as passed to Pixtral.
+
+    Built from the cached base64 payload on every call rather than cached
+    itself, so the page's bytes are held once.
+    """
+    ext = os.path.splitext(image_path)[1][1:]  # Get the file extension
+    return f"data:image/{ext};base64,{base64_image(image_path)}"
+
+def rgb_image(image_path):
+    """
+    Returns the decoded page as an RGB PIL image. Callers must not modify it.
+    """
+    def build(path):
+        with Image.open(path) as img:
+            return img.convert('RGB')
+    return cached_input(image_path, 'rgb', build)
+
+def qwen_image(image_path, resized_height, resized_width):
+    """
+    Returns the page decoded and resized the way Qwen2-VL's process_vision_info would.
+    """
+    def build(path):
+        from qwen_vl_utils import fetch_image
+        return fetch_image({"image": path, "resized_height": resized_height, "resized_width": resized_width})
+    return cached_input(image_path, 'qwen', build, resized_height, resized_width)
+
+def vision_cache_stats():
+    return _vision_cache.stats()
@@ -0,0 +1,157 @@
+# models/warmup.py
+
+import os
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from models.model_loader import load_model
+from models.session_store import list_sessions
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+def _names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+# What to load at process start: generation models, query encoders, session
+# indexes by id, and the N most recently updated sessions from the catalog
+PRELOAD_MODELS = _names(os.getenv('PRELOAD_MODELS', ''))
+PRELOAD_ENCODERS = _names(os.getenv('PRELOAD_ENCODERS', ''))
+PRELOAD_SESSIONS = _names(os.getenv('PRELOAD_SESSIONS', ''))
+PRELOAD_RECENT_SESSIONS = int(os.getenv('PRELOAD_RECENT_SESSIONS', 0))
+PRELOAD_WORKERS = int(os.getenv('PRELOAD_WORKERS', 4))
+
+# Synthetic query run through retrieval and generation once everything is loaded
+WARMUP_QUERY = os.getenv('WARMUP_QUERY', 'Summarize the work experience of this candidate.')
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+_lock = threading.Lock()
+_thread = None
+_state = {'status': 'cold', 'started_at': None, 'ready_at': None, 'error': None, 'steps': {}}
+
+def _record(step, start, error=None):
+    with _lock:
+        _state['steps'][step] = {'seconds': round(time.perf_counter() - start, 3),
+                                 'error': str(error) if error is not None else None}
+    if error is None:
+        logger.info("Warm-up step '%s' done in %.2fs.", step, time.perf_counter() - start)
+    else:
+        logger.error("Warm-up step '%s' failed: %s", step, error)
+
+def _step(step, fn, *args):
+    start = time.perf_counter()
+    try:
+        result = fn(*args)
+    except Exception as e:
+        _record(step, start, e)
+        return None
+    _record(step, start)
+    return result
+
+def _generate(images, model_choice):
+    from models.responder import generate_response, is_error_response
+    # generate_response reports failures as text, which must not count as a warm model
+    response = generate_response(images, WARMUP_QUERY, 'warmup', 280, 280, model_choice)
+    if is_error_response(response):
+        raise RuntimeError(response)
+    return response
+
+def _blank_page():
+    # A plain page, so local backends run a real forward pass when no session is preloaded
+    from PIL import Image
+    path = os.path.join(tempfile.gettempdir(), 'resumebot-warmup.png')
+    if not os.path.exists(path):
+        Image.new('RGB', (280, 280), 'white').save(path)
+    return path
+
+def warm_up(load_session_index, session_folder):
+    """
+    Loads the configured models and indexes in parallel, then runs the
+    warm-up query through retrieval and each preloaded model, so the first
+    real request pays no load or first-call cost.
+
+    Failed steps are logged and reported by readiness(); they do not keep
+    the process out of rotation. Neither does an unexpected error in the
+    warm-up itself: it ends in the 'failed' status with the error recorded,
+    and whatever was not loaded is loaded on first use.
+
+    Args:
+        load_session_index (callable): Loads (and caches) a session's index by id.
+        session_folder (str): The folder holding the sessions.
+    """
+    with _lock:
+        _state['status'] = 'warming'
+        _state['started_at'] = time.time()
+    status, error = 'failed', None
+    try:
+        _warm_up(load_session_index, session_folder)
+        status = 'ready'
+    except Exception as e:
+        error = e
+        logger.exception("Warm-up failed: %s", e)
+    finally:
+        # Always leave a terminal status, so /readyz does not report 'warming' forever
+        with _lock:
+            _state['status'] = status
+            _state['ready_at'] = time.time()
+            _state['error'] = str(error) if error is not None else None
+            seconds = _state['ready_at'] - _state['started_at']
+        logger.info("Warm-up %s in %.2fs.", 'finished' if status == 'ready' else 'ended', seconds)
+
+def _warm_up(load_session_index, session_folder):
+    from models.encoders import get_encoder
+    from models.retriever import encode_queries, retrieve_documents
+
+    session_ids = list(PRELOAD_SESSIONS)
+    if PRELOAD_RECENT_SESSIONS:
+        recent = _step('list recent sessions', list_sessions, session_folder, 0, PRELOAD_RECENT_SESSIONS) or []
+        session_ids += [entry['id'] for entry in recent if entry['id'] not in session_ids]
+
+    # Models, encoders and indexes are independent, so they load side by side
+    with ThreadPoolExecutor(max_workers=max(PRELOAD_WORKERS, 1), thread_name_prefix='preload') as pool:
+        models = {name: pool.submit(_step, f"load model {name}", load_model, name) for name in PRELOAD_MODELS}
+        encoders = {name: pool.submit(_step, f"load encoder {name}", get_encoder, name) for name in PRELOAD_ENCODERS}
+        indexes = {sid: pool.submit(_step, f"load index {sid}", load_session_index, sid) for sid in session_ids}
+        models = {name: future.result() for name, future in models.items()}
+        encoders = {name: future.result() for name, future in encoders.items()}
+        indexes = {sid: future.result() for sid, future in indexes.items()}
+
+    images = []
+    if WARMUP_ENABLED:
+        for name, encoder in encoders.items():
+            if encoder is not None:
+                _step(f"encode query {name}", encode_queries, encoder, [WARMUP_QUERY])
+        for sid, RAG in indexes.items():
+            if RAG is not None:
+                images = _step(f"retrieve {sid}", retrieve_documents, RAG, WARMUP_QUERY, sid) or images
+        if PRELOAD_MODELS:
+            images = images or [_blank_page()]
+        for name, model in models.items():
+            if model is not None:
+                _step(f"generate {name}", _generate, images, name)
+
+def start_warmup(load_session_index, session_folder):
+    """
+    Runs warm_up on a background thread, once per process.
+    """
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=warm_up, args=(load_session_index, session_folder),
+                                   name='warmup', daemon=True)
+    _thread.start()
+
+def is_ready():
+    # A failed warm-up still ends it; the process then loads on first use
+    with _lock:
+        return _state['status'] in ('ready', 'failed')
+
+def readiness():
+    """
+    Returns the warm-up status ('cold', 'warming', 'ready' or 'failed'), the
+    error that ended a failed warm-up, and the duration and error of each step.
+    """
+    with _lock:
+        return {**_state, 'steps': {step: dict(result) for step, result in _state['steps'].items()}}
@@ -0,0 +1,10 @@
+# tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+# Keep test runs from writing app.log into the tree or flooding the console
+os.environ.setdefault('LOG_FILE', os.path.join(tempfile.gettempdir(), 'resumebot-tests.log'))
+os.environ.setdefault('LOG_CONSOLE_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
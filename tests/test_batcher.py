@@ -0,0 +1,87 @@
+# tests/test_batcher.py
+
+import threading
+import pytest
+
+from models.batcher import MicroBatcher, BatchQueueFullError
+
+def _submit_all(batcher, requests):
+    results = {}
+
+    def submit(request):
+        try:
+            results[request] = batcher.submit(request)
+        except Exception as e:
+            results[request] = e
+
+    threads = [threading.Thread(target=submit, args=(request,)) for request in requests]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results
+
+def test_requests_are_batched():
+    batches = []
+
+    def run_batch(requests):
+        batches.append(list(requests))
+        return [request * 2 for request in requests]
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=200)
+    results = _submit_all(batcher, [1, 2, 3, 4])
+    assert results == {1: 2, 2: 4, 3: 6, 4: 8}
+    assert max(len(batch) for batch in batches) > 1
+
+def test_exception_result_fails_only_its_request():
+    def run_batch(requests):
+        return [ValueError(request) if request == 2 else request for request in requests]
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=200)
+    results = _submit_all(batcher, [1, 2, 3])
+    assert isinstance(results[2], ValueError)
+    assert results[1] == 1 and results[3] == 3
+
+def test_failing_batch_is_retried_per_request():
+    calls = []
+
+    def run_batch(requests):
+        calls.append(list(requests))
+        if 2 in requests:
+            raise RuntimeError('bad request')
+        return list(requests)
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=200)
+    results = _submit_all(batcher, [1, 2, 3])
+    assert isinstance(results[2], RuntimeError)
+    assert results[1] == 1 and results[3] == 3
+    assert [2] in calls
+
+def test_wrong_number_of_results_is_an_error():
+    batcher = MicroBatcher(lambda requests: [], max_wait_ms=0)
+    with pytest.raises(ValueError):
+        batcher.submit(1)
+
+def test_full_queue_rejects_request():
+    started, release = threading.Event(), threading.Event()
+
+    def run_batch(requests):
+        started.set()
+        release.wait(5)
+        return list(requests)
+
+    batcher = MicroBatcher(run_batch, max_batch_size=1, max_wait_ms=0, max_queue=1)
+    worker = threading.Thread(target=batcher.submit, args=(1,))
+    worker.start()
+    started.wait(5)
+    waiting = threading.Thread(target=batcher.submit, args=(2,))
+    waiting.start()
+    try:
+        while batcher.depth() < 1:
+            pass
+        with pytest.raises(BatchQueueFullError):
+            batcher.submit(3)
+    finally:
+        release.set()
+        worker.join(5)
+        waiting.join(5)
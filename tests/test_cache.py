@@ -0,0 +1,89 @@
+# tests/test_cache.py
+
+import pytest
+
+from models import cache as cache_module
+from models.cache import LRUCache, SessionIndexCache
+
+def test_max_entries_evicts_least_recently_used():
+    evicted = []
+    cache = LRUCache(max_entries=2, on_evict=lambda key, value: evicted.append(key))
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.keys() == ['a', 'c']
+    assert evicted == ['b']
+    assert cache.stats()['evictions'] == 1
+
+def test_byte_budget_evicts_until_it_fits():
+    cache = LRUCache(max_bytes=10, sizeof=len)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'xxxx')
+    cache.put('c', 'xxxxxx')
+    assert cache.keys() == ['b', 'c']
+    assert cache.stats()['bytes'] == 10
+
+def test_oversized_entry_is_kept_alone():
+    cache = LRUCache(max_bytes=4, sizeof=len)
+    cache.put('a', 'xx')
+    cache.put('big', 'xxxxxxxx')
+    assert cache.keys() == ['big']
+
+def test_replacing_entry_updates_size():
+    cache = LRUCache(max_bytes=10, sizeof=len)
+    cache.put('a', 'xxxxxxxx')
+    cache.put('a', 'xx')
+    assert cache.size_of('a') == 2
+    assert cache.stats()['bytes'] == 2
+
+def test_pinned_entries_are_never_evicted():
+    cache = LRUCache(max_entries=1)
+    cache.pin('a')
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('c', 3)
+    assert cache.keys() == ['a', 'c']
+    cache.unpin('a')
+    cache.put('d', 4)
+    assert cache.keys() == ['d']
+
+def test_make_room_frees_bytes_ahead_of_insert():
+    cache = LRUCache(max_bytes=10, sizeof=len)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'xxxx')
+    cache.make_room(5)
+    assert cache.keys() == ['b']
+
+def test_ttl_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'monotonic', lambda: now[0])
+    cache = LRUCache(ttl=5)
+    cache.put('a', 1)
+    now[0] += 4
+    assert cache.get('a') == 1
+    now[0] += 2
+    assert cache.get('a') is None
+    assert 'a' not in cache
+    assert cache.stats()['misses'] == 1
+
+def test_session_index_cache_loads_once():
+    loads = []
+    cache = SessionIndexCache(lambda session_id: loads.append(session_id) or object())
+    first = cache.get_or_load('s1')
+    assert cache.get_or_load('s1') is first
+    assert loads == ['s1']
+
+def test_session_index_cache_does_not_cache_missing_index():
+    cache = SessionIndexCache(lambda session_id: None)
+    assert cache.get_or_load('s1') is None
+    assert 's1' not in cache
+
+def test_session_index_cache_reloads_stale_index():
+    stale = set()
+    cache = SessionIndexCache(lambda session_id: object(), is_stale=lambda session_id, RAG: RAG in stale)
+    first = cache.get_or_load('s1')
+    stale.add(first)
+    second = cache.get_or_load('s1')
+    assert second is not first
+    assert cache.get_or_load('s1') is second
@@ -0,0 +1,49 @@
+# tests/test_manifest.py
+
+import os
+import pytest
+
+pytest.importorskip('byaldi')
+
+from models.indexer import diff_manifest, scan_folder, load_manifest, save_manifest, file_hash
+
+def _entries(files):
+    return {name: {'sha256': sha256, 'doc_id': doc_id, 'pages': 1}
+            for doc_id, (name, sha256) in enumerate(files.items())}
+
+def test_unchanged_folder_needs_no_work():
+    files = {'a.pdf': 'h1', 'b.pdf': 'h2'}
+    assert diff_manifest(_entries(files), files) == ([], [])
+
+def test_new_file_is_added():
+    entries = _entries({'a.pdf': 'h1'})
+    assert diff_manifest(entries, {'a.pdf': 'h1', 'b.pdf': 'h2'}) == ([], ['b.pdf'])
+
+def test_changed_file_is_stale_and_readded():
+    entries = _entries({'a.pdf': 'h1', 'b.pdf': 'h2'})
+    assert diff_manifest(entries, {'a.pdf': 'h1', 'b.pdf': 'changed'}) == (['b.pdf'], ['b.pdf'])
+
+def test_removed_file_is_stale_only():
+    entries = _entries({'a.pdf': 'h1', 'b.pdf': 'h2'})
+    assert diff_manifest(entries, {'a.pdf': 'h1'}) == (['b.pdf'], [])
+
+def test_empty_manifest_adds_everything():
+    assert diff_manifest({}, {'a.pdf': 'h1', 'b.pdf': 'h2'}) == ([], ['a.pdf', 'b.pdf'])
+
+def test_scan_folder_hashes_indexable_files_only(tmp_path):
+    (tmp_path / 'resume.pdf').write_bytes(b'%PDF-1.4 resume')
+    (tmp_path / 'notes.txt').write_text('not indexable')
+    (tmp_path / 'nested').mkdir()
+    files = scan_folder(str(tmp_path))
+    assert files == {'resume.pdf': file_hash(str(tmp_path / 'resume.pdf'))}
+
+def test_manifest_round_trip(tmp_path):
+    manifest = {'version': 3, 'files': _entries({'a.pdf': 'h1'})}
+    save_manifest(str(tmp_path), manifest)
+    assert load_manifest(str(tmp_path)) == manifest
+    assert not os.path.exists(os.path.join(str(tmp_path), 'manifest.json.tmp'))
+
+def test_missing_or_corrupt_manifest_loads_as_none(tmp_path):
+    assert load_manifest(str(tmp_path)) is None
+    (tmp_path / 'manifest.json').write_text('{"files": ')
+    assert load_manifest(str(tmp_path)) is None
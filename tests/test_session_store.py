@@ -0,0 +1,72 @@
+# tests/test_session_store.py
+
+import json
+import os
+import pytest
+
+from models import session_store
+
+EXCHANGE = [{'role': 'user', 'content': 'ping'}, {'role': 'assistant', 'content': 'pong', 'images': []}]
+
+@pytest.fixture
+def folder(tmp_path):
+    return str(tmp_path / 'sessions')
+
+def _log_path(folder, session_id):
+    return os.path.join(folder, f"{session_id}.jsonl")
+
+def _tear(folder, session_id):
+    # A write cut short by a crash leaves a partial last line
+    with open(_log_path(folder, session_id), 'a') as f:
+        f.write(json.dumps(EXCHANGE[0])[:10])
+
+def test_append_and_load(folder):
+    session_store.create_session('s1', 'First', folder)
+    assert session_store.append_messages('s1', EXCHANGE, folder) == 2
+    session = session_store.load_session('s1', folder=folder)
+    assert session['session_name'] == 'First'
+    assert session['chat_history'] == EXCHANGE
+    assert session_store.load_session('s1', history_limit=1, folder=folder)['chat_history'] == EXCHANGE[1:]
+
+def test_torn_line_is_skipped_on_read(folder):
+    session_store.append_messages('s1', EXCHANGE, folder)
+    _tear(folder, 's1')
+    assert session_store.load_session('s1', folder=folder)['chat_history'] == EXCHANGE
+    assert session_store.recent_messages('s1', 5, folder) == EXCHANGE
+
+def test_append_after_tear_compacts_log(folder):
+    session_store.append_messages('s1', EXCHANGE, folder)
+    _tear(folder, 's1')
+    count = session_store.append_messages('s1', EXCHANGE, folder)
+    with open(_log_path(folder, 's1')) as f:
+        lines = f.read().splitlines()
+    assert count == len(lines) == 4
+    assert all(json.loads(line) for line in lines)
+    meta = session_store.load_session_meta('s1', folder)
+    assert meta['message_count'] == 4
+    assert meta['compacted_size'] == os.path.getsize(_log_path(folder, 's1'))
+
+def test_compact_session_resyncs_count(folder):
+    session_store.append_messages('s1', EXCHANGE, folder)
+    _tear(folder, 's1')
+    assert session_store.compact_session('s1', folder) == 2
+    assert session_store.load_session_meta('s1', folder)['message_count'] == 2
+
+def test_log_compacts_when_grown_by_threshold(folder, monkeypatch):
+    monkeypatch.setattr(session_store, 'SESSION_COMPACT_BYTES', 512)
+    for _ in range(20):
+        session_store.append_messages('s1', EXCHANGE, folder)
+    meta = session_store.load_session_meta('s1', folder)
+    assert meta['compacted_size']
+    assert os.path.getsize(_log_path(folder, 's1')) - meta['compacted_size'] < 512
+    assert meta['message_count'] == 40
+
+def test_legacy_session_is_migrated(folder):
+    os.makedirs(folder)
+    legacy = {'session_name': 'Old', 'chat_history': EXCHANGE, 'indexed_files': ['a.pdf']}
+    with open(os.path.join(folder, 's1.json'), 'w') as f:
+        json.dump(legacy, f)
+    session = session_store.load_session('s1', folder=folder)
+    assert session == legacy
+    assert not os.path.exists(os.path.join(folder, 's1.json'))
+    assert session_store.load_session_meta('s1', folder)['message_count'] == 2